@@ -0,0 +1,543 @@
+# -*- coding: utf-8 -*-
+'''
+This module contains benchmarks for the cpap_extraction module. Each benchmark
+writes synthetic data files to a temporary directory, and times how long
+cpap_extraction takes to process them.
+
+Example
+-------
+    $ python benchmark_cpap_extraction.py suite --json results.json
+
+Generates synthetic .001, .002 and .005 session files, times each stage of
+the extraction pipeline on them, separately and end to end, and records the
+results in results.json so they can be compared between runs.
+
+    $ python benchmark_cpap_extraction.py read_packets --sizes 1 16 256 1024
+
+Times splitting synthetic 1 MB, 16 MB, 256 MB and 1 GB data files into
+packets, using both read_packets and the original byte-at-a-time read_packet.
+
+    $ python benchmark_cpap_extraction.py extract_packet --packets 1000000
+
+Times extracting a million header packets, using both extract_packet and the
+original field-at-a-time extract_packet.
+
+Attributes
+----------
+DELIMETER : bytes
+    The packet delimeter used in the synthetic data files
+
+MEGABYTE : int
+    The number of bytes in a megabyte
+
+FILE_TYPES : dictionary {string: int}
+    The File type data of the header of each type of synthetic session file
+'''
+import argparse                 # For command line arguments
+import binascii                 # For the CRC of synthetic session files
+import json                     # For recording results
+import os                       # For file IO
+import platform                 # For recording where results came from
+import random                   # For synthetic data
+import struct                   # For packing synthetic packets
+import tempfile                 # For writing synthetic data files
+import time                     # For timing
+import warnings                 # For raising warnings
+import cpap_extraction          # The module to be benchmarked
+import summary                  # For the summary stage
+
+
+def legacy_read_packet(input_file, delimeter):
+    '''
+    The original, byte-at-a-time, read_packet. Kept here only so it can be
+    compared to cpap_extraction.read_packets
+    '''
+    packet = b''
+    if delimeter == b'':
+        warnings.warn('WARNING: Delimeter is empty')
+        first_byte_of_delimeter = b''
+    else:
+        first_byte_of_delimeter = delimeter[0].to_bytes(1, 'little')
+
+    while True:
+        byte = input_file.read(1)
+        if byte == first_byte_of_delimeter:
+            input_file.seek(-1, 1)
+            if input_file.read(len(delimeter)) == delimeter:
+                break
+        elif byte == b'':
+            break
+
+        packet += byte
+
+    return bytearray(packet)
+
+
+def legacy_read_packets(input_file, delimeter):
+    '''
+    The original read_packets, built on legacy_read_packet
+    '''
+    packet_array = []
+    while True:
+        packet = legacy_read_packet(input_file, delimeter)
+        if packet == b'':
+            break
+        packet_array.append(packet)
+
+    return packet_array
+
+
+def legacy_extract_packet(packet, fields):
+    '''
+    The original extract_packet, which unpacks one field at a time and
+    deletes each field from packet once it is unpacked. Kept here only so it
+    can be compared to cpap_extraction.extract_packet
+    '''
+    data = []
+
+    for field in fields:
+        c_type = fields.get(field)
+        number_of_bytes = cpap_extraction.C_TYPES.get(c_type)
+        bytes_to_be_extracted = packet[:number_of_bytes]
+        del packet[:number_of_bytes]
+
+        c_type = '<' + c_type
+        (extracted_line,) = struct.unpack(c_type, bytes_to_be_extracted)
+        data.append('{}: {}\n'.format(field, extracted_line))
+
+    return data
+
+
+def make_data_file(path, size, packet_size=4096):
+    '''
+    Writes a synthetic data file of size bytes to path. The file is made of
+    packets of packet_size random bytes, separated by DELIMETER. The random
+    bytes never contain \\xff, so the only delimeters in the file are the
+    ones between packets.
+
+    Parameters
+    ----------
+    path : Path
+        Where to write the data file
+
+    size : int
+        The size of the data file, in bytes
+
+    packet_size : int
+        The size of each packet, not counting its delimeter
+    '''
+    packet = os.urandom(packet_size).replace(b'\xff', b'\xfe') + DELIMETER
+    chunk = packet * max(1, MEGABYTE // len(packet))
+
+    with open(path, 'wb') as data_file:
+        written = 0
+        while written + len(chunk) <= size:
+            data_file.write(chunk)
+            written += len(chunk)
+        data_file.write(chunk[:size - written])
+
+
+def time_splitter(splitter, path):
+    '''
+    Times how long splitter takes to split the data file at path into
+    packets
+
+    Returns
+    -------
+    (seconds, packets) : (float, int)
+        How long splitter took, and how many packets it returned
+    '''
+    with open(path, 'rb') as data_file:
+        start = time.perf_counter()
+        packets = splitter(data_file, DELIMETER)
+        seconds = time.perf_counter() - start
+
+    return seconds, len(packets)
+
+
+def benchmark_read_packets(sizes, legacy_limit):
+    '''
+    Times read_packets and legacy_read_packets on data files of each size in
+    sizes (in megabytes). legacy_read_packets is only timed on files up to
+    legacy_limit megabytes, because it is far too slow for larger files.
+    '''
+    print('{:>10} {:>10} {:>14} {:>14} {:>10}'.format(
+        'Size (MB)', 'Packets', 'read_packets', 'legacy', 'Speedup'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, '{}MB.005'.format(size))
+            make_data_file(path, size * MEGABYTE)
+
+            seconds, packets = time_splitter(cpap_extraction.read_packets,
+                                             path)
+            if size <= legacy_limit:
+                legacy_seconds, _ = time_splitter(legacy_read_packets, path)
+                legacy = '{:.3f} s'.format(legacy_seconds)
+                speedup = '{:.0f}x'.format(legacy_seconds / seconds)
+            else:
+                legacy = 'skipped'
+                speedup = '-'
+
+            print('{:>10} {:>10} {:>14} {:>14} {:>10}'.format(
+                size, packets, '{:.3f} s'.format(seconds), legacy, speedup))
+            os.remove(path)
+
+
+def benchmark_extract_packet(count):
+    '''
+    Times extract_packet and legacy_extract_packet on count header packets.
+    legacy_extract_packet consumes the packets it extracts, so it is given a
+    fresh copy of each packet, just as read_packets used to give it.
+
+    unpack_fields is timed too, as most of extract_packet's time is now spent
+    formatting the extracted strings rather than decoding the packet.
+    '''
+    fields = cpap_extraction.HEADER_FIELDS
+    packet = struct.pack('<IHHIIQQHHIHH', 3341948587, 10, 1, 1332405373,
+                         1553245673, 1553245673000, 1553258852000, 0, 2,
+                         46106, 0, 4)
+    packets = [packet] * count
+
+    assert (cpap_extraction.extract_packet(packet, fields) ==
+            legacy_extract_packet(bytearray(packet), fields))
+
+    start = time.perf_counter()
+    for packet in packets:
+        cpap_extraction.extract_packet(packet, fields)
+    seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for packet in packets:
+        cpap_extraction.unpack_fields(packet, fields)
+    unpack_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for packet in packets:
+        legacy_extract_packet(bytearray(packet), fields)
+    legacy_seconds = time.perf_counter() - start
+
+    print('{:>10} {:>16} {:>14} {:>14} {:>10}'.format(
+        'Packets', 'extract_packet', 'unpack_fields', 'legacy', 'Speedup'))
+    print('{:>10} {:>16} {:>14} {:>14} {:>10}'.format(
+        count, '{:.3f} s'.format(seconds),
+        '{:.3f} s'.format(unpack_seconds), '{:.3f} s'.format(legacy_seconds),
+        '{:.1f}x'.format(legacy_seconds / seconds)))
+
+
+def make_header(file_type, start_time, end_time, data_size, crc=0):
+    '''
+    Packs a header packet for a synthetic session file
+    '''
+    return struct.pack('<IHHIIQQHHIHH', 3341948587, 10, file_type, 1332405373,
+                       start_time // 1000, start_time, end_time, 0, 2,
+                       data_size, crc, 4)
+
+
+def make_session_file(path, packets, samples, start_time=1553245673000):
+    '''
+    Writes a synthetic PRS1 session file to path. The type of file is taken
+    from the extension of path. The file starts with a header packet, which
+    is followed by packets of samples, laid out according to the fields of
+    the file type's parser, see cpap_extraction.find_parser. File types
+    without a known sample layout get packets of samples random bytes. No
+    sample ever contains \xff, so the only delimeters in the file are the
+    ones between packets. The header's CRC matches the packets, see
+    cpap_extraction.verify_file.
+
+    Parameters
+    ----------
+    path : Path
+        Where to write the session file, e.g., 38611.005
+
+    packets : int
+        How many packets follow the header
+
+    samples : int
+        How many samples each packet holds
+
+    start_time : int (optional)
+        The start time of the session, in milliseconds. Each packet covers one
+        second of samples
+
+    Returns
+    -------
+    size : int
+        The size of the session file, in bytes
+    '''
+    extension = os.path.splitext(path)[1]
+    fields = cpap_extraction.find_parser(extension).fields
+    sample_size = 1
+    if fields is not None:
+        sample_size = cpap_extraction.compile_fields(fields).size
+
+    generator = random.Random(packets * samples)
+    body = bytes(generator.randrange(255)
+                 for _ in range(sample_size * samples * min(packets, 64)))
+    packet_size = sample_size * samples
+
+    header_fields = (FILE_TYPES.get(extension, 0), start_time,
+                     start_time + packets * 1000,
+                     packets * (packet_size + len(DELIMETER)))
+
+    crc = cpap_extraction.CRC_INITIAL
+    with open(path, 'wb') as session_file:
+        session_file.write(make_header(*header_fields))
+        for packet in range(packets):
+            start = (packet % 64) * packet_size
+            session_file.write(DELIMETER)
+            session_file.write(body[start:start + packet_size])
+
+            # The CRC covers everything after the header packet's delimeter
+            if packet > 0:
+                crc = binascii.crc_hqx(DELIMETER, crc)
+            crc = binascii.crc_hqx(body[start:start + packet_size], crc)
+
+        session_file.seek(0)
+        session_file.write(make_header(*header_fields, crc=crc))
+
+    return os.path.getsize(path)
+
+
+def time_function(function, repeat):
+    '''
+    Calls function repeat times, and returns the fastest and mean time, in
+    seconds
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times), sum(times) / len(times)
+
+
+def suite_stages(path, destination):
+    '''
+    Returns the stages of the extraction pipeline to be timed on the session
+    file at path, each as a (name, function) pair. Each function runs its
+    stage from scratch, over the whole file, so it can be called repeatedly.
+    '''
+    extension = os.path.splitext(path)[1]
+    fields = cpap_extraction.find_parser(extension).fields
+
+    with open(path, 'rb') as session_file:
+        packets = cpap_extraction.read_packets(session_file, DELIMETER)
+    header_packet = packets[0]
+    header = cpap_extraction.extract_header(header_packet)
+    times = [cpap_extraction.decode_header(header_packet).start_time +
+             1000 * second for second in range(len(packets))]
+
+    def read_packet():
+        with open(path, 'rb') as session_file:
+            while cpap_extraction.read_packet(session_file, DELIMETER):
+                pass
+
+    def read_packets():
+        with open(path, 'rb') as session_file:
+            cpap_extraction.read_packets(session_file, DELIMETER)
+
+    def resync_packets():
+        with open(path, 'rb') as session_file:
+            for _ in cpap_extraction.resync_packets(session_file, path,
+                                                    DELIMETER):
+                pass
+
+    def extract_packet():
+        # Every sample of every packet, one at a time, or, for file types
+        # without samples, the header once per packet
+        if fields is None:
+            for _ in packets:
+                cpap_extraction.extract_packet(header_packet,
+                                               cpap_extraction.HEADER_FIELDS)
+            return
+
+        sample_size = cpap_extraction.compile_fields(fields).size
+        for packet in packets[1:]:
+            for offset in range(0, len(packet) - sample_size + 1,
+                                sample_size):
+                cpap_extraction.extract_packet(packet, fields, offset)
+
+    def extract_header():
+        cpap_extraction.extract_header(header_packet)
+
+    def convert_unix_time():
+        for unixtime in times:
+            cpap_extraction.convert_unix_time(unixtime)
+
+    def convert_unix_times():
+        cpap_extraction.convert_unix_times(times)
+
+    def write_file():
+        cpap_extraction.write_file(header, destination, 'header')
+
+    def decode_samples():
+        cpap_extraction.decode_samples(packets[1:], fields)
+
+    def summarize_file():
+        summary.summarize_file(path)
+
+    def decimate():
+        samples = cpap_extraction.decode_samples(packets[1:], fields)
+        times = cpap_extraction.sample_times(0, 3600000, len(samples))
+        cpap_extraction.decimate(times, samples, 1000)
+
+    def build_index():
+        cpap_extraction.PacketIndex.build(path)
+
+    index = cpap_extraction.PacketIndex.build(path)
+    middle = (index.starts[0] + index.ends[0]) // 2
+
+    def packets_between():
+        # A tenth of the session, read through the index
+        for _ in index.packets_between(middle,
+                                       middle + (index.ends[0] -
+                                                 index.starts[0]) // 10):
+            pass
+
+    def verify_file():
+        cpap_extraction.verify_file(path)
+
+    def end_to_end_crc():
+        cpap_extraction.Extractor(destination=destination,
+                                  check_crc=True).extract_file(path)
+
+    def end_to_end():
+        cpap_extraction.extract_file(path, destination)
+
+    stages = [('read_packet', read_packet),
+              ('read_packets', read_packets),
+              ('resync_packets', resync_packets),
+              ('extract_packet', extract_packet),
+              ('extract_header', extract_header),
+              ('convert_unix_time', convert_unix_time),
+              ('convert_unix_times', convert_unix_times),
+              ('write_file', write_file)]
+    if fields is not None:
+        stages += [('decode_samples', decode_samples),
+                   ('decimate', decimate),
+                   ('summarize_file', summarize_file)]
+    stages += [('build_index', build_index),
+               ('packets_between', packets_between)]
+    stages += [('verify_file', verify_file),
+               ('end_to_end', end_to_end),
+               ('end_to_end_crc', end_to_end_crc)]
+
+    return stages
+
+
+def benchmark_suite(packets, samples, repeat, extensions):
+    '''
+    Times each stage of the extraction pipeline, see suite_stages, on a
+    synthetic session file of each type in extensions.
+
+    Parameters
+    ----------
+    packets, samples : int
+        The number of packets in each session file, and of samples in each
+        packet, see make_session_file
+
+    repeat : int
+        How many times to time each stage
+
+    extensions : String array
+        The types of session file to generate, e.g., ['.001', '.005']
+
+    Returns
+    -------
+    results : Array <Dictionary>
+        One result per stage and file type, holding the fastest and mean
+        time, in seconds, and the throughput, in MB/s, of the fastest time
+    '''
+    results = []
+    print('{:>6} {:>18} {:>12} {:>12} {:>10}'.format(
+        'File', 'Stage', 'Best', 'Mean', 'MB/s'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in extensions:
+            path = os.path.join(directory, '38611' + extension)
+            size = make_session_file(path, packets, samples)
+
+            for name, function in suite_stages(path, directory):
+                best, mean = time_function(function, repeat)
+                results.append({'benchmark': name,
+                                'file type': extension,
+                                'size': size,
+                                'packets': packets,
+                                'samples': samples,
+                                'repeat': repeat,
+                                'best': best,
+                                'mean': mean,
+                                'throughput': size / MEGABYTE / best})
+                print('{:>6} {:>18} {:>10.4f} s {:>10.4f} s {:>10.1f}'.format(
+                    extension, name, best, mean, size / MEGABYTE / best))
+
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+
+    return results
+
+
+def save_results(results, path):
+    '''
+    Saves the results of benchmark_suite to path as JSON, along with where
+    they came from, so they can be compared against later runs
+    '''
+    with open(path, 'w') as results_file:
+        json.dump({'time': time.strftime('%Y-%m-%d_%H-%M-%S'),
+                   'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'parser version': cpap_extraction.PARSER_VERSION,
+                   'results': results}, results_file, indent=1)
+
+
+# Global variables
+DELIMETER = b'\xff\xff\xff\xff'
+MEGABYTE = 1 << 20
+FILE_TYPES = {'.001': 1, '.002': 2, '.004': 4, '.005': 5}
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='CPAP_data_extraction '
+                                                 'benchmarks')
+    PARSER.add_argument('benchmarks', nargs='*',
+                        choices=['suite', 'read_packets', 'extract_packet'],
+                        default='suite',
+                        help='which benchmarks to run (default: suite)')
+    PARSER.add_argument('--sizes', nargs='+', type=int,
+                        default=[1, 16, 256, 1024],
+                        help='sizes of the synthetic data files, in MB')
+    PARSER.add_argument('--legacy-limit', type=int, default=4,
+                        help='largest size, in MB, to time the original '
+                             'read_packet on')
+    PARSER.add_argument('--packets', type=int, default=1000000,
+                        help='how many packets to extract')
+    PARSER.add_argument('--session-packets', type=int, default=10000,
+                        help='how many packets each synthetic session file '
+                             'of the suite holds')
+    PARSER.add_argument('--samples', type=int, default=25,
+                        help='how many samples each packet of the suite '
+                             'holds')
+    PARSER.add_argument('--repeat', type=int, default=3,
+                        help='how many times to time each stage of the suite')
+    PARSER.add_argument('--file-types', nargs='+',
+                        default=['.001', '.002', '.005'],
+                        help='the types of session file the suite generates')
+    PARSER.add_argument('--json', default=None,
+                        help='file to record the suite results in')
+    ARGS = PARSER.parse_args()
+    if isinstance(ARGS.benchmarks, str):
+        # The default is checked against the choices as a single value
+        ARGS.benchmarks = [ARGS.benchmarks]
+
+    if 'suite' in ARGS.benchmarks:
+        RESULTS = benchmark_suite(ARGS.session_packets, ARGS.samples,
+                                  ARGS.repeat, ARGS.file_types)
+        if ARGS.json is not None:
+            save_results(RESULTS, ARGS.json)
+
+    if 'read_packets' in ARGS.benchmarks:
+        benchmark_read_packets(ARGS.sizes, ARGS.legacy_limit)
+    if 'extract_packet' in ARGS.benchmarks:
+        benchmark_extract_packet(ARGS.packets)
@@ -5,10 +5,22 @@ output.
 
 Example
 -------
-    $ python cpap_extraction.py 38611.000 .
+    $ python cpap_extraction.py 38611.005 --format json
 
-Extracts the raw CPAP data from 38611.000 to a new file called
-38611_extracted.JSON
+Extracts the raw CPAP data from 38611.005 to a new file called
+<start time>.005.json, e.g., 2019-03-22_09-07-53.005.json
+
+A PacketIndex records where each packet of a session file is, so a single
+packet, or the packets of a stretch of time, can be read on their own.
+query_profile uses the headers and indexes of a whole profile to decode only
+the samples between two times, e.g.,
+
+    $ python cpap_extraction.py profile --between 2019-03-22T02:00 \\
+          2019-03-22T03:00
+
+An Extractor runs the whole pipeline with its own configuration and state,
+so several can run at once, e.g., in threads. The module functions, such as
+extract_file, use an Extractor configured by the globals below.
 
 Attributes
 ----------
@@ -22,15 +34,126 @@ C_TYPES : dictionary {char: int}
     A dictionary containing the relavent number of bytes for each C Type.
     See https://docs.python.org/3/library/struct.html
 
+HEADER_FIELDS : dictionary {string: char}
+    The name and C Type of each field in a header packet
+
+EVENT_FIELDS, WAVEFORM_FIELDS : dictionary {string: char}
+    The name and C Type of each field in a sample of a .002 event packet, and
+    of a .005 waveform packet
+
+Header, Event : Record
+    The typed records of header packets, and of the samples of event packets
+
+PARSERS : dictionary {tuple: FileParser}
+    The parser of each type of session file, by extension, File type data
+    and File version, see find_parser
+
+LAYOUTS : dictionary {tuple: struct.Struct}
+    A cache of the compiled struct layout of each dictionary of fields
+
+NUMPY_TYPES : dictionary {char: string}
+    The little endian NumPy type matching each C Type
+
+DTYPES : dictionary {tuple: numpy.dtype}
+    A cache of the NumPy structured dtype of each dictionary of fields
+
 VERBOSE : bool
     If True, be VERBOSE
+
+MMAP : bool
+    If True, memory-map SOURCE instead of reading it into memory
+
+WORKERS : int
+    How many processes to extract a profile directory with, None for one per
+    CPU
+
+INCREMENTAL : bool
+    If True, skip profile sessions that are unchanged since the last run, see
+    load_manifest
+
+REBUILD : bool
+    If True, ignore the manifest of the last run, and extract every session
+
+OUTPUT_FORMAT : string
+    The format of the extracted files, 'txt', one of COLUMNAR_FORMATS or
+    JSON_FORMATS, or SQLITE_FORMAT
+
+PROFILE : bool
+    If True, collect instrumentation counters and histograms, and print a
+    summary of the run
+
+PROFILE_DUMP : path
+    If set, the run is also profiled with cProfile, and its pstats are dumped
+    to this file
+
+ARCHIVE_EXTENSIONS : tuple
+    The extensions of archived copies of session files, e.g., 38611.005.gz,
+    which are read directly, see open_stream
+
+DECOMPRESSORS : dictionary {int: function}
+    The decompressor of each value of the header's Compression field, see
+    split_session
+
+INDEX_EXTENSION : string
+    The extension of PacketIndex sidecar files, e.g., 38611.005.<hash>.idx
+
+INDEX_DIR : path
+    The directory PacketIndex sidecar files are kept in, defaults to
+    INDEX_DIRECTORY in DESTINATION, see index_sidecar
+
+BLOCK_SIZE : int
+    How many bytes are read from a data file at a time when splitting it into
+    packets
+
+WRITE_BUFFER_SIZE : int
+    How many bytes of output a SessionWriter buffers before writing to disk
+
+BETWEEN : (int, int)
+    If set, the samples between these UNIX times, in milliseconds, are
+    written out instead of extracting SOURCE, see query_profile
+
+CHECK_CRC : bool
+    If True, verify each session file before extracting it, see verify_file
+
+VERIFY : bool
+    If True, only verify SOURCE instead of extracting it, see verify_profile
+
+RESYNC : bool
+    If True, skip malformed packets instead of failing, see resync_packets
+
+RESOLUTION : int
+    If set, decimate the waveform samples of the columnar and SQLite formats,
+    and of BETWEEN, to one bucket per RESOLUTION milliseconds, see decimate.
+    Events are never decimated
+
+DECIMATION : string
+    How samples are decimated, one of DECIMATIONS
 '''
 import argparse                 # For command line arguments
+import binascii                 # For verifying CRCs
+from array import array         # For packet indexes
+import bisect                   # For finding packets by time
+import functools                # For caching formatted times
+import gzip                     # For reading .gz archived session files
+from collections import namedtuple  # For typed packet records
+import hashlib                  # For fingerprinting session files
+import json                     # For the manifest of extracted files
+from concurrent.futures import ProcessPoolExecutor, as_completed  # Profiles
+import mmap                     # For memory-mapping large files
 import os                       # For file IO
 import struct                   # For unpacking binary data
-from datetime import datetime   # For converting UNIX time
+from datetime import datetime, timedelta  # For converting UNIX time
 import warnings                 # For raising warnings
+import cProfile                 # For --profile-dump
+import time                     # For timing --profile runs
+import instrumentation          # For --profile counters and histograms
 import re                       # For ripping unixtimes out of strings
+import shutil                   # For copying outputs that are appended to
+import sqlite3                  # For the SQLite store of sessions
+import sys                      # For the byte order of packet indexes
+import tempfile                 # For the temporary files of outputs
+import threading                # For serialising appends to an output
+import zlib                     # For decompressing compressed sessions
 
 
 def setup_args():
@@ -40,7 +163,9 @@ def setup_args():
     Attributes
     ----------
     SOURCE : path
-        The SOURCE data file(s) to be extracted
+        The SOURCE data file(s) to be extracted. If SOURCE is a directory,
+        such as a SleepyHead Profiles/<name>/PRS1_* directory, every session
+        file in it is extracted
 
     DESTINATION : path (optional)
         The directory to place the extracted files
@@ -58,6 +183,21 @@ def setup_args():
     global DESTINATION
     global VERBOSE
     global DEBUG
+    global MMAP
+    global WORKERS
+    global INCREMENTAL
+    global REBUILD
+    global OUTPUT_FORMAT
+    global PROFILE
+    global PROFILE_DUMP
+    global WRITE_BUFFER_SIZE
+    global BETWEEN
+    global CHECK_CRC
+    global VERIFY
+    global RESYNC
+    global RESOLUTION
+    global DECIMATION
+    global INDEX_DIR
 
     parser = argparse.ArgumentParser(description='CPAP_data_extraction')
     parser.add_argument('source', nargs=1, help='path to CPAP data')
@@ -65,12 +205,83 @@ def setup_args():
                         help='path to place extracted files')
     parser.add_argument('-v', action='store_true', help='be VERBOSE')
     parser.add_argument('-d', action='store_true', help='debug mode')
+    parser.add_argument('--mmap', action='store_true',
+                        help='memory-map the source instead of reading it')
+    parser.add_argument('--format', default='txt',
+                        choices=(['txt'] + list(COLUMNAR_FORMATS) +
+                                 list(JSON_FORMATS) + [SQLITE_FORMAT]),
+                        help='format of the extracted files')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes to extract a profile '
+                             'directory with (default: one per CPU)')
+    parser.add_argument('--buffer-size', type=int, default=WRITE_BUFFER_SIZE,
+                        help='how many bytes of output to buffer before '
+                             'writing to disk')
+    parser.add_argument('--profile', action='store_true',
+                        help='count bytes read, packets split, fields '
+                             'decoded and write latency, and print a summary')
+    parser.add_argument('--profile-dump', default=None,
+                        help='with --profile, also run under cProfile and '
+                             'dump the pstats to this file')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip profile sessions that are unchanged since '
+                             'they were last extracted')
+    parser.add_argument('--between', nargs=2, type=parse_time, default=None,
+                        metavar=('START', 'END'),
+                        help='instead of extracting, write out the samples '
+                             'between two UTC times, e.g., '
+                             '2019-03-22T02:00 2019-03-22T03:00')
+    parser.add_argument('--check-crc', action='store_true',
+                        help='verify the CRC of each session file, and skip '
+                             'the corrupt ones')
+    parser.add_argument('--verify', action='store_true',
+                        help='instead of extracting, only verify the CRC of '
+                             'each session file')
+    parser.add_argument('--resync', action='store_true',
+                        help='skip malformed packets, and carry on from the '
+                             'next header, instead of failing')
+    parser.add_argument('--resolution', type=int, default=None,
+                        metavar='MS',
+                        help='decimate the waveforms of the columnar and '
+                             'sqlite formats, or of --between, to one bucket '
+                             'per MS milliseconds, events are kept whole')
+    parser.add_argument('--decimation', default=DECIMATIONS[0],
+                        choices=DECIMATIONS,
+                        help='with --resolution, keep the minimum and '
+                             'maximum, or the mean, of each bucket')
+    parser.add_argument('--index-dir', default=None,
+                        help='directory to keep the packet indexes of '
+                             '--between in (default: {} in the '
+                             'destination)'.format(INDEX_DIRECTORY))
+    parser.add_argument('--rebuild', action='store_true',
+                        help='with --incremental, forget what was extracted '
+                             'before and extract every session')
 
     args = parser.parse_args()
     (SOURCE,) = args.source
     (DESTINATION,) = args.destination
     VERBOSE = args.v
     DEBUG = args.d
+    MMAP = args.mmap
+    WORKERS = args.workers
+    INCREMENTAL = args.incremental
+    REBUILD = args.rebuild
+    OUTPUT_FORMAT = args.format
+    PROFILE = args.profile
+    PROFILE_DUMP = args.profile_dump
+    WRITE_BUFFER_SIZE = args.buffer_size
+    BETWEEN = args.between
+    CHECK_CRC = args.check_crc
+    VERIFY = args.verify
+    RESYNC = args.resync
+    RESOLUTION = args.resolution
+    DECIMATION = args.decimation
+    INDEX_DIR = args.index_dir
+
+    if (RESOLUTION is not None and BETWEEN is None and
+            OUTPUT_FORMAT not in COLUMNAR_FORMATS + (SQLITE_FORMAT,)):
+        parser.error('--resolution needs a columnar or sqlite --format, or '
+                     '--between')
 
 
 def open_file(source):
@@ -93,32 +304,55 @@ def open_file(source):
     Returns
     -------
     File : The read-in file
+
+    Notes
+    ------
+    A thin wrapper of Extractor.open_file, configured by the module globals
     '''
+    return global_extractor().open_file(source)
 
-    if VERBOSE:
-        print('Reading in {}'.format(source))
 
-    if not os.path.isfile(source):
-        raise FileNotFoundError(
-            'ERROR: source file {} not found!'.format(SOURCE))
+def open_mapped_file(source):
+    '''
+    Memory-maps a SOURCE from the users' drive, read-only. Unlike open_file,
+    nothing is read into memory up front, the operating system pages the
+    file in as it is accessed, so resident memory stays flat no matter how
+    big the file is.
+
+    Parameters
+    ----------
+    source : Path
+        The file to be mapped
+
+    Returns
+    -------
+    mmap : The mapped file. Any memoryviews into it, such as the packets
+           returned by read_mapped_packets, must be released before it is
+           closed
 
-    opened_file = open(source, 'rb')
-    return opened_file
+    Notes
+    ------
+    Empty files cannot be memory-mapped, a ValueError is raised for them
+
+    A thin wrapper of Extractor.open_mapped_file, configured by the module
+    globals
+    '''
+    return global_extractor().open_mapped_file(source)
 
 
-def read_packet(input_file, delimeter):
+def read_packet(input_file, delimeter, block_size=None):
     '''
     Packets are sepearted using a delimeter, the .001 files, for example, use
-    \xff\xff\xff\xff as their delimeter. This packet reads and returns all data
-    stored in input_file up to delimeter. The data are stored with varrying
-    length, some data fields are a single byte, some are 16 bytes. Because of
-    this, even if we know the delimeter is four bytes, we cannot read the data
-    file four bytes at a time. We must instead read one byte at a time. Once
-    each byte is read in, this method checks if that byte is the first part of
-    the delimeter. If it isn't, the byte is appended to packet. If it is, this
-    method seeks back one byte, then checks if the next bytes match the
-    delimeter, if they do, the packet is completely read, so this method
-    returns. TODO: Make this explanation less terrible.
+    \xff\xff\xff\xff as their delimeter. This method reads and returns all
+    data stored in input_file up to delimeter, and leaves the seek point of
+    input_file at the beginning of the next packet.
+
+    Rather than reading one byte at a time, input_file is read in blocks of
+    block_size bytes, and each block is searched for the delimeter with
+    bytearray.find(). A delimeter may straddle two blocks, so the search of
+    each new block starts len(delimeter) - 1 bytes before its beginning. Once
+    the delimeter is found, the bytes read past it are given back by seeking
+    input_file backwards.
 
     Parameters
     ----------
@@ -130,43 +364,149 @@ def read_packet(input_file, delimeter):
         The 'separator' of the packets in input_file. For .001 files, the
         delimeter is b'\xff\xff\xff\xff'
 
+    block_size : int (optional)
+        How many bytes to read from input_file at a time, defaults to
+        BLOCK_SIZE
+
     Attributes
     ----------
-    packet : bytes
+    packet : bytearray
         The complete packet of bytes to be returned
 
-    byte : bytes
-        A single byte of data. If this byte isn't part of the delimeter, it
-        gets appended to packet
+    block : bytes
+        A block of data read from input_file, appended to packet
+
+    Returns
+    -------
+    packet : bytearray
+        The packet, an empty bytearray if input_file has no data left
     '''
     if not isinstance(delimeter, bytes):
         raise TypeError('Delimeter {} is invalid, it must be of type bytes')
 
-    packet = b''
     if delimeter == b'':
         warnings.warn('WARNING: Delimeter is empty')
-        first_byte_of_delimeter = b''
-    else:
-        first_byte_of_delimeter = delimeter[0].to_bytes(1, 'little')
+        return bytearray(input_file.read())
 
+    if block_size is None:
+        block_size = BLOCK_SIZE
+
+    packet = bytearray()
     while True:
-        byte = input_file.read(1)
-        if byte == first_byte_of_delimeter:
-            input_file.seek(-1, 1)
-            if input_file.read(len(delimeter)) == delimeter:
-                break
-        elif byte == b'':
+        search_start = max(0, len(packet) - len(delimeter) + 1)
+        block = input_file.read(block_size)
+        if block == b'':
             break
+        if instrumentation.ENABLED:
+            instrumentation.count('bytes read', len(block))
+
+        packet += block
+        end = packet.find(delimeter, search_start)
+        if end != -1:
+            # Give back everything read past the delimeter
+            input_file.seek(end + len(delimeter) - len(packet), 1)
+            del packet[end:]
+            break
+
+    return packet
+
+
+def iter_packets(input_file, delimeter, block_size=None):
+    '''
+    Yields the packets found in input_file one at a time, as they are split.
+    Only one block of input_file, plus the packet that spans into it, is held
+    in memory at any time, so reading the first packet (e.g., the header)
+    costs a single block, no matter how long the file is.
+
+    Blocks of block_size bytes are read, every delimeter in a block is found
+    with bytearray.find(), and only the unfinished packet at the end of each
+    block is carried over to the next one.
+
+    Paramters
+    ---------
+    input_file : File
+        A file object created by read_file(), this object contains the data
+        packets to be read
 
-        packet += byte
+    delimeter : bytes
+        The 'separator' of the packets in input_file. For .001 files, the
+        delimeter is b'\xff\xff\xff\xff'
+
+    block_size : int (optional)
+        How many bytes to read from input_file at a time, defaults to
+        BLOCK_SIZE
+
+    Attributes
+    ----------
+    buffer : bytearray
+        The data read from input_file that has not been split into packets yet
+
+    search_start : int
+        Where to start searching buffer for the delimeter. Bytes before this
+        have already been searched, apart from the last len(delimeter) - 1
+        bytes of the previous block, which may hold the start of a delimeter
+
+    Yields
+    -------
+    packet : bytearray
+        The next packet in input_file
+
+    Notes
+    ------
+    Like read_packet, an empty packet (i.e., two delimeters in a row) marks
+    the end of the data, and no further packets are yielded
+    '''
+    if not isinstance(delimeter, bytes):
+        raise TypeError('Delimeter {} is invalid, it must be of type bytes')
 
-    return bytearray(packet)
+    if delimeter == b'':
+        packet = read_packet(input_file, delimeter)
+        if packet:
+            yield packet
+        return
+
+    if block_size is None:
+        block_size = BLOCK_SIZE
+
+    buffer = bytearray()
+    while True:
+        search_start = max(0, len(buffer) - len(delimeter) + 1)
+        block = input_file.read(block_size)
+        if block == b'':
+            if buffer:
+                if instrumentation.ENABLED:
+                    instrumentation.count('packets split')
+                yield buffer
+            return
+        if instrumentation.ENABLED:
+            instrumentation.count('bytes read', len(block))
+
+        buffer += block
+        start = 0
+        while True:
+            end = buffer.find(delimeter, max(start, search_start))
+            if end == -1:
+                break
+            if end == start:
+                return
+
+            if instrumentation.ENABLED:
+                instrumentation.count('packets split')
+            yield buffer[start:end]
+            start = end + len(delimeter)
+
+        del buffer[:start]
 
 
-def read_packets(input_file, delimeter):
+def read_packets(input_file, delimeter, block_size=None):
     '''
-    Using the read_packet method, returns all packet_array found in input_file
-    in an array of packet_array.
+    Returns all packets found in input_file in an array of packets. This
+    returns the same packets as calling read_packet until it returns an empty
+    packet, but the whole of input_file is split in a single pass by
+    iter_packets.
+
+    Prefer iter_packets when the packets can be processed one at a time, as
+    read_packets holds every packet in memory at once.
 
     Paramters
     ---------
@@ -178,268 +518,3412 @@ def read_packets(input_file, delimeter):
         The 'separator' of the packet_array in input_file. For .001 files, the
         delimeter is b'\xff\xff\xff\xff'
 
+    block_size : int (optional)
+        How many bytes to read from input_file at a time, defaults to
+        BLOCK_SIZE
+
     Attributes
     ----------
-    packet : bytes
-        The packet returned by read_packet
-
     packet_array : Array <packets>
         The packet array to be returned
     '''
-    packet_array = []
-    while True:
-        packet = read_packet(input_file, delimeter)
-        if packet == b'':
-            break
-        packet_array.append(packet)
-
+    packet_array = list(iter_packets(input_file, delimeter, block_size))
     return packet_array
 
 
-def extract_packet(packet, fields):
+def find_packets(buffer, delimeter):
     '''
-    Extracts packets into their specified fields
+    Finds the packets in buffer without copying them. This splits buffer
+    exactly like read_packets, but instead of the packets themselves, yields
+    where each packet is in buffer.
 
     Parameters
     ----------
-    packet : Bytes
-        The packet, created by read_packet() to be extracted
+    buffer : bytes, bytearray or mmap
+        The data to be split into packets
 
-    fields : The varying data fields that are expected to be found within
-             packet
+    delimeter : bytes
+        The 'separator' of the packets in buffer
 
-    Attributes
-    ----------
+    Yields
+    -------
+    (offset, length) : (int, int)
+        The position of a packet in buffer, and its length in bytes
+    '''
+    if not isinstance(delimeter, bytes):
+        raise TypeError('Delimeter {} is invalid, it must be of type bytes')
 
-    VERBOSE : bool
-        if True, print 'Extracting {field} from {SOURCE}
+    if delimeter == b'':
+        warnings.warn('WARNING: Delimeter is empty')
+        if len(buffer) > 0:
+            yield 0, len(buffer)
+        return
+
+    start = 0
+    while start < len(buffer):
+        end = buffer.find(delimeter, start)
+        if end == -1:
+            end = len(buffer)
+        if end == start:
+            return
+
+        if instrumentation.ENABLED:
+            instrumentation.count('packets split')
+            instrumentation.count('bytes read', end - start)
+        yield start, end - start
+        start = end + len(delimeter)
+
+
+def read_mapped_packets(mapping, delimeter):
+    '''
+    Yields each packet in mapping, a file mapped by open_mapped_file, as a
+    memoryview into the mapping. No packet is copied, so extract_packet and
+    extract_header read straight from the mapped file.
 
-    C_TYPES : dictionary {character: int}
-        The keys of this dictionary indicate a c_type, and the values indicate
-        the corresponding size of that c_type. For more info, see
-        https://docs.python.org/3/library/struct.html
+    Parameters
+    ----------
+    mapping : mmap
+        The mapped file, created by open_mapped_file()
 
-    data : String array
-        A String array to be populated with the various fields found in the
-        packet
+    delimeter : bytes
+        The 'separator' of the packets in mapping
 
-    field : {string: character}
-        Contains the name of the field (e.g., Start time, machine ID, etc.),
-        and the c_type of that field (e.g., H, I, L, etc.)
+    Yields
+    -------
+    packet : memoryview
+        A read-only view of the next packet in mapping
+    '''
+    view = memoryview(mapping)
+    try:
+        for offset, length in find_packets(mapping, delimeter):
+            yield view[offset:offset + length]
+    finally:
+        view.release()
 
-    number_of_bytes : int
-        The number of bytes used by the current field, determined by that
-        fields' c_type
 
-    bytes_to_be_extracted : Bytes array
-        The appropriate number of Bytes, taken from packet, to be unpacked
+def split_archive(source):
+    '''
+    Splits the extension of an archived copy, e.g., .gz, off source
 
-    extracted_line : String
-        The fully extracted line, ready to be appeneded to data.
-        Example: Start Time: 1553245673000
+    Returns
+    -------
+    (name, archive) : (Path, String)
+        e.g., ('38611.005', '.gz') for 38611.005.gz, or (source, '') if source
+        is not archived, see ARCHIVE_EXTENSIONS
+    '''
+    name, archive = os.path.splitext(source)
+    if archive in ARCHIVE_EXTENSIONS:
+        return name, archive
+    return source, ''
 
-    Notes
-    --------
-    Once the bytes from packet are correctly read and appended to data, they
-    are removed from packet. This is simply to make parsing the data cleaner
 
-    All the data are little endian, struct.unpack() expects a '<' before the
-    c_type to specifiy if the Bytes are little endian, which is why a '<' is
-    prepended to the c_type
+def session_extension(source):
+    '''
+    Returns the extension of session file source, e.g., '.005' for both
+    38611.005 and 38611.005.gz
+    '''
+    return os.path.splitext(split_archive(source)[0])[1]
 
-    struct.unpack() returns a tuple, using (extracted_line,) = struct.unpack()
-    automatically returns the unpacked tuple.
-    https://stackoverflow.com/questions/13894350/what-does-the-comma-mean-in-pythons-unpack#13894363
 
+def open_stream(source):
+    '''
+    Opens source for reading, decompressing archived copies, see
+    ARCHIVE_EXTENSIONS, as they are read, without a temporary file
 
     Returns
     -------
-    data : String array
-        The extracted data
+    opened_file : File
+        A binary file object. Archived copies can only be read forwards
     '''
+    archive = split_archive(source)[1]
+    if archive == '.gz':
+        return gzip.open(source, 'rb')
 
-    global C_TYPES
-    data = []
+    if archive == '.zst':
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(source, 'rb'),
+                                                          closefd=True)
 
-    for field in fields:
-        if VERBOSE:
-            print('Extracting {} from {}'.format(field, SOURCE))
+    return open(source, 'rb')
+
+
+class DecompressingReader(object):
+    '''
+    A read-only file object over the decompressed contents of another file
+    object. The compressed data is read and decompressed a chunk at a time,
+    and no more than a chunk of decompressed data is held at once, so
+    iter_packets can split a compressed stream without it ever being fully
+    inflated in memory.
 
-        c_type = fields.get(field)
-        number_of_bytes = C_TYPES.get(c_type)
-        bytes_to_be_extracted = packet[:number_of_bytes]
-        del packet[:number_of_bytes]
-        
-        if DEBUG:
-            print('Bytes in {}: {}'.format(field, bytes_to_be_extracted))
-            print('Remaining bytes in packet: {}'.format(packet))
+    Attributes
+    ----------
+    compressed : File
+        The file object the compressed data is read from
 
-        c_type = '<' + c_type
-        # https://stackoverflow.com/questions/13894350/what-does-the-comma-mean-in-pythons-unpack#13894363
-        (extracted_line,) = struct.unpack(c_type, bytes_to_be_extracted)
-        data.append('{}: {}\n'.format(field, extracted_line))
+    decompressor : zlib.Decompress
+        The decompressor of the data, e.g., zlib.decompressobj(), or None
+        if the data is not compressed
 
-    return data
+    prefix : bytes
+        Data read from compressed before it was handed over, e.g., while
+        reading the header, which is read before anything else
 
+    chunk_size : int
+        How many bytes are read, and decompressed, at a time
 
-def extract_header(packet):
+    buffer : bytearray
+        The decompressed data that has not been read yet
     '''
-    Uses extract_packet to extract the header information from a packet.
 
-    Attributes
+    def __init__(self, compressed, decompressor=None, prefix=b'',
+                 chunk_size=None):
+        self.compressed = compressed
+        self.decompressor = decompressor
+        self.prefix = prefix
+        self.chunk_size = chunk_size or BLOCK_SIZE
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, size=-1):
+        '''
+        Reads up to size decompressed bytes, or all that are left if size is
+        negative. Fewer bytes are only returned at the end of the data
+        '''
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            self.fill()
+
+        if size < 0 or size > len(self.buffer):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def fill(self):
+        '''
+        Decompresses the next chunk into buffer
+        '''
+        decompressor = self.decompressor
+        if decompressor is not None and decompressor.eof:
+            # Anything after the end of the compressed data is ignored
+            self.eof = True
+            return
+
+        if decompressor is not None and decompressor.unconsumed_tail:
+            chunk = decompressor.unconsumed_tail
+        elif self.prefix:
+            (chunk, self.prefix) = (self.prefix, b'')
+        else:
+            chunk = self.compressed.read(self.chunk_size)
+
+        if not chunk:
+            if decompressor is not None:
+                self.buffer += decompressor.flush()
+            self.eof = True
+            return
+
+        if decompressor is None:
+            self.buffer += chunk
+            return
+
+        data = decompressor.decompress(chunk, self.chunk_size)
+        if instrumentation.ENABLED:
+            instrumentation.count('bytes decompressed', len(data))
+        self.buffer += data
+
+    def close(self):
+        '''
+        Closes the compressed file object
+        '''
+        self.compressed.close()
+
+
+def split_session(data_file, source, delimeter=None, skipped=None):
+    '''
+    Reads the header of data_file, an opened session file, finds its parser,
+    and starts splitting data_file into packets. If the header's Compression
+    field is set, the packets after the header are decompressed as they are
+    split, see DECOMPRESSORS and DecompressingReader.
+
+    Parameters
     ----------
-    fields : Dictionary {Field name: c_type}
-        A dictionary containing the various fields found in a header packet,
-        along with their corresponding c_type, which determines the number of
-        bytes that fiels uses. See the C_TYPES dictionary.
+    data_file : File
+        The session file, opened by open_file, read from its start
+
+    source : Path
+        The path of the session file, see find_parser
+
+    delimeter : bytes (optional)
+        The packet delimeter, defaults to the delimeter of the parser
+
+    skipped : Array <(int, int)> (optional)
+        If given, the packets are split by resync_packets, which skips
+        malformed packets rather than stopping at them, and the byte ranges
+        it skips are appended to skipped
 
     Returns
-    --------
-    A method call to extract_packet, which itself will return a string array
+    -------
+    (header, parser, packets) : (Header, FileParser, generator)
+        The header of data_file, its parser, and its packets, the header
+        packet included, as iter_packets would yield them
+    '''
+    first = bytearray()
+    while len(first) < Header.layout.size:
+        block = data_file.read(BLOCK_SIZE)
+        if not block:
+            break
+        first += block
 
-    Notes
-    ------
-    Only use this method on packets that you're sure are header packets
+    resync = skipped is not None
+    if resync and not first.startswith(HEADER_MAGIC_BYTES):
+        # The header itself is damaged, so it is found by resync_packets
+        header = None
+    else:
+        header = decode_header(first)
+
+    if header is None or not header.compression:
+        if data_file.seekable():
+            data_file.seek(0)
+        else:
+            data_file = DecompressingReader(data_file, prefix=bytes(first))
+
+        if not resync:
+            parser = find_parser(source, header)
+            return header, parser, iter_packets(
+                data_file, delimeter or parser.delimeter)
+
+        packets = resync_packets(data_file, source, delimeter, skipped)
+        header_packet = next(packets, None)
+        if header_packet is None:
+            raise ValueError('ERROR: source file {} has no header'.format(
+                source))
+        header = decode_header(header_packet)
+        return header, find_parser(source, header), iter_compressed_packets(
+            header_packet, packets)
+
+    if header.compression not in DECOMPRESSORS:
+        raise ValueError('ERROR: {} uses an unknown compression {}'.format(
+            source, header.compression))
+
+    parser = find_parser(source, header)
+    delimeter = delimeter or parser.delimeter
+    end = find_header_end(data_file, first, delimeter)
+    if end == -1:
+        raise ValueError('ERROR: the header of {} is not followed by a '
+                         'delimeter'.format(source))
+
+    body = DecompressingReader(data_file,
+                               DECOMPRESSORS[header.compression](),
+                               bytes(first[end + len(delimeter):]))
+    if resync:
+        packets = resync_packets(body, source, delimeter, skipped, parser)
+    else:
+        packets = iter_packets(body, delimeter)
+    return header, parser, iter_compressed_packets(bytes(first[:end]),
+                                                   packets)
+
+
+def iter_compressed_packets(header_packet, packets):
     '''
-    global start_time
+    Yields header_packet, and then each of packets, e.g., the packets of a
+    DecompressingReader, see split_session
+    '''
+    yield header_packet
+    yield from packets
+
 
-    fields = {'Magic number': 'I',
-              'File version': 'H',
-              'File type data': 'H',
-              'Machine ID': 'I',
-              'Session ID': 'I',
-              'Start time': 'Q',
-              'End time': 'Q',
-              'Compression': 'H',
-              'Machine type': 'H',
-              'Data size': 'I',
-              'CRC': 'H',
-              'MCSize': 'H'}
+def resync_packets(input_file, source, delimeter=None, skipped=None,
+                   parser=None, block_size=None):
+    '''
+    Splits input_file into packets like iter_packets, but rather than
+    stopping at, or yielding, a malformed packet, skips it, and carries on
+    from the next delimeter. Every byte range skipped is recorded in skipped.
+
+    A packet is malformed if it comes before the first header, or if it
+    doesn't hold a whole number of samples of the parser of the last header.
+    A malformed packet that only starts with stray 0xff bytes, e.g., from a
+    delimeter that was written out too long, loses those bytes, otherwise
+    only that packet is skipped, so the well-framed packets after it are
+    kept. The framing is only lost before the first header, or where a
+    header has run into the packet before it, and only then is everything up
+    to the next HEADER_MAGIC skipped. Empty packets, i.e., runs of
+    delimeters, are passed over rather than ending the data.
 
-    header = extract_packet(packet, fields)
+    Parameters
+    ----------
+    input_file : File
+        The data to be split, read from its start
 
+    source : Path
+        The path of the session file, see find_parser
 
-    header[5] = convert_time_string(header[5])
-    header[6] = convert_time_string(header[6])
+    delimeter : bytes (optional)
+        The packet delimeter, defaults to the delimeter of source's parser
 
-    start_time = re.search('[^s \n]*$', header[5]).group()
+    skipped : Array <(int, int)> (optional)
+        The (start, end) byte offset, in input_file, of each range skipped is
+        appended to skipped
 
-    return header
+    parser : FileParser (optional)
+        If given, input_file starts after a header with this parser, e.g.,
+        the decompressed body of a compressed session
 
+    block_size : int (optional)
+        How many bytes to read from input_file at a time, defaults to
+        BLOCK_SIZE
 
-def separate_int(input_string):
+    Yields
+    -------
+    packet : bytearray
+        The first header, and each well-formed packet after it. Later
+        headers only change the parser, and are not yielded
     '''
-    Converts input_string into an array, of the form [string, int, string]
+    if delimeter is None:
+        delimeter = find_parser(source).delimeter
+    if skipped is None:
+        skipped = []
+    if block_size is None:
+        block_size = BLOCK_SIZE
+
+    buffer = bytearray()
+    position = 0    # The offset in input_file of buffer[0]
+    eof = False
+    seen_header = parser is not None
+
+    def read_more():
+        block = input_file.read(block_size)
+        if instrumentation.ENABLED:
+            instrumentation.count('bytes read', len(block))
+        buffer.extend(block)
+        return len(block)
+
+    def find(pattern, start):
+        nonlocal eof
+        found = buffer.find(pattern, start)
+        while found == -1 and not eof:
+            searched = max(len(buffer) - len(pattern) + 1, start)
+            if read_more() == 0:
+                eof = True
+            found = buffer.find(pattern, searched)
+        return found
+
+    def skip(start, end):
+        skipped.append((position + start, position + end))
+        if instrumentation.ENABLED:
+            instrumentation.count('bytes skipped', end - start)
+
+    start = 0
+    while True:
+        end = find(delimeter, start)
+        if end == -1:
+            end = len(buffer)
+            if end == start:
+                return
+
+        if end == start:
+            start = end + len(delimeter)
+            continue
+
+        packet = buffer[start:end]
+        if packet.startswith(HEADER_MAGIC_BYTES) and (
+                len(packet) >= Header.layout.size):
+            parser = find_parser(source, decode_header(packet))
+            if not seen_header:
+                seen_header = True
+                yield packet
+            start = end + len(delimeter)
+        else:
+            sample_size = parser.layout.size if (
+                parser is not None and parser.layout is not None) else 1
+            if not seen_header:
+                bad = 0
+            elif len(packet) % sample_size == 0:
+                bad = None
+            else:
+                stray = len(packet) - len(packet.lstrip(b'\xff'))
+                bad = 0
+                if stray and (len(packet) - stray) % sample_size == 0:
+                    bad = stray
+
+            if bad is None:
+                yield packet
+                start = end + len(delimeter)
+            elif bad:
+                skip(start, start + bad)
+                if len(packet) > bad:
+                    yield packet[bad:]
+                start = end + len(delimeter)
+            elif seen_header and packet.find(HEADER_MAGIC_BYTES, 1) == -1:
+                skip(start, end)
+                start = end + len(delimeter)
+            else:
+                magic = find(HEADER_MAGIC_BYTES, start + 1)
+                if magic == -1:
+                    skip(start, len(buffer))
+                    return
+                skip(start, magic)
+                start = magic
+
+        del buffer[:start]
+        position += start
+        start = 0
+
+
+def find_header_end(data_file, first, delimeter):
     '''
-    strings = re.findall(r'\D+', input_string)
-    integer = re.search(r'\d+', input_string)
+    Finds the end of the header packet in first, the data read from the
+    start of data_file so far, reading more of data_file into first until the
+    delimeter after the header is found
 
-    separated_string = [strings[0], int(integer.group()), strings[1]]
-    return separated_string
+    Returns
+    -------
+    end : int
+        Where the header packet ends in first, or -1 if data_file ended first
+    '''
+    end = first.find(delimeter)
+    while end == -1:
+        block = data_file.read(BLOCK_SIZE)
+        if not block:
+            return -1
+        first += block
+        end = first.find(delimeter, max(len(first) - len(block) -
+                                        len(delimeter) + 1, 0))
 
+    return end
 
-def convert_unix_time(unixtime):
+
+def verify_file(source, delimeter=None):
     '''
-    Converts an integer, unitime, to a human-readable year-month-day,
-    hour-minute-second format. The raw data stores time values in milliseconds
-    which is UNIX time * 1000, this method corrects for that.
+    Verifies that source, a session file, is intact, without extracting it.
+    Its header must hold HEADER_MAGIC, and the CRC of everything after the
+    header packet, as stored, must match the header's CRC field. The CRC is
+    computed in blocks of VERIFY_BLOCK_SIZE bytes by binascii.crc_hqx, see
+    CRC_INITIAL. Headers with a CRC of 0 have no CRC to check.
 
-    Paramters
-    ---------
-    unixtime : int
-        The UNIX time number to be converted
+    Parameters
+    ----------
+    source : Path
+        The session file, archived copies are verified as the file they are
+        a copy of
+
+    delimeter : bytes (optional)
+        The packet delimeter, defaults to the delimeter of source's parser
 
     Returns
-    --------
-    human-readable-time : string
-        The UNIX time converted to year-month-day, hour-minute-second format
+    -------
+    problems : String array
+        What is wrong with source, empty if it is intact
     '''
+    with open_stream(source) as data_file:
+        first = bytearray()
+        while len(first) < Header.layout.size:
+            block = data_file.read(BLOCK_SIZE)
+            if not block:
+                return ['{} bytes is too short to hold a header'.format(
+                    len(first))]
+            first += block
+
+        header = decode_header(first)
+        problems = []
+        if header.magic_number != HEADER_MAGIC:
+            problems.append('magic number {} is not {}'.format(
+                header.magic_number, HEADER_MAGIC))
+
+        delimeter = delimeter or find_parser(source, header).delimeter
+        end = find_header_end(data_file, first, delimeter)
+        crc = CRC_INITIAL
+        if end != -1:
+            crc = binascii.crc_hqx(
+                memoryview(first)[end + len(delimeter):], crc)
+            for block in iter(lambda: data_file.read(VERIFY_BLOCK_SIZE), b''):
+                crc = binascii.crc_hqx(block, crc)
+                if instrumentation.ENABLED:
+                    instrumentation.count('bytes verified', len(block))
+
+    if header.crc and crc != header.crc:
+        problems.append('CRC {:#06x} does not match the header\'s CRC '
+                        '{:#06x}'.format(crc, header.crc))
+
+    return problems
+
+
+def verify_files(sources):
+    '''
+    Verifies each of sources, see verify_file
 
-    try:
-        unixtime = int(unixtime / 1000)
-    except TypeError:
-        return 'ERROR: {} is invalid\n'.format(unixtime)
+    Returns
+    -------
+    results : Array <(Path, String array, Exception)>
+        The problems of each of sources, or the error raised if it couldn't
+        be read
+    '''
+    results = []
+    for source in sources:
+        try:
+            results.append((source, verify_file(source), None))
+        except (OSError, ValueError) as error:
+            results.append((source, None, error))
 
-    if unixtime <= 0:
-        warnings.warn('WARNING: UNIX time in {} evaluated to 0')
+    return results
 
-    if unixtime >= 2147483647:
-        warnings.warn('WARNING: UNIX time in {} evaluated to beyond the year \
-                       2038, if you really are from the future, hello!')
 
-    return datetime.utcfromtimestamp(unixtime).strftime('%Y-%m-%d_%H-%M-%S')
+def verify_profile(profile, workers=None, batch_size=None):
+    '''
+    Verifies every session file in profile on a pool of worker processes,
+    see verify_file. Nothing is extracted, so a whole archive of profiles can
+    be scanned at the speed files can be read.
 
+    Parameters
+    ----------
+    profile : Path
+        A profile directory, see find_sessions
 
-def convert_time_string(input_string):
-    '''
-    Takes a string of the form "Start time: 1553245673000\n" and returns the 
-    UNIX time converted to the more human-readable format: 
-    "Start time: 2019-03-22_09:07:53"
+    workers : int (optional)
+        How many processes to verify with, None for one per CPU
+
+    batch_size : int (optional)
+        How many session files each task verifies, defaults to
+        VERIFY_BATCH_SIZE. Session files are small, so verifying them in
+        batches saves a round trip to a worker per file
+
+    Yields
+    -------
+    (source, problems, error) : (Path, String array, Exception)
+        The result of each session file, as its batch is verified. error is
+        None, unless source couldn't be read
     '''
-    time = separate_int(input_string)
-    time[1] = convert_unix_time(time[1])
-    converted_string = ''.join(time)
-    return converted_string
+    batch_size = batch_size or VERIFY_BATCH_SIZE
+    sources = [source for sources in find_sessions(profile).values()
+               for source in sources]
+    batches = [sources[i:i + batch_size]
+               for i in range(0, len(sources), batch_size)]
 
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(verify_files, batch) for batch in batches]
+        for future in as_completed(futures):
+            yield from future.result()
 
-def write_file(input_file, destination, packet_type=None):
+
+def compile_fields(fields):
     '''
-    Writes input_file out to the users' drive, in directory destination
+    Compiles a dictionary of fields into a single struct.Struct, which unpacks
+    every field of a packet in one call. Compiled layouts are cached in
+    LAYOUTS, so each dictionary of fields is only compiled once.
 
     Parameters
     ----------
-    input_file : file
-        The file to be written out
-
-    destination : Path
-        The directory to place the written out file
-
-    packet_type : String
-        The type of packet being written out (e.g., header, event summary)
+    fields : Dictionary {Field name: c_type}
+        The data fields that are expected to be found within a packet, in the
+        order they are found
 
     Attributes
     ----------
-    SOURCE : String
-        The name of the original file
+    key : tuple
+        The fields, as a hashable tuple of (field name, c_type) pairs, used to
+        look the layout up in LAYOUTS
 
-    output_name : String
-        The name of the output file
+    Returns
+    -------
+    layout : struct.Struct
+        The compiled layout, e.g., '<IHHIIQQHHIHH' for a header
 
-    VERBOSE : bool
-        If True, print 'Now writing out SOURCE.JSON', where 'source' is the
-        name of the orginal file.
+    Notes
+    ------
+    All the data are little endian, and '<' also tells struct not to add any
+    padding between fields, so the size of the layout is simply the sum of
+    the sizes of its fields' c_types
     '''
+    key = tuple(fields.items())
+    layout = LAYOUTS.get(key)
+    if layout is None:
+        for field, c_type in key:
+            if c_type not in C_TYPES:
+                raise ValueError('ERROR: {} has an invalid c_type {}'.format(
+                    field, c_type))
 
-    global start_time
-    output_name = start_time + '.txt'
+        layout = struct.Struct('<' + ''.join(fields.values()))
+        LAYOUTS[key] = layout
 
-    # Check if input_file is empty
-    if input_file == '':
-        warnings.warn('WARNING: Output is empty')
+    return layout
 
-    if VERBOSE:
-        print('Now writting {} to file {} at {}'.format(packet_type,
-                                                        output_name,
-                                                        destination))
 
-    if not os.path.isdir(destination):
-        raise FileNotFoundError(
-            'ERROR: destination directory {} not found!'.format(DESTINATION))
+def unpack_fields(packet, fields, offset=0):
+    '''
+    Unpacks the fields of packet, starting at offset, with a single
+    unpack_from() call on the compiled layout of fields
 
-    with open(destination + '/' + output_name, 'a') as output:
-        if packet_type is not None:
-            output.write('---{}---\n'.format(packet_type.upper()))
+    Parameters
+    ----------
+    packet : Bytes, bytearray or memoryview
+        The packet to be unpacked
 
-        for line in input_file:
-            output.write(str(line))
+    fields : Dictionary {Field name: c_type}
+        The data fields that are expected to be found within packet
 
+    offset : int (optional)
+        Where in packet the first field starts
 
-# Global variables
-SOURCE = "."
-DESTINATION = "."
-VERBOSE = False
-DEBUG = False
-start_time = 'INVALID START TIME'
+    Returns
+    -------
+    values : Dictionary {Field name: value}
+        The unpacked value of each field, in the same order as fields
+    '''
+    layout = compile_fields(fields)
+    return dict(zip(fields, layout.unpack_from(packet, offset)))
+
+
+def extract_packet(packet, fields, offset=0):
+    '''
+    Extracts packets into their specified fields
+
+    Parameters
+    ----------
+    packet : Bytes, bytearray or memoryview
+        The packet, created by read_packet() or read_mapped_packets(), to be
+        extracted
+
+    fields : The varying data fields that are expected to be found within
+             packet
+
+    offset : int (optional)
+        Where in packet the first field starts
+
+    Attributes
+    ----------
+
+    VERBOSE : bool
+        if True, print 'Extracting {field} from {SOURCE}
+
+    layout : struct.Struct
+        The compiled layout of fields, see compile_fields()
+
+    data : String array
+        A String array to be populated with the various fields found in the
+        packet
+
+    Notes
+    --------
+    packet is never modified or copied, every field is unpacked in place with
+    a single call to layout.unpack_from(), so packet may be a memoryview into
+    a mapped file
+
+    A thin wrapper of Extractor.extract_packet, configured by the module
+    globals
+
+    Returns
+    -------
+    data : String array
+        The extracted data. Example: ['Start time: 1553245673000\n', ...]
+    '''
+    return global_extractor().extract_packet(packet, fields, offset)
+
+
+def fields_to_dtype(fields):
+    '''
+    Builds a NumPy structured dtype from a dictionary of fields, the same
+    dictionaries that extract_packet uses. Each field becomes a little endian
+    member of the dtype, so a buffer of fixed-width samples can be decoded
+    with numpy.frombuffer(). Built dtypes are cached in DTYPES.
+
+    Parameters
+    ----------
+    fields : Dictionary {Field name: c_type}
+        The data fields found in each sample, in the order they are found
+
+    Returns
+    -------
+    dtype : numpy.dtype
+        The structured dtype, with no padding between fields, so its itemsize
+        matches compile_fields(fields).size
+    '''
+    import numpy
+
+    key = tuple(fields.items())
+    dtype = DTYPES.get(key)
+    if dtype is None:
+        for field, c_type in key:
+            if c_type not in NUMPY_TYPES:
+                raise ValueError('ERROR: {} has an invalid c_type {}'.format(
+                    field, c_type))
+
+        dtype = numpy.dtype([(field, NUMPY_TYPES.get(c_type))
+                             for field, c_type in key])
+        DTYPES[key] = dtype
+
+    return dtype
+
+
+def decode_samples(packets, fields):
+    '''
+    Decodes packets of fixed-width samples, such as the bodies of .002 event
+    and .005 waveform packets, into a NumPy structured array. Every sample in
+    every packet is decoded by a single numpy.frombuffer() call, rather than
+    by a Python loop per sample.
+
+    Parameters
+    ----------
+    packets : Bytes, bytearray, memoryview, or an iterable of them
+        The packet, or packets, to be decoded. Several packets (e.g., a whole
+        night of waveform packets from iter_packets) are joined and decoded
+        together
+
+    fields : Dictionary {Field name: c_type}
+        The data fields found in each sample, e.g., WAVEFORM_FIELDS
+
+    Returns
+    -------
+    samples : numpy.ndarray
+        One element per sample, each field can be read as a column, e.g.,
+        samples['Flow']
+
+    Notes
+    ------
+    If the packets do not hold a whole number of samples, a warning is
+    raised, and the trailing partial sample is ignored
+    '''
+    import numpy
+
+    dtype = fields_to_dtype(fields)
+    if not isinstance(packets, (bytes, bytearray, memoryview)):
+        packets = b''.join(packets)
+
+    number_of_bytes = len(packets)
+    if isinstance(packets, memoryview):
+        number_of_bytes = packets.nbytes
+
+    count, remainder = divmod(number_of_bytes, dtype.itemsize)
+    if remainder:
+        warnings.warn('WARNING: {} trailing bytes do not make up a whole '
+                      'sample'.format(remainder))
+
+    if instrumentation.ENABLED:
+        instrumentation.count('samples decoded', count)
+        instrumentation.count('fields decoded', count * len(fields))
+
+    return numpy.frombuffer(packets, dtype, count)
+
+
+def sample_times(start, end, count):
+    '''
+    Spreads the UNIX times of count samples evenly from start, the Start time
+    of a session file, up to its End time, both in milliseconds
+
+    Returns
+    -------
+    times : numpy.ndarray
+        The int64 time of each sample
+    '''
+    import numpy
+
+    return start + (end - start) * numpy.arange(
+        count, dtype=numpy.int64) // max(count, 1)
+
+
+def decimate(times, samples, resolution, method=None):
+    '''
+    Downsamples samples, e.g., the waveform of a whole night, to one bucket
+    per resolution milliseconds, for plotting. Every bucket is reduced at
+    once, by numpy.ufunc.reduceat(), rather than by a Python loop per
+    bucket.
+
+    Parameters
+    ----------
+    times : numpy.ndarray
+        The UNIX time, in milliseconds, of each of samples, in order, e.g.,
+        from sample_times
+
+    samples : numpy.ndarray
+        The samples, decoded by decode_samples, with numeric fields
+
+    resolution : int
+        How many milliseconds each bucket spans
+
+    method : String (optional)
+        One of DECIMATIONS, defaults to 'minmax'. 'minmax' keeps two samples
+        per bucket, holding each field's minimum and maximum, in the order
+        they occurred, so peaks survive. 'mean' keeps one sample per bucket,
+        holding each field's mean
+
+    Returns
+    -------
+    (times, samples) : (numpy.ndarray, numpy.ndarray)
+        The decimated times and samples. With 'minmax', each bucket's pair of
+        samples is timed at its first and last sample, with 'mean', each
+        bucket is timed halfway between them
+    '''
+    import numpy
+
+    method = method or DECIMATIONS[0]
+    if method not in DECIMATIONS:
+        raise ValueError('ERROR: {} is not one of {}'.format(
+            method, DECIMATIONS))
+    if resolution <= 0:
+        raise ValueError('ERROR: resolution must be positive, not {}'.format(
+            resolution))
+    if len(samples) == 0:
+        return times, samples
+
+    buckets = (times - times[0]) // resolution
+    starts = numpy.flatnonzero(numpy.diff(buckets, prepend=-1))
+    lasts = numpy.append(starts[1:], len(samples)) - 1
+
+    if method == 'mean':
+        lengths = lasts - starts + 1
+        decimated = numpy.empty(len(starts), [(field, 'f8') for field in
+                                              samples.dtype.names])
+        for field in samples.dtype.names:
+            decimated[field] = numpy.add.reduceat(
+                samples[field].astype('f8'), starts) / lengths
+        return times[starts] + (times[lasts] - times[starts]) // 2, decimated
+
+    lengths = lasts - starts + 1
+    positions = numpy.arange(len(samples))
+    decimated = numpy.empty(2 * len(starts), samples.dtype)
+    for field in samples.dtype.names:
+        values = samples[field]
+        lowest = numpy.minimum.reduceat(values, starts)
+        highest = numpy.maximum.reduceat(values, starts)
+        # The position of the first occurrence of each bucket's minimum and
+        # maximum, so they are kept in the order they occurred in
+        first_lowest = numpy.minimum.reduceat(
+            numpy.where(values == numpy.repeat(lowest, lengths), positions,
+                        len(samples)), starts)
+        first_highest = numpy.minimum.reduceat(
+            numpy.where(values == numpy.repeat(highest, lengths), positions,
+                        len(samples)), starts)
+        lowest_first = first_lowest <= first_highest
+        decimated[field][0::2] = numpy.where(lowest_first, lowest, highest)
+        decimated[field][1::2] = numpy.where(lowest_first, highest, lowest)
+
+    decimated_times = numpy.empty(2 * len(starts), times.dtype)
+    decimated_times[0::2] = times[starts]
+    decimated_times[1::2] = times[lasts]
+    return decimated_times, decimated
+
+
+def decimate_results(results, resolution, method=None):
+    '''
+    Decimates the samples of each QueryResult in results whose parser is
+    continuous, see decimate
+
+    Yields
+    ------
+    result : QueryResult
+        The result, with its times and samples decimated. Results without
+        samples, or with discrete samples such as events, are yielded as they
+        are
+    '''
+    for result in results:
+        if (result.samples is not None and
+                find_parser(result.source, result.header).continuous):
+            (times, samples) = decimate(result.times, result.samples,
+                                        resolution, method)
+            result = result._replace(times=times, samples=samples)
+        yield result
+
+
+class Record(object):
+    '''
+    The methods shared by the typed packet records made by make_record_type.
+    A record is a namedtuple holding the unpacked value of each field, e.g.,
+    header.start_time is the start time as an int. Nothing is formatted until
+    lines() is called.
+
+    Attributes
+    ----------
+    labels : tuple
+        The name of each field, as found in the fields dictionary, e.g.,
+        'Start time'
+
+    time_fields : tuple
+        The labels of the fields holding UNIX times in milliseconds, which
+        lines() converts to a human-readable format
+
+    layout : struct.Struct
+        The compiled layout of the fields, see compile_fields
+    '''
+    __slots__ = ()
+    labels = ()
+    time_fields = ()
+    layout = None
+
+    @classmethod
+    def unpack(cls, packet, offset=0):
+        '''
+        Unpacks a single record from packet, starting at offset
+        '''
+        return cls._make(cls.layout.unpack_from(packet, offset))
+
+    @classmethod
+    def iter_unpack(cls, packet):
+        '''
+        Yields a record for each fixed-width sample in packet
+        '''
+        for values in cls.layout.iter_unpack(packet):
+            yield cls._make(values)
+
+    def as_dict(self):
+        '''
+        Returns the record as a dictionary {label: value}
+        '''
+        return dict(zip(self.labels, self))
+
+    def lines(self):
+        '''
+        Formats the record the way extract_packet does, one 'label: value\n'
+        string per field, with the time_fields converted by convert_unix_time
+
+        Returns
+        -------
+        data : String array
+            Example: ['Start time: 2019-03-22_09-07-53\n', ...]
+        '''
+        data = []
+        for label, value in zip(self.labels, self):
+            if label in self.time_fields:
+                value = convert_unix_time(value)
+            data.append('{}: {}\n'.format(label, value))
+
+        return data
+
+
+def make_record_type(name, fields, time_fields=()):
+    '''
+    Makes a typed record class for a type of packet, from the same fields
+    dictionaries that extract_packet uses
+
+    Parameters
+    ----------
+    name : String
+        The name of the class, e.g., 'Header'
+
+    fields : Dictionary {Field name: c_type}
+        The fields of the packet. Each field becomes an attribute, named in
+        lower case with underscores, e.g., 'Start time' becomes start_time
+
+    time_fields : tuple (optional)
+        The fields holding UNIX times in milliseconds
+
+    Returns
+    -------
+    record_type : class
+        A subclass of Record and of a namedtuple of the fields
+    '''
+    attributes = [field.lower().replace(' ', '_') for field in fields]
+
+    return type(name, (Record, namedtuple(name, attributes)),
+                {'__slots__': (),
+                 'labels': tuple(fields),
+                 'time_fields': tuple(time_fields),
+                 'layout': compile_fields(fields)})
+
+
+def decode_header(packet):
+    '''
+    Decodes a header packet into a Header record
+
+    Returns
+    -------
+    header : Header
+        The header, e.g., header.session_id, header.start_time
+    '''
+    return Header.unpack(packet)
+
+
+class FileParser(object):
+    '''
+    Parses one type of session file. Every session file starts with a header
+    packet, see HEADER_FIELDS, the packets after it hold fixed-width samples
+    of fields, if the type of file has any. Parsers are registered in
+    PARSERS, see register_parser, and found for each file by find_parser.
+
+    Example
+    -------
+        register_parser(FileParser('Events', '.002', EVENT_FIELDS,
+                                   file_version=3))
+
+    Attributes
+    ----------
+    name : String
+        The name of the type of file, e.g., 'Waveform'
+
+    extension : String
+        The extension of the type of file, e.g., '.005'
+
+    fields : Dictionary {Field name: c_type}
+        The fields of each sample in the packets after the header, or None if
+        the type of file only has a header
+
+    file_type, file_version : int
+        The File type data and File version of the headers this parser is
+        for, or None for any
+
+    delimeter : bytes
+        The packet delimeter of the type of file
+
+    continuous : bool
+        If True, the samples are a continuous waveform, which can be
+        decimated, see decimate. Discrete samples, such as events, never are
+
+    timer : function (optional)
+        Called with (Start time, samples) to return the UNIX time, in
+        milliseconds, of each sample, for samples that hold their own time,
+        e.g., event_times. If None, samples are spread evenly over the time
+        their packets cover, see times
+
+    layout : struct.Struct
+        The compiled layout of fields, compiled when the parser is made, or
+        None if there are no fields
+    '''
+    __slots__ = ('name', 'extension', 'fields', 'file_type', 'file_version',
+                 'delimeter', 'continuous', 'timer', 'layout')
+
+    def __init__(self, name, extension, fields=None, file_type=None,
+                 file_version=None, delimeter=None, continuous=False,
+                 timer=None):
+        self.name = name
+        self.extension = extension
+        self.fields = fields
+        self.file_type = file_type
+        self.file_version = file_version
+        self.delimeter = delimeter or PACKET_DELIMETER
+        self.continuous = continuous
+        self.timer = timer
+        self.layout = compile_fields(fields) if fields else None
+
+    def __repr__(self):
+        return 'FileParser({!r}, {!r})'.format(self.name, self.extension)
+
+    @property
+    def dtype(self):
+        '''
+        The NumPy dtype of fields, see fields_to_dtype
+        '''
+        return fields_to_dtype(self.fields)
+
+    def decode(self, packets):
+        '''
+        Decodes the samples of packets, see decode_samples
+
+        Returns
+        -------
+        samples : numpy.ndarray
+            The samples, or None if the type of file has no fields
+        '''
+        if self.fields is None:
+            return None
+        return decode_samples(packets, self.fields)
+
+    def times(self, start, end, samples):
+        '''
+        Returns the UNIX time, in milliseconds, of each of samples, the
+        samples of a session file from its Start time to its End time, see
+        timer
+        '''
+        if self.timer is not None:
+            return self.timer(start, samples)
+        return sample_times(start, end, len(samples))
+
+
+def event_times(start, samples):
+    '''
+    Times event samples by their Time offset from start, the Start time of
+    their session file, see EVENT_TIME_UNIT
+
+    Returns
+    -------
+    times : numpy.ndarray
+        The int64 UNIX time, in milliseconds, of each event
+    '''
+    return start + samples['Time offset'].astype('i8') * EVENT_TIME_UNIT
+
+
+def register_parser(parser):
+    '''
+    Registers parser in PARSERS, replacing any parser registered for the
+    same extension, File type data and File version
+
+    Returns
+    -------
+    parser : FileParser
+        The registered parser
+    '''
+    PARSERS[(parser.extension, parser.file_type,
+             parser.file_version)] = parser
+    return parser
+
+
+def find_parser(source, header=None):
+    '''
+    Finds the parser of source, from its extension and, if given, the File
+    type data and File version of its header. A parser registered for the
+    exact File type data and File version is preferred, then one for the
+    File type data and any version, then one for any header
+
+    Parameters
+    ----------
+    source : Path
+        The session file, or just its extension, e.g., '.005'
+
+    header : Header (optional)
+        The header of source, see decode_header
+
+    Returns
+    -------
+    parser : FileParser
+        The parser, or UNKNOWN_PARSER, which only parses the header, if no
+        parser is registered for source
+    '''
+    extension = session_extension(source) or source
+    if header is not None:
+        for key in ((extension, header.file_type_data, header.file_version),
+                    (extension, header.file_type_data, None)):
+            parser = PARSERS.get(key)
+            if parser is not None:
+                return parser
+
+    return PARSERS.get((extension, None, None), UNKNOWN_PARSER)
+
+
+def extract_header(packet):
+    '''
+    Extracts the header information from a packet, and sets start_time, which
+    names the output file, from it.
+
+    Attributes
+    ----------
+    record : Header
+        The decoded header, see decode_header
+
+    Returns
+    --------
+    header : String array
+        The header formatted the same way as extract_packet, with the start
+        and end times converted to a human-readable format
+
+    Notes
+    ------
+    Only use this method on packets that you're sure are header packets
+
+    A thin wrapper of Extractor.extract_header, which keeps start_time in the
+    module globals
+    '''
+    global start_time
+
+    extractor = global_extractor()
+    header = extractor.extract_header(packet)
+    start_time = extractor.start_time
+
+    return header
+
+
+def separate_int(input_string):
+    '''
+    Converts input_string into an array, of the form [string, int, string]
+    '''
+    strings = re.findall(r'\D+', input_string)
+    integer = re.search(r'\d+', input_string)
+
+    separated_string = [strings[0], int(integer.group()), strings[1]]
+    return separated_string
+
+
+def convert_unix_time(unixtime):
+    '''
+    Converts an integer, unitime, to a human-readable year-month-day,
+    hour-minute-second format. The raw data stores time values in milliseconds
+    which is UNIX time * 1000, this method corrects for that.
+
+    Paramters
+    ---------
+    unixtime : int
+        The UNIX time number to be converted
+
+    Returns
+    --------
+    human-readable-time : string
+        The UNIX time converted to year-month-day, hour-minute-second format
+    '''
+
+    try:
+        unixtime = int(unixtime / 1000)
+    except TypeError:
+        return 'ERROR: {} is invalid\n'.format(unixtime)
+
+    if unixtime <= 0:
+        warnings.warn('WARNING: UNIX time in {} evaluated to 0')
+
+    if unixtime >= 2147483647:
+        warnings.warn('WARNING: UNIX time in {} evaluated to beyond the year \
+                       2038, if you really are from the future, hello!')
+
+    return format_unix_time(unixtime)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def format_unix_time(seconds):
+    '''
+    Formats seconds, a UNIX time in whole seconds, in year-month-day,
+    hour-minute-second format. Sessions repeat the same few seconds many
+    times, e.g., in the samples of a packet, so the formatted times are cached
+    '''
+    return datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%d_%H-%M-%S')
+
+
+def convert_unix_times(unixtimes):
+    '''
+    Converts an array of UNIX times, in milliseconds, to the human-readable
+    format of convert_unix_time, all at once. The range warnings of
+    convert_unix_time are raised at most once per batch, rather than once per
+    value.
+
+    Parameters
+    ----------
+    unixtimes : array_like
+        The UNIX times, in milliseconds, e.g., a column of decode_samples.
+        Extra milliseconds are dropped, as in convert_unix_time
+
+    Returns
+    --------
+    human-readable-times : numpy.ndarray
+        The converted times, as strings of the same shape as unixtimes
+
+    Raises
+    ------
+    TypeError
+        If unixtimes is not numeric
+
+    ValueError
+        If a time is before the year 1, or after the year 9999
+    '''
+    import numpy
+
+    unixtimes = numpy.asarray(unixtimes)
+    if unixtimes.dtype.kind == 'u':
+        seconds = (unixtimes // 1000).astype(numpy.int64)
+    elif unixtimes.dtype.kind == 'i':
+        unixtimes = unixtimes.astype(numpy.int64)
+        # Round towards 0, as int() does in convert_unix_time
+        seconds = -(-unixtimes // 1000)
+        seconds[unixtimes >= 0] = unixtimes[unixtimes >= 0] // 1000
+    elif unixtimes.dtype.kind == 'f':
+        seconds = numpy.trunc(unixtimes / 1000).astype(numpy.int64)
+    else:
+        raise TypeError('ERROR: {} is invalid'.format(unixtimes.dtype))
+
+    if seconds.size == 0:
+        return numpy.empty(seconds.shape, 'U19')
+
+    if seconds.min() <= 0:
+        warnings.warn('WARNING: {} of {} UNIX times evaluated to 0 or '
+                      'earlier'.format(numpy.count_nonzero(seconds <= 0),
+                                       seconds.size))
+
+    if seconds.max() >= 2147483647:
+        warnings.warn('WARNING: {} of {} UNIX times evaluated to beyond the '
+                      'year 2038, if you really are from the future, '
+                      'hello!'.format(
+                          numpy.count_nonzero(seconds >= 2147483647),
+                          seconds.size))
+
+    if seconds.min() < MIN_UNIX_SECONDS or seconds.max() > MAX_UNIX_SECONDS:
+        raise ValueError('ERROR: UNIX times must be between the years 1 and '
+                         '9999')
+
+    # NumPy formats as 1996-09-10T02:43:00, a byte per character, which
+    # only needs its separators replaced
+    times = seconds.astype('datetime64[s]').astype('S19')
+    characters = times.view(numpy.uint8).reshape(-1, 19)
+    characters[:, 10] = ord('_')
+    characters[:, 13] = ord('-')
+    characters[:, 16] = ord('-')
+    return times.astype('U19')
+
+
+def convert_time_string(input_string):
+    '''
+    Takes a string of the form "Start time: 1553245673000\n" and returns the 
+    UNIX time converted to the more human-readable format: 
+    "Start time: 2019-03-22_09:07:53"
+    '''
+    time = separate_int(input_string)
+    time[1] = convert_unix_time(time[1])
+    converted_string = ''.join(time)
+    return converted_string
+
+
+def write_file(input_file, destination, packet_type=None):
+    '''
+    Writes input_file out to the users' drive, in directory destination
+
+    Parameters
+    ----------
+    input_file : file
+        The file to be written out
+
+    destination : Path
+        The directory to place the written out file
+
+    packet_type : String
+        The type of packet being written out (e.g., header, event summary)
+
+    Attributes
+    ----------
+    SOURCE : String
+        The name of the original file
+
+    output_name : String
+        The name of the output file
+
+    VERBOSE : bool
+        If True, print 'Now writing out SOURCE.JSON', where 'source' is the
+        name of the orginal file.
+
+    Notes
+    ------
+    A thin wrapper of Extractor.write_file, configured by the module globals
+    '''
+    global_extractor(destination).write_file(input_file, packet_type)
+
+
+class SessionWriter(object):
+    '''
+    Writes the extracted text of a session out to destination. Unlike
+    write_file, which opens its output once per call, a SessionWriter keeps
+    each output open, buffered, for the whole session, so sections are
+    written out in large batches.
+
+    Each output is written to a temporary file in destination, which only
+    replaces the real output once the session is closed. A run that crashes
+    part way through a session never leaves a half written output behind.
+    Every writer has its own temporary files, and appending writers merge
+    their sections into the output under its lock, see output_lock, so
+    SessionWriters in several threads can append to the same output.
+
+    Example
+    -------
+        with SessionWriter(destination) as writer:
+            writer.write(start_time + '.txt', header, 'header')
+
+    Attributes
+    ----------
+    destination : Path
+        The directory to place the written out files
+
+    buffer_size : int
+        How many bytes to buffer before writing to disk, defaults to
+        WRITE_BUFFER_SIZE
+
+    append : bool
+        If True, each output starts with whatever the existing output in
+        destination holds when the session is closed, as write_file would
+        append to it. If False, each output is written from scratch
+
+    verbose : bool
+        If True, print each section as it is written
+
+    outputs : Dictionary {output_name: (temporary path, File)}
+        The temporary file, and its open file object, of each output
+    '''
+
+    def __init__(self, destination, buffer_size=None, append=True,
+                 verbose=False):
+        if not os.path.isdir(destination):
+            raise FileNotFoundError(
+                'ERROR: destination directory {} not found!'.format(
+                    destination))
+
+        self.destination = destination
+        self.buffer_size = buffer_size or WRITE_BUFFER_SIZE
+        self.append = append
+        self.verbose = verbose
+        self.outputs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def open_output(self, output_name):
+        '''
+        Opens a new temporary file for output_name, unique to this writer
+        '''
+        (handle, temporary_path) = tempfile.mkstemp(
+            prefix='.{}.'.format(output_name), suffix='.tmp',
+            dir=self.destination)
+        output = os.fdopen(handle, 'w', buffering=self.buffer_size)
+
+        self.outputs[output_name] = (temporary_path, output)
+        return output
+
+    @instrumentation.timed('write latency')
+    def write(self, output_name, lines, packet_type=None):
+        '''
+        Writes lines to output_name, under a ---PACKET_TYPE--- heading, the
+        same way write_file does
+
+        Parameters
+        ----------
+        output_name : String
+            The name of the output file, e.g., 2019-03-22_09-07-53.txt
+
+        lines : iterable
+            The lines to be written
+
+        packet_type : String (optional)
+            The type of packet being written out (e.g., header, event summary)
+        '''
+        if self.verbose:
+            print('Now writting {} to file {} at {}'.format(packet_type,
+                                                            output_name,
+                                                            self.destination))
+
+        output = self.outputs.get(output_name)
+        if output is None:
+            output = self.open_output(output_name)
+        else:
+            output = output[1]
+
+        if packet_type is not None:
+            output.write('---{}---\n'.format(packet_type.upper()))
+
+        output.writelines(str(line) for line in lines)
+
+    def close(self):
+        '''
+        Flushes every output, and moves it into place
+
+        Returns
+        -------
+        outputs : Path array
+            The files written to
+        '''
+        written = []
+        remaining = dict(self.outputs)
+        try:
+            # mkstemp makes files only their owner can read
+            mode = 0o666 & ~read_umask() if self.outputs else None
+            for output_name, (temporary_path, output) in self.outputs.items():
+                output.close()
+                os.chmod(temporary_path, mode)
+                path = self.destination + '/' + output_name
+                with output_lock(path):
+                    if self.append and os.path.isfile(path):
+                        self.prepend(path, temporary_path)
+                    os.replace(temporary_path, path)
+                del remaining[output_name]
+                written.append(path)
+        finally:
+            # If an output couldn't be moved into place, throw away it and
+            # the outputs after it, rather than leaving their temporary files
+            self.outputs = remaining
+            self.abort()
+
+        return written
+
+    def prepend(self, path, temporary_path):
+        '''
+        Puts the existing output at path in front of the sections written to
+        temporary_path
+        '''
+        (handle, merged_path) = tempfile.mkstemp(
+            prefix='.' + os.path.basename(path) + '.', suffix='.tmp',
+            dir=self.destination)
+        try:
+            with os.fdopen(handle, 'w', buffering=self.buffer_size) as merged:
+                for source_path in (path, temporary_path):
+                    with open(source_path) as source:
+                        shutil.copyfileobj(source, merged, self.buffer_size)
+            os.replace(merged_path, temporary_path)
+        except BaseException:
+            os.remove(merged_path)
+            raise
+
+    def abort(self):
+        '''
+        Throws away every output, leaving the existing outputs untouched
+        '''
+        for temporary_path, output in self.outputs.values():
+            output.close()
+            try:
+                os.remove(temporary_path)
+            except FileNotFoundError:
+                pass
+
+        self.outputs = {}
+
+
+def read_umask():
+    '''
+    Returns the umask of the process, which the outputs of a SessionWriter
+    honour. It is read each time it is needed, so later changes to it are
+    followed. Linux reports it in /proc, elsewhere it can only be read by
+    setting it, so it is set straight back
+    '''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def output_lock(path):
+    '''
+    Returns the lock of the output at path, which SessionWriters in this
+    process hold while they move a session into place, so appends to the
+    same output from several threads are never lost
+    '''
+    path = os.path.abspath(path)
+    with OUTPUT_LOCKS_LOCK:
+        lock = OUTPUT_LOCKS.get(path)
+        if lock is None:
+            lock = OUTPUT_LOCKS[path] = threading.Lock()
+    return lock
+
+
+def name_output(header, extension, file_format):
+    '''
+    Names the output file of a session file, from its start time, its
+    extension, and the format it is written in
+
+    Returns
+    -------
+    output_name : String
+        e.g., 2019-03-22_09-07-53.005.parquet
+    '''
+    return '{}{}.{}'.format(convert_unix_time(header['Start time']),
+                            extension, file_format)
+
+
+def iter_records(header, packets, fields=None):
+    '''
+    Yields the records of a session file, ready to be encoded as JSON. Each
+    packet is decoded as it is yielded, so records can be written out while
+    the session file is still being read.
+
+    Parameters
+    ----------
+    header : Dictionary {Field name: value}
+        The header of the session file, from unpack_fields(packet,
+        HEADER_FIELDS)
+
+    packets : iterable
+        The packets following the header, e.g., the rest of iter_packets
+
+    fields : Dictionary {Field name: c_type} (optional)
+        The fields of each sample in packets. If None, only the header is
+        yielded
+
+    Yields
+    -------
+    record : Dictionary
+        First {'type': 'header', field: value, ...}, then, for each packet,
+        {'type': 'packet', 'index': int, field: [value, ...], ...}. All
+        values stay numeric
+    '''
+    record = {'type': 'header'}
+    record.update(header)
+    yield record
+
+    if fields is None:
+        return
+
+    for index, packet in enumerate(packets):
+        samples = decode_samples(packet, fields)
+        record = {'type': 'packet', 'index': index}
+        for field in fields:
+            record[field] = samples[field].tolist()
+        yield record
+
+
+def encode_json(value):
+    '''
+    Encodes the values the json module can't, i.e., the bytes of 'c' fields
+    '''
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    raise TypeError('{} is not JSON serializable'.format(value))
+
+
+@instrumentation.timed('write latency')
+def write_json(records, output, ndjson=False):
+    '''
+    Streams records out to output as JSON. Each record is encoded and written
+    as soon as it is produced, so the whole document is never held in memory
+
+    Parameters
+    ----------
+    records : iterable <Dictionary>
+        The records to be written, e.g., from iter_records()
+
+    output : Path
+        The file to write to
+
+    ndjson : bool (optional)
+        If True, write newline-delimited JSON, one record per line, rather
+        than a single JSON array of records
+    '''
+    with open(output, 'w') as output_file:
+        if ndjson:
+            for record in records:
+                output_file.write(json.dumps(record, default=encode_json))
+                output_file.write('\n')
+            return
+
+        separator = '[\n'
+        for record in records:
+            output_file.write(separator)
+            output_file.write(json.dumps(record, default=encode_json))
+            separator = ',\n'
+
+        output_file.write('[]\n' if separator == '[\n' else '\n]\n')
+
+
+@instrumentation.timed('write latency')
+def write_columnar(header, samples, destination, extension,
+                   file_format='parquet', times=None):
+    '''
+    Writes a session file out as typed columns, in an Apache Parquet or Arrow
+    IPC file, so analytics over many sessions only need to read the columns
+    they use. Each file holds a single row group (or record batch), with one
+    row per sample. The header fields are repeated in every row, which costs
+    next to nothing once Parquet's dictionary and run length encoding have
+    compressed them.
+
+    Parameters
+    ----------
+    header : Dictionary {Field name: value}
+        The header of the session file, from unpack_fields(packet,
+        HEADER_FIELDS)
+
+    samples : numpy.ndarray
+        The samples decoded from the session file by decode_samples(), or None
+        if the file only has a header, in which case a single row is written.
+        If no packets were decoded, a single row is written too, with the
+        sample columns null, so the header still reaches the output
+
+    destination : Path
+        The directory to place the written out file
+
+    extension : String
+        The extension of the session file, e.g., '.005'. Sessions are made of
+        several files with different columns, so each gets its own output
+
+    file_format : String (optional)
+        Either 'parquet' or 'arrow'
+
+    times : numpy.ndarray (optional)
+        If given, the UNIX time of each of samples, e.g., once decimated, is
+        written as a Time column
+
+    Returns
+    -------
+    output : Path
+        The file written to, e.g., 2019-03-22_09-07-53.005.parquet
+    '''
+    import numpy
+    import pyarrow
+
+    if file_format not in COLUMNAR_FORMATS:
+        raise ValueError('ERROR: {} is not a columnar format'.format(
+            file_format))
+
+    if not os.path.isdir(destination):
+        raise FileNotFoundError(
+            'ERROR: destination directory {} not found!'.format(destination))
+
+    output = destination + '/' + name_output(header, extension, file_format)
+
+    rows = 1 if samples is None else max(len(samples), 1)
+    header_dtype = fields_to_dtype(HEADER_FIELDS)
+    columns = {field: numpy.full(rows, value, header_dtype[field])
+               for field, value in header.items()}
+    if samples is not None and len(samples) == 0:
+        if times is not None:
+            columns['Time'] = pyarrow.nulls(
+                1, pyarrow.from_numpy_dtype(times.dtype))
+        for field in samples.dtype.names:
+            columns[field] = pyarrow.nulls(
+                1, pyarrow.from_numpy_dtype(samples.dtype[field]))
+    elif samples is not None:
+        if times is not None:
+            columns['Time'] = times
+        for field in samples.dtype.names:
+            columns[field] = samples[field]
+
+    table = pyarrow.table(columns)
+
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, output,
+                                    row_group_size=max(rows, 1))
+    else:
+        with pyarrow.OSFile(output, 'wb') as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=max(rows, 1))
+
+    return output
+
+
+def column_name(field):
+    '''
+    Names the SQLite column of field, as records name their attributes, e.g.,
+    'Machine ID' becomes machine_id
+    '''
+    return field.lower().replace(' ', '_')
+
+
+class SQLiteStore(object):
+    '''
+    A SQLite database of extracted sessions, so years of nights can be
+    queried without reading thousands of output files. It holds a sessions
+    table, keyed by Machine ID and Session ID, and a table of the samples of
+    each parser with fields, e.g., events and waveform. Every sample row
+    holds its Machine ID, Session ID and UNIX time, in milliseconds, from
+    its parser, like query_file, see FileParser.times. Events are timed by
+    their Time offset, waveforms are spread evenly from the header's Start
+    time to its End time.
+
+    Each session file is stored in a single transaction, its samples by one
+    executemany() call, replacing whatever an earlier run stored for it
+
+    Example
+    -------
+        with SQLiteStore('output/sessions.sqlite') as store:
+            store.store_file(header, parser, samples)
+            store.sessions_between(t0, t1)
+
+    Attributes
+    ----------
+    path : Path
+        The database file, created if it does not exist
+
+    connection : sqlite3.Connection
+        The open connection to path
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+        # Readers are not blocked while a session file is being stored
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.executescript(SQLITE_SCHEMA)
+            for parser in set(PARSERS.values()):
+                if parser.fields is not None:
+                    self.create_table(parser)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        '''
+        Closes the connection to the database
+        '''
+        self.connection.close()
+
+    @staticmethod
+    def table_name(parser):
+        '''
+        Names the table of parser's samples, e.g., waveform
+        '''
+        return column_name(parser.name)
+
+    def create_table(self, parser):
+        '''
+        Creates the table of parser's samples, and its index on session and
+        time, if they do not exist
+        '''
+        table = self.table_name(parser)
+        columns = ''.join(', "{}"'.format(column_name(field))
+                          for field in parser.fields)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS "{}" (machine_id INTEGER NOT NULL, '
+            'session_id INTEGER NOT NULL, time INTEGER NOT NULL{})'.format(
+                table, columns))
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS "{0}_session_time" ON "{0}" '
+            '(machine_id, session_id, time)'.format(table))
+
+    def store_file(self, header, parser, samples=None, times=None):
+        '''
+        Stores a session file, in a single transaction. Its session's Start
+        time and End time are widened to span it, and its samples replace
+        any stored for the same session by an earlier run
+
+        Parameters
+        ----------
+        header : Dictionary {Field name: value}
+            The header of the session file, e.g., from Record.as_dict()
+
+        parser : FileParser
+            The parser of the session file, see find_parser
+
+        samples : numpy.ndarray (optional)
+            The samples of the session file, decoded by parser.decode()
+
+        times : numpy.ndarray (optional)
+            The UNIX time of each of samples, e.g., once decimated, defaults
+            to those of parser, see FileParser.times
+
+        Returns
+        -------
+        rows : int
+            How many samples were stored
+        '''
+        machine_id = header['Machine ID']
+        session_id = header['Session ID']
+        start = header['Start time']
+        end = header['End time']
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO sessions VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (machine_id, session_id) DO UPDATE SET '
+                'start_time = min(start_time, excluded.start_time), '
+                'end_time = max(end_time, excluded.end_time)',
+                (machine_id, session_id, start, end, header['Machine type']))
+
+            if samples is None or parser.fields is None:
+                return 0
+
+            self.create_table(parser)
+            table = self.table_name(parser)
+            self.connection.execute(
+                'DELETE FROM "{}" WHERE machine_id = ? AND '
+                'session_id = ?'.format(table), (machine_id, session_id))
+
+            rows = len(samples)
+            if times is None:
+                times = parser.times(start, end, samples)
+            columns = [samples[field].tolist() for field in parser.fields]
+            self.connection.executemany(
+                'INSERT INTO "{}" VALUES ({})'.format(
+                    table, ', '.join('?' * (len(columns) + 3))),
+                zip([machine_id] * rows, [session_id] * rows,
+                    times.tolist(), *columns))
+
+        if instrumentation.ENABLED:
+            instrumentation.count('rows stored', rows)
+
+        return rows
+
+    def sessions_between(self, t0, t1):
+        '''
+        Finds the sessions overlapping the UNIX times t0 and t1, in
+        milliseconds, by the index on their Start time
+
+        Returns
+        -------
+        sessions : Array <(int, int, int, int)>
+            The Machine ID, Session ID, Start time and End time of each
+            session, sorted by Start time
+        '''
+        return self.connection.execute(
+            'SELECT machine_id, session_id, start_time, end_time '
+            'FROM sessions WHERE start_time <= ? AND end_time >= ? '
+            'ORDER BY start_time', (t1, t0)).fetchall()
+
+
+@instrumentation.timed('write latency')
+def write_sqlite(header, parser, samples, destination, times=None):
+    '''
+    Stores a session file in the SQLiteStore SQLITE_NAME in destination, see
+    SQLiteStore.store_file
+
+    Returns
+    -------
+    output : Path
+        The database written to
+    '''
+    if not os.path.isdir(destination):
+        raise FileNotFoundError(
+            'ERROR: destination directory {} not found!'.format(destination))
+
+    output = destination + '/' + SQLITE_NAME
+    with SQLiteStore(output) as store:
+        store.store_file(header, parser, samples, times)
+
+    return output
+
+
+def extract_file(source, destination, writer=None):
+    '''
+    Runs the whole extraction pipeline on a single SOURCE file: its header is
+    extracted, and written out to a file in destination. For the columnar,
+    JSON and SQLite OUTPUT_FORMATs, the packets following the header are
+    also decoded, if the parser of this type of file has fields, see
+    find_parser. JSON is streamed out as each packet is decoded
+
+    Parameters
+    ----------
+    source : Path
+        The file to be extracted
+
+    destination : Path
+        The directory to place the extracted file
+
+    writer : SessionWriter (optional)
+        The writer of the session source belongs to, for text output. If
+        None, a new SessionWriter appends to the output
+
+    Returns
+    -------
+    output : Path
+        The file the header was written to
+
+    Notes
+    ------
+    A thin wrapper of Extractor.extract_file, configured by the module
+    globals, which keeps start_time in the module globals
+    '''
+    global start_time
+
+    extractor = global_extractor(destination)
+    try:
+        return extractor.extract_file(source, writer)
+    finally:
+        start_time = extractor.start_time
+
+
+def find_sessions(profile):
+    '''
+    Finds every session file in profile, a directory such as a SleepyHead
+    Profiles/<name>/PRS1_* directory, grouped by session. The files of a
+    session share a name, e.g., 38611.001, 38611.002 and 38611.005
+
+    Parameters
+    ----------
+    profile : Path
+        The directory to search, including its subdirectories
+
+    Returns
+    -------
+    sessions : Dictionary {Path: Path array}
+        The files of each session, keyed by their path without an extension,
+        sorted by extension
+    '''
+    sessions = {}
+    for root, dirs, files in os.walk(profile):
+        dirs.sort()
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            session, extension = os.path.splitext(split_archive(source)[0])
+            if extension in SESSION_EXTENSIONS:
+                sessions.setdefault(session, []).append(source)
+
+    return sessions
+
+
+def extract_session(sources, destination):
+    '''
+    Extracts each file of a single session with extract_file. An error in one
+    file is returned rather than raised, so the rest of the session, and the
+    rest of the profile, are still extracted. The text output of the whole
+    session is written by a single SessionWriter, so it replaces, rather than
+    appends to, the output of an earlier run
+
+    Returns
+    -------
+    results : Array <(source, output, error)>
+        For each file, the file extract_file wrote to and None, or None and
+        the exception extract_file raised
+    '''
+    return global_extractor(destination).extract_session(sources)
+
+
+def instrumented_session(sources, destination):
+    '''
+    Runs extract_session in a worker process with instrumentation enabled,
+    and sends the worker's counters and histograms back along with the
+    results, so they can be merged into the parent's
+
+    Returns
+    -------
+    (results, snapshot) : (Array, tuple)
+        See extract_session and instrumentation.snapshot
+    '''
+    return global_extractor(destination).instrumented_session(sources)
+
+
+def fingerprint(source, with_hash=True):
+    '''
+    Fingerprints source by its size, modification time, and a BLAKE2 hash of
+    its contents
+
+    Parameters
+    ----------
+    source : Path
+        The file to be fingerprinted
+
+    with_hash : bool (optional)
+        If False, skip hashing, which means reading the whole file
+
+    Returns
+    -------
+    fingerprint : Dictionary {string: int or string}
+        The 'size', 'mtime' (in nanoseconds), and, if with_hash, 'hash' of
+        source
+    '''
+    stat = os.stat(source)
+    result = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    if with_hash:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(source, 'rb') as opened_file:
+            for block in iter(lambda: opened_file.read(BLOCK_SIZE), b''):
+                digest.update(block)
+        result['hash'] = digest.hexdigest()
+
+    return result
+
+
+def load_manifest(path, rebuild=False, settings=None):
+    '''
+    Loads the manifest of previously extracted files from path. The manifest
+    is a JSON file of the form
+    {'parser version': int, 'settings': settings,
+     'files': {source: fingerprint}}, where each fingerprint also holds the
+    'output' its source was extracted to.
+
+    Parameters
+    ----------
+    path : Path
+        The manifest file, usually MANIFEST_NAME in the destination directory
+
+    rebuild : bool (optional)
+        If True, ignore the manifest on disk and start a new one
+
+    settings : Dictionary (optional)
+        The settings that shape the output, see Extractor.output_settings
+
+    Returns
+    -------
+    manifest : Dictionary
+        The manifest. A new, empty, manifest is returned if rebuild is True,
+        if there is no manifest at path, if it can't be read, or if it was
+        made by a different PARSER_VERSION or with different settings
+    '''
+    manifest = {'parser version': PARSER_VERSION, 'settings': settings,
+                'files': {}}
+    if rebuild or not os.path.isfile(path):
+        return manifest
+
+    try:
+        with open(path) as manifest_file:
+            loaded = json.load(manifest_file)
+    except ValueError:
+        warnings.warn('WARNING: manifest {} is corrupt, starting a new '
+                      'one'.format(path))
+        return manifest
+
+    if loaded.get('parser version') != PARSER_VERSION:
+        if VERBOSE:
+            print('Manifest {} is from an older parser, starting a new '
+                  'one'.format(path))
+        return manifest
+
+    if loaded.get('settings') != settings:
+        if VERBOSE:
+            print('Manifest {} was made with different output settings, '
+                  'starting a new one'.format(path))
+        return manifest
+
+    return loaded
+
+
+def save_manifest(manifest, path):
+    '''
+    Saves manifest to path. The manifest is written to a temporary file that
+    then replaces path, so an interrupted save never leaves a corrupt manifest
+    '''
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def is_unchanged(manifest, source):
+    '''
+    Checks whether source is unchanged since it was recorded in manifest. If
+    its size and modification time match, source is unchanged. If only its
+    modification time differs, its contents are hashed, so files that were
+    merely touched or copied are still recognised as unchanged. If the output
+    it was extracted to is gone, source has to be extracted again.
+
+    Returns
+    -------
+    unchanged : bool
+        True if source doesn't need to be extracted again
+    '''
+    recorded = manifest['files'].get(os.path.abspath(source))
+    if recorded is None:
+        return False
+
+    if not recorded.get('output') or not os.path.exists(recorded['output']):
+        return False
+
+    current = fingerprint(source, with_hash=False)
+    if current['size'] != recorded['size']:
+        return False
+    if current['mtime'] == recorded['mtime']:
+        return True
+
+    if fingerprint(source)['hash'] != recorded['hash']:
+        return False
+
+    recorded['mtime'] = current['mtime']
+    return True
+
+
+def record_file(manifest, source, output, recorded=None):
+    '''
+    Records in manifest that source was extracted to output
+
+    Parameters
+    ----------
+    recorded : Dictionary (optional)
+        The fingerprint of source, taken before it was extracted, so a file
+        modified while it is being extracted is extracted again by the next
+        run. Defaults to fingerprinting source now
+    '''
+    if recorded is None:
+        recorded = fingerprint(source)
+    recorded = dict(recorded, output=output)
+    manifest['files'][os.path.abspath(source)] = recorded
+
+
+class PacketIndex(object):
+    '''
+    An index of where each packet of a session file is, and which stretch of
+    the session it covers, so a packet can be read without splitting every
+    packet before it. Indexes are saved as sidecar files in INDEX_DIR, see
+    open_index.
+
+    Packets after the header don't hold a time of their own, so the session,
+    from the header's Start time to its End time, is shared out between them
+    in proportion to their length. The header itself covers the whole session.
+
+    Example
+    -------
+        index = open_index('38611.005')
+        header = index.seek_packet(0)
+        for (i, packet) in index.packets_between(1553245673000,
+                                                 1553245733000):
+            ...
+
+    Attributes
+    ----------
+    source : Path
+        The session file indexed
+
+    size, mtime : int
+        The size and modification time, in nanoseconds, of source when it
+        was indexed, so a stale index can be recognised
+
+    offsets, lengths : array('Q')
+        Where each packet starts in source, and its length, in bytes
+
+    starts, ends : array('Q')
+        The UNIX time, in milliseconds, each packet starts and ends at
+    '''
+
+    def __init__(self, source, size=0, mtime=0):
+        self.source = source
+        self.size = size
+        self.mtime = mtime
+        self.offsets = array('Q')
+        self.lengths = array('Q')
+        self.starts = array('Q')
+        self.ends = array('Q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, source, delimeter=None):
+        '''
+        Indexes source, by splitting its packets with find_packets
+
+        Parameters
+        ----------
+        source : Path
+            The session file to index
+
+        delimeter : bytes (optional)
+            The packet delimeter of source, defaults to the delimeter of its
+            parser, see find_parser
+
+        Returns
+        -------
+        index : PacketIndex
+            The index of source
+
+        Raises
+        ------
+        ValueError
+            If source is archived or compressed, as its packets can't be read
+            on their own
+        '''
+        stat = os.stat(source)
+        index = cls(source, stat.st_size, stat.st_mtime_ns)
+        if split_archive(source)[1]:
+            raise ValueError('ERROR: {} is archived, and can\'t be '
+                             'indexed'.format(source))
+
+        mapping = open_mapped_file(source)
+        try:
+            header = decode_header(mapping)
+            if header.compression:
+                raise ValueError('ERROR: {} is compressed, and can\'t be '
+                                 'indexed'.format(source))
+            if delimeter is None:
+                delimeter = find_parser(source, header).delimeter
+
+            for (offset, length) in find_packets(mapping, delimeter):
+                index.offsets.append(offset)
+                index.lengths.append(length)
+        finally:
+            mapping.close()
+
+        start = header.start_time
+        duration = max(header.end_time - start, 0)
+        index.starts.append(start)
+        index.ends.append(start + duration)
+
+        total = sum(index.lengths[1:])
+        before = 0
+        for length in index.lengths[1:]:
+            index.starts.append(start + duration * before // total)
+            before += length
+            index.ends.append(start + duration * before // total)
+
+        return index
+
+    @classmethod
+    def load(cls, path, source):
+        '''
+        Loads the index of source saved at path
+
+        Returns
+        -------
+        index : PacketIndex
+            The index, or None if there is no index at path, if it can't be
+            read, or if source has changed since it was indexed
+        '''
+        try:
+            with open(path, 'rb') as index_file:
+                (magic, version, size, mtime, count) = INDEX_LAYOUT.unpack(
+                    index_file.read(INDEX_LAYOUT.size))
+                if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                    return None
+
+                stat = os.stat(source)
+                if (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+                    return None
+
+                index = cls(source, size, mtime)
+                for column in index.columns():
+                    column.fromfile(index_file, count)
+        except (OSError, EOFError, struct.error):
+            return None
+
+        if sys.byteorder != 'little':
+            for column in index.columns():
+                column.byteswap()
+
+        return index
+
+    def save(self, path):
+        '''
+        Saves the index to path. The index is written to a temporary file
+        that then replaces path, so an interrupted save never leaves a corrupt
+        index
+        '''
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as index_file:
+            index_file.write(INDEX_LAYOUT.pack(INDEX_MAGIC, INDEX_VERSION,
+                                               self.size, self.mtime,
+                                               len(self)))
+            for column in self.columns():
+                if sys.byteorder != 'little':
+                    column = array('Q', column)
+                    column.byteswap()
+                column.tofile(index_file)
+        os.replace(temporary_path, path)
+
+    def columns(self):
+        '''
+        Returns the arrays of the index, in the order they are saved
+        '''
+        return (self.offsets, self.lengths, self.starts, self.ends)
+
+    def seek_packet(self, i, data_file=None):
+        '''
+        Reads the i-th packet of source, where the header is packet 0,
+        reading only the bytes of that packet
+
+        Parameters
+        ----------
+        i : int
+            The packet to read, negative values count from the end
+
+        data_file : File (optional)
+            source, opened for binary reading. If None, source is opened,
+            and closed again once the packet is read
+
+        Returns
+        -------
+        packet : bytes
+            The packet, as read_packets would have split it
+        '''
+        if data_file is None:
+            with open(self.source, 'rb') as data_file:
+                return self.seek_packet(i, data_file)
+
+        data_file.seek(self.offsets[i])
+        return data_file.read(self.lengths[i])
+
+    def find_between(self, t0, t1):
+        '''
+        Finds the packets after the header that overlap the times t0 to t1,
+        inclusive, in milliseconds
+
+        Returns
+        -------
+        (first, last) : (int, int)
+            The range of the packets, i.e., range(first, last)
+        '''
+        first = bisect.bisect_left(self.ends, t0, 1)
+        last = bisect.bisect_right(self.starts, t1, first)
+        return first, last
+
+    def packets_between(self, t0, t1, data_file=None):
+        '''
+        Yields the packets after the header that overlap the times t0 to t1,
+        inclusive, in milliseconds. The packets are read in a single read of
+        the bytes they span
+
+        Parameters
+        ----------
+        t0, t1 : int
+            The UNIX times, in milliseconds, to yield the packets between
+
+        data_file : File (optional)
+            source, opened for binary reading, see seek_packet
+
+        Yields
+        ------
+        (i, packet) : (int, memoryview)
+            The number of each packet, as in seek_packet, and the packet
+        '''
+        (first, last) = self.find_between(t0, t1)
+        if first >= last:
+            return
+
+        if data_file is None:
+            with open(self.source, 'rb') as data_file:
+                yield from self.packets_between(t0, t1, data_file)
+            return
+
+        span_start = self.offsets[first]
+        data_file.seek(span_start)
+        span = memoryview(data_file.read(self.offsets[last - 1] +
+                                         self.lengths[last - 1] - span_start))
+        if instrumentation.ENABLED:
+            instrumentation.count('bytes read', len(span))
+
+        for i in range(first, last):
+            offset = self.offsets[i] - span_start
+            yield i, span[offset:offset + self.lengths[i]]
+
+
+def index_sidecar(source, index_dir=None):
+    '''
+    Returns the sidecar file of source's PacketIndex, in index_dir. Profiles
+    are often on read-only SD cards, so indexes are kept apart from them, and
+    as session files of different profiles share names, each sidecar is
+    named after the whole path of its session file
+
+    Parameters
+    ----------
+    index_dir : Path (optional)
+        The directory of the sidecar, defaults to INDEX_DIR, or, if that isn't
+        set, INDEX_DIRECTORY in DESTINATION
+
+    Returns
+    -------
+    path : Path
+        The sidecar file, e.g., .index/38611.005.3f5e0c2a9b1d4e67.idx
+    '''
+    if index_dir is None:
+        index_dir = INDEX_DIR
+    if index_dir is None:
+        index_dir = os.path.join(DESTINATION, INDEX_DIRECTORY)
+
+    digest = hashlib.sha1(os.fsencode(os.path.abspath(source))).hexdigest()
+    return os.path.join(index_dir, '{}.{}{}'.format(
+        os.path.basename(source), digest[:16], INDEX_EXTENSION))
+
+
+def open_index(source, path=None, delimeter=None):
+    '''
+    Opens the index of source saved at path, or, if there is none, or source
+    has changed since, indexes source and saves the index to path
+
+    Parameters
+    ----------
+    source : Path
+        The session file to index
+
+    path : Path (optional)
+        The sidecar file of the index, defaults to index_sidecar(source)
+
+    delimeter : bytes (optional)
+        The packet delimeter of source, see PacketIndex.build
+
+    Returns
+    -------
+    index : PacketIndex
+        The index of source. If the index can't be saved, e.g., its directory
+        isn't writable, it is still returned, and only kept in memory
+    '''
+    if path is None:
+        path = index_sidecar(source)
+
+    index = PacketIndex.load(path, source)
+    if index is not None:
+        return index
+
+    index = PacketIndex.build(source, delimeter)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        index.save(path)
+    except OSError as error:
+        warnings.warn('WARNING: index of {} could not be saved: {}'.format(
+            source, error))
+
+    return index
+
+
+def parse_time(text):
+    '''
+    Parses text, a UTC time, into a UNIX time in milliseconds, the unit of
+    the headers' Start time and End time
+
+    Parameters
+    ----------
+    text : String
+        Either a UNIX time in milliseconds, e.g., 1553245673000, or a time in
+        one of TIME_FORMATS, e.g., 2019-03-22_09-07-53 or 2019-03-22T02:00
+
+    Returns
+    -------
+    unixtime : int
+        The UNIX time, in milliseconds
+
+    Raises
+    ------
+    ValueError
+        If text is not a time
+    '''
+    text = text.strip()
+    if text.lstrip('-').isdigit():
+        return int(text)
+
+    for time_format in TIME_FORMATS:
+        try:
+            parsed = datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+        return (parsed - datetime(1970, 1, 1)) // timedelta(milliseconds=1)
+
+    raise ValueError('ERROR: {} is not a time'.format(text))
+
+
+def read_header(source):
+    '''
+    Reads the header of source, and nothing after it
+
+    Returns
+    -------
+    header : Header
+        The typed header record, see decode_header
+    '''
+    with open_stream(source) as data_file:
+        packet = data_file.read(Header.layout.size)
+    if instrumentation.ENABLED:
+        instrumentation.count('bytes read', len(packet))
+
+    return decode_header(packet)
+
+
+def query_file(source, t0, t1, fields=None, index_path=None):
+    '''
+    Decodes the samples of source between the times t0 and t1. The session
+    is pruned by its header first, and then the packets by its PacketIndex,
+    so only the header and the packets overlapping the window are read.
+
+    Each sample is given a time by sharing out the time its packet covers,
+    see PacketIndex, between the samples in the packet.
+
+    Parameters
+    ----------
+    source : Path
+        The session file to query, e.g., 38611.005
+
+    t0, t1 : int
+        The UNIX times, in milliseconds, of the window, inclusive
+
+    fields : Dictionary {Field name: c_type} (optional)
+        The fields of each sample, defaults to those of source's parser, see
+        find_parser
+
+    index_path : Path (optional)
+        The sidecar file of source's index, see open_index
+
+    Returns
+    -------
+    result : QueryResult
+        (source, header, times, samples), where times holds the UNIX time,
+        in milliseconds, of each of samples, or None if the session doesn't
+        overlap the window. For files without samples, such as .001 files,
+        samples is None
+    '''
+    import numpy
+
+    header = read_header(source)
+    if header.end_time < t0 or header.start_time > t1:
+        return None
+
+    parser = find_parser(source, header)
+    if fields is None:
+        fields = parser.fields
+    if fields is None:
+        return QueryResult(source, header, numpy.empty(0, numpy.int64), None)
+
+    index = open_index(source, index_path)
+    itemsize = fields_to_dtype(fields).itemsize
+    if parser.timer is None:
+        packets = index.packets_between(t0, t1)
+    else:
+        # Samples with times of their own, such as events, can fall outside
+        # the share of the session their packet is indexed with
+        packets = index.packets_between(0, MAX_UNIX_SECONDS * 1000)
+
+    times = []
+    samples = []
+    for (i, packet) in packets:
+        # Packets are decoded one at a time, so a packet with a partial
+        # sample doesn't shift the samples of the packets after it
+        decoded = decode_samples(packet[:len(packet) - len(packet) %
+                                        itemsize], fields)
+        if parser.timer is None:
+            times.append(sample_times(index.starts[i], index.ends[i],
+                                      len(decoded)))
+        else:
+            times.append(parser.timer(header.start_time, decoded))
+        samples.append(decoded)
+
+    if not samples:
+        return QueryResult(source, header, numpy.empty(0, numpy.int64),
+                           decode_samples(b'', fields))
+
+    times = numpy.concatenate(times)
+    samples = numpy.concatenate(samples)
+    in_window = (times >= t0) & (times <= t1)
+    return QueryResult(source, header, times[in_window], samples[in_window])
+
+
+def query_profile(profile, t0, t1, extensions=None, index_dir=None):
+    '''
+    Decodes the samples of every session file in profile between the times
+    t0 and t1, see query_file. Only the headers of the sessions outside the
+    window are read.
+
+    Parameters
+    ----------
+    profile : Path
+        A profile directory, see find_sessions, or a single session file
+
+    t0, t1 : int
+        The UNIX times, in milliseconds, of the window, inclusive, see
+        parse_time
+
+    extensions : String array (optional)
+        The types of session file to query, defaults to those with a parser
+        with samples, see PARSERS
+
+    index_dir : Path (optional)
+        The directory the PacketIndex of each session file is kept in, see
+        index_sidecar
+
+    Yields
+    ------
+    result : QueryResult
+        The window of each session file that overlaps it, in the order of
+        find_sessions. Session files that can't be read are warned about, and
+        skipped
+    '''
+    if extensions is None:
+        extensions = tuple(parser.extension for parser in PARSERS.values()
+                           if parser.fields is not None)
+
+    if os.path.isfile(profile):
+        sources = [profile]
+    else:
+        sources = [source for sources in find_sessions(profile).values()
+                   for source in sources]
+
+    for source in sources:
+        if session_extension(source) not in extensions:
+            continue
+
+        try:
+            result = query_file(source, t0, t1,
+                                index_path=index_sidecar(source, index_dir))
+        except (OSError, ValueError, struct.error) as error:
+            warnings.warn('WARNING: {} could not be queried: {}'.format(
+                source, error))
+            continue
+
+        if result is not None:
+            yield result
+
+
+def iter_query_records(results):
+    '''
+    Yields a record of each QueryResult in results, ready to be encoded as
+    JSON, like iter_records
+
+    Yields
+    -------
+    record : Dictionary
+        {'type': 'window', 'source': Path, header field: value, ...,
+         'Time': [UNIX time, ...], field: [value, ...], ...}
+    '''
+    for result in results:
+        record = {'type': 'window', 'source': result.source}
+        record.update(result.header.as_dict())
+        record['Time'] = result.times.tolist()
+        if result.samples is not None:
+            for field in result.samples.dtype.names:
+                record[field] = result.samples[field].tolist()
+        yield record
+
+
+def extract_profile(profile, destination, workers=None, manifest=None):
+    '''
+    Extracts every session file in profile on a pool of worker processes, and
+    yields the result for each file as soon as its session is done.
+
+    Each session is extracted by a single worker, as all the files of a
+    session are written to the same output file. Sessions are independent of
+    each other, so they are spread across the pool.
+
+    Parameters
+    ----------
+    profile : Path
+        The directory to extract, e.g., a SleepyHead PRS1_* directory
+
+    destination : Path
+        The directory to place the extracted files
+
+    workers : int (optional)
+        How many worker processes to use, defaults to one per CPU
+
+    manifest : Dictionary (optional)
+        A manifest from load_manifest(). If given, sessions whose files are
+        all unchanged since they were recorded in manifest are skipped, and
+        every file that is extracted is recorded in manifest
+
+    Yields
+    -------
+    (source, output, error) : (Path, Path, Exception)
+        See extract_session. If a worker process dies, error is set for every
+        file of the session it was extracting
+    '''
+    return global_extractor(destination).extract_profile(profile, workers,
+                                                         manifest)
+
+
+class Extractor(object):
+    '''
+    Extracts session files, carrying its own configuration and per-session
+    state, rather than relying on the module globals. Any number of
+    Extractors can run at once, e.g., in several threads of one process,
+    without writing into each other's output. The module functions, such as
+    extract_header and write_file, are thin wrappers around an Extractor
+    configured by the module globals, see global_extractor.
+
+    Example
+    -------
+        extractor = Extractor(destination='output', output_format='json')
+        extractor.extract_file('38611.005')
+
+    Attributes
+    ----------
+    source : Path
+        The SOURCE being extracted, e.g., a profile directory, only used in
+        messages
+
+    session_file : Path
+        The session file being, or most recently, extracted, named in
+        messages in place of source
+
+    destination : Path
+        The directory to place the extracted files
+
+    verbose, debug : bool
+        If True, be verbose, or print debugging information
+
+    use_mmap : bool
+        If True, memory-map session files instead of reading them
+
+    output_format : String
+        The format of the extracted files, 'txt', one of COLUMNAR_FORMATS or
+        JSON_FORMATS, or SQLITE_FORMAT, which stores every session file in a
+        single SQLiteStore
+
+    buffer_size : int
+        How many bytes of output to buffer, see SessionWriter
+
+    delimeter : bytes
+        If set, the packet delimeter of every session file, rather than the
+        delimeter of its parser
+
+    check_crc : bool
+        If True, verify each session file before extracting it, see
+        verify_file, and refuse to extract it if it is corrupt
+
+    resync : bool
+        If True, skip malformed packets, and carry on from the next header,
+        see resync_packets
+
+    resolution : int
+        If set, the continuous samples of the columnar and SQLite formats,
+        e.g., waveforms, are decimated to one bucket per resolution
+        milliseconds, see decimate and FileParser.continuous
+
+    decimation : String
+        How the samples are decimated, one of DECIMATIONS
+
+    skipped : Array <(int, int)>
+        With resync, the byte ranges skipped in the session file most
+        recently extracted
+
+    start_time : String
+        The start time of the header most recently extracted, which names the
+        text output
+    '''
+
+    def __init__(self, source=None, destination='.', verbose=False,
+                 debug=False, use_mmap=False, output_format='txt',
+                 buffer_size=None, delimeter=None, check_crc=False,
+                 resync=False, resolution=None, decimation=None):
+        self.source = source
+        self.destination = destination
+        self.verbose = verbose
+        self.debug = debug
+        self.use_mmap = use_mmap
+        self.output_format = output_format
+        self.buffer_size = buffer_size
+        self.delimeter = delimeter
+        self.check_crc = check_crc
+        self.resync = resync
+        self.resolution = resolution
+        self.decimation = decimation
+        self.skipped = None
+        self.session_file = None
+        self.start_time = 'INVALID START TIME'
+
+    def open_file(self, source):
+        '''
+        Opens source for reading, see open_file
+        '''
+        if self.verbose:
+            print('Reading in {}'.format(source))
+
+        if not os.path.isfile(source):
+            raise FileNotFoundError(
+                'ERROR: source file {} not found!'.format(source))
+
+        opened_file = open_stream(source)
+        return opened_file
+
+    def open_mapped_file(self, source):
+        '''
+        Memory-maps source, see open_mapped_file
+        '''
+        if self.verbose:
+            print('Mapping {}'.format(source))
+
+        if not os.path.isfile(source):
+            raise FileNotFoundError(
+                'ERROR: source file {} not found!'.format(source))
+
+        if os.path.getsize(source) == 0:
+            raise ValueError(
+                'ERROR: source file {} is empty, it cannot be mapped'.format(
+                    source))
+
+        with open(source, 'rb') as opened_file:
+            # The mapping keeps its own handle on the file
+            return mmap.mmap(opened_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def open_packets(self, source):
+        '''
+        Opens source, finds its parser from its header, and starts splitting
+        it into packets, memory-mapped if use_mmap is set. Archived copies,
+        and compressed sessions, are decompressed as they are split instead,
+        see split_session
+
+        Returns
+        -------
+        (data_file, parser, packets) : (File or mmap, FileParser, generator)
+            The opened file, which must be closed once packets is, the parser
+            of source, see find_parser, and the packets in source, from
+            iter_packets or read_mapped_packets
+        '''
+        self.skipped = [] if self.resync else None
+        if (self.use_mmap and not self.resync and
+                not split_archive(source)[1]):
+            data_file = self.open_mapped_file(source)
+            try:
+                header = decode_header(data_file)
+            except struct.error:
+                data_file.close()
+                raise
+
+            if not header.compression:
+                parser = find_parser(source, header)
+                return data_file, parser, read_mapped_packets(
+                    data_file, self.delimeter or parser.delimeter)
+            data_file.close()
+
+        data_file = self.open_file(source)
+        try:
+            (header, parser, packets) = split_session(data_file, source,
+                                                      self.delimeter,
+                                                      self.skipped)
+        except Exception:
+            data_file.close()
+            raise
+
+        return data_file, parser, packets
+
+    def extract_packet(self, packet, fields, offset=0):
+        '''
+        Extracts packet into its fields, see extract_packet
+        '''
+        layout = compile_fields(fields)
+        values = layout.unpack_from(packet, offset)
+        if instrumentation.ENABLED:
+            instrumentation.count('fields decoded', len(values))
+
+        if self.verbose:
+            for field in fields:
+                print('Extracting {} from {}'.format(
+                    field, self.session_file or self.source))
+
+        if self.debug:
+            for field, c_type in fields.items():
+                number_of_bytes = C_TYPES.get(c_type)
+                print('Bytes in {}: {}'.format(
+                    field, bytes(packet[offset:offset + number_of_bytes])))
+                offset += number_of_bytes
+            print('Remaining bytes in packet: {}'.format(
+                bytes(packet[offset:])))
+
+        data = ['{}: {}\n'.format(field, value)
+                for field, value in zip(fields, values)]
+        return data
+
+    def extract_header(self, packet):
+        '''
+        Extracts the header from packet, and sets start_time from it, see
+        extract_header
+        '''
+        if self.verbose:
+            print('Extracting header from {}'.format(
+                self.session_file or self.source))
+
+        record = decode_header(packet)
+        self.start_time = convert_unix_time(record.start_time)
+
+        return record.lines()
+
+    @instrumentation.timed('write latency')
+    def write_file(self, input_file, packet_type=None):
+        '''
+        Appends input_file to the output named after start_time, see
+        write_file
+        '''
+        output_name = self.start_time + '.txt'
+
+        # Check if input_file is empty
+        if input_file == '':
+            warnings.warn('WARNING: Output is empty')
+
+        if self.verbose:
+            print('Now writting {} to file {} at {}'.format(packet_type,
+                                                            output_name,
+                                                            self.destination))
+
+        if not os.path.isdir(self.destination):
+            raise FileNotFoundError(
+                'ERROR: destination directory {} not found!'.format(
+                    self.destination))
+
+        with open(self.destination + '/' + output_name, 'a') as output:
+            if packet_type is not None:
+                output.write('---{}---\n'.format(packet_type.upper()))
+
+            for line in input_file:
+                output.write(str(line))
+
+    def extract_file(self, source, writer=None):
+        '''
+        Runs the whole extraction pipeline on source, see extract_file
+        '''
+        self.session_file = source
+        destination = self.destination
+        extension = session_extension(source)
+
+        if self.check_crc:
+            problems = verify_file(source, self.delimeter)
+            if problems:
+                raise ValueError('ERROR: {} is corrupt: {}'.format(
+                    source, '; '.join(problems)))
+
+        data_file, parser, packets = self.open_packets(source)
+        fields = parser.fields
+        records = None
+        try:
+            packet = next(packets, None)
+            if packet is None:
+                raise ValueError(
+                    'ERROR: source file {} has no packets'.format(source))
+            header = self.extract_header(packet)
+            values = decode_header(packet).as_dict()
+
+            samples = None
+            times = None
+            if (self.output_format in COLUMNAR_FORMATS or
+                    self.output_format == SQLITE_FORMAT):
+                samples = parser.decode(packets)
+                if (samples is not None and self.resolution and
+                        parser.continuous):
+                    times = parser.times(values['Start time'],
+                                         values['End time'], samples)
+                    (times, samples) = decimate(times, samples,
+                                                self.resolution,
+                                                self.decimation)
+
+            if self.output_format in JSON_FORMATS:
+                if not os.path.isdir(destination):
+                    raise FileNotFoundError(
+                        'ERROR: destination directory {} not found!'.format(
+                            destination))
+
+                output = destination + '/' + name_output(
+                    values, extension, self.output_format)
+                if self.verbose:
+                    print('Now writting {} to {}'.format(source, output))
+                records = iter_records(values, packets, fields)
+                write_json(records, output, self.output_format == 'ndjson')
+                return output
+        finally:
+            # A mapped file can't be closed while a packet still points into
+            # it, and records, if writing it failed part way, still holds the
+            # packet it was decoding
+            packet = None
+            if records is not None:
+                records.close()
+            packets.close()
+            data_file.close()
+            if self.skipped:
+                warnings.warn('WARNING: skipped {} malformed bytes of {}, '
+                              'at {}'.format(
+                                  sum(end - start
+                                      for (start, end) in self.skipped),
+                                  source, self.skipped))
+
+        if self.output_format in COLUMNAR_FORMATS:
+            if self.verbose:
+                print('Now writting {} to {}'.format(source, destination))
+            return write_columnar(values, samples, destination, extension,
+                                  self.output_format, times)
+
+        if self.output_format == SQLITE_FORMAT:
+            if self.verbose:
+                print('Now storing {} in {}'.format(source, destination))
+            return write_sqlite(values, parser, samples, destination, times)
+
+        output_name = self.start_time + '.txt'
+        if writer is None:
+            with self.session_writer() as writer:
+                writer.write(output_name, header, 'header')
+        else:
+            writer.write(output_name, header, 'header')
+
+        return destination + '/' + output_name
+
+    def output_settings(self):
+        '''
+        Returns the settings that shape the output of this Extractor, so a
+        manifest made with other settings is not trusted, see load_manifest
+
+        Returns
+        -------
+        settings : Dictionary {String: value}
+            The output format, decimation, and packet splitting settings
+        '''
+        return {'format': self.output_format,
+                'resolution': self.resolution,
+                'decimation': self.decimation if self.resolution else None,
+                'resync': self.resync,
+                'delimeter': self.delimeter and self.delimeter.hex()}
+
+    def session_writer(self, append=True):
+        '''
+        Returns a SessionWriter for this Extractor's destination
+        '''
+        return SessionWriter(self.destination, self.buffer_size, append,
+                             self.verbose)
+
+    def extract_session(self, sources, fingerprints=None):
+        '''
+        Extracts each file of a single session, see extract_session. If
+        fingerprints, a dictionary, is given, each file is fingerprinted into
+        it just before it is extracted, see record_file
+        '''
+        results = []
+        with self.session_writer(append=False) as writer:
+            for source in sources:
+                try:
+                    if fingerprints is not None:
+                        fingerprints[source] = fingerprint(source)
+                    results.append((source,
+                                    self.extract_file(source, writer),
+                                    None))
+                except Exception as error:
+                    results.append((source, None, error))
+
+        return results
+
+    def instrumented_session(self, sources):
+        '''
+        Runs extract_session with instrumentation enabled, see
+        instrumented_session
+        '''
+        instrumentation.enable()
+        results = self.extract_session(sources)
+        return results, instrumentation.snapshot()
+
+    def profile_session(self, sources, fingerprinted=False,
+                        instrumented=False):
+        '''
+        Runs extract_session in a worker process of extract_profile
+
+        Parameters
+        ----------
+        fingerprinted : bool (optional)
+            If True, fingerprint each file before it is extracted, for the
+            manifest, so the parent process doesn't have to read every file
+            again
+
+        instrumented : bool (optional)
+            If True, enable instrumentation, and send a snapshot back
+
+        Returns
+        -------
+        (results, fingerprints, snapshot) : (Array, Dictionary, tuple)
+            See extract_session, fingerprint and instrumentation.snapshot.
+            fingerprints and snapshot are None unless asked for
+        '''
+        if instrumented:
+            instrumentation.enable()
+        fingerprints = {} if fingerprinted else None
+        results = self.extract_session(sources, fingerprints)
+        snapshot = instrumentation.snapshot() if instrumented else None
+        return results, fingerprints, snapshot
+
+    def extract_profile(self, profile, workers=None, manifest=None):
+        '''
+        Extracts every session file in profile on a pool of worker processes,
+        see extract_profile. Each worker gets a copy of this Extractor, so the
+        workers share its configuration, but not its state
+        '''
+        sessions = find_sessions(profile)
+        if manifest is not None:
+            sessions = {session: sources
+                        for session, sources in sessions.items()
+                        if not all(is_unchanged(manifest, source)
+                                   for source in sources)}
+
+        # Worker processes can't add to this process' instrumentation
+        # directly, and fingerprint the files they extract themselves
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.profile_session, sources,
+                                       manifest is not None,
+                                       instrumentation.ENABLED): sources
+                       for sources in sessions.values()}
+
+            for future in as_completed(futures):
+                try:
+                    (results, fingerprints, snapshot) = future.result()
+                except Exception as error:
+                    (results, fingerprints, snapshot) = (
+                        [(source, None, error)
+                         for source in futures[future]], None, None)
+
+                if snapshot is not None:
+                    instrumentation.merge(snapshot)
+
+                for result in results:
+                    (source, output, error) = result
+                    if manifest is not None and error is None:
+                        record_file(manifest, source, output,
+                                    fingerprints[source])
+                    yield result
+
+
+def write_query(profile, destination, t0, t1, resolution=None,
+                decimation=None):
+    '''
+    Writes the samples of every session file in profile between the times t0
+    and t1 to destination, as newline-delimited JSON, or JSON if
+    OUTPUT_FORMAT is 'json', see query_profile and iter_query_records. If
+    resolution is set, the samples are decimated first, see decimate_results.
+    Packet indexes are kept in INDEX_DIR, or in INDEX_DIRECTORY in
+    destination
+
+    Returns
+    -------
+    output : Path
+        The file written to, e.g.,
+        2019-03-22_02-00-00_2019-03-22_03-00-00.ndjson
+    '''
+    if not os.path.isdir(destination):
+        raise FileNotFoundError(
+            'ERROR: destination directory {} not found!'.format(destination))
+
+    file_format = 'json' if OUTPUT_FORMAT == 'json' else 'ndjson'
+    output = '{}/{}_{}.{}'.format(destination, convert_unix_time(t0),
+                                  convert_unix_time(t1), file_format)
+    index_dir = INDEX_DIR
+    if index_dir is None:
+        index_dir = os.path.join(destination, INDEX_DIRECTORY)
+    results = query_profile(profile, t0, t1, index_dir=index_dir)
+    if resolution:
+        results = decimate_results(results, resolution, decimation)
+    write_json(iter_query_records(results), output, file_format == 'ndjson')
+    return output
+
+
+def global_extractor(destination=None):
+    '''
+    Returns an Extractor configured by the module globals, as set up by
+    setup_args, and holding the module's start_time
+
+    Parameters
+    ----------
+    destination : Path (optional)
+        The directory to place the extracted files, defaults to DESTINATION
+    '''
+    if destination is None:
+        destination = DESTINATION
+
+    extractor = Extractor(SOURCE, destination, VERBOSE, DEBUG, MMAP,
+                          OUTPUT_FORMAT, WRITE_BUFFER_SIZE,
+                          check_crc=CHECK_CRC, resync=RESYNC,
+                          resolution=RESOLUTION, decimation=DECIMATION)
+    extractor.start_time = start_time
+    return extractor
+
+
+def main():
+    '''
+    Extracts SOURCE, a single session file, or a whole profile directory, to
+    DESTINATION, as set up by setup_args
+    '''
+    if BETWEEN is not None:
+        print('Wrote {}'.format(write_query(SOURCE, DESTINATION, *BETWEEN,
+                                            RESOLUTION, DECIMATION)))
+        return
+
+    if VERIFY:
+        if os.path.isdir(SOURCE):
+            results = verify_profile(SOURCE, WORKERS)
+        else:
+            results = verify_files([SOURCE])
+
+        (verified, corrupt) = (0, 0)
+        for (session_file, problems, error) in results:
+            verified += 1
+            if error is not None or problems:
+                corrupt += 1
+                print('CORRUPT: {}: {}'.format(
+                    session_file, error or '; '.join(problems)))
+            elif VERBOSE:
+                print('Verified {}'.format(session_file))
+        print('Verified {} session files, {} corrupt'.format(
+            verified, corrupt))
+        return
+
+    extractor = global_extractor()
+    if os.path.isdir(SOURCE):
+        manifest = None
+        manifest_path = os.path.join(DESTINATION, MANIFEST_NAME)
+        if INCREMENTAL:
+            manifest = load_manifest(manifest_path, REBUILD,
+                                     extractor.output_settings())
+
+        try:
+            for (session_file, output, error) in extractor.extract_profile(
+                    SOURCE, WORKERS, manifest):
+                if error is not None:
+                    print('ERROR: {} could not be extracted: {}'.format(
+                        session_file, error))
+                elif VERBOSE:
+                    print('Extracted {} to {}'.format(session_file, output))
+        finally:
+            if manifest is not None:
+                save_manifest(manifest, manifest_path)
+    else:
+        extractor.extract_file(SOURCE)
+
+
+def run():
+    '''
+    Runs main, with instrumentation and cProfile if PROFILE and PROFILE_DUMP
+    are set, and prints a summary of the run
+    '''
+    if not PROFILE:
+        main()
+        return
+
+    instrumentation.enable()
+    profiler = cProfile.Profile() if PROFILE_DUMP is not None else None
+    start = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.runcall(main)
+        else:
+            main()
+    finally:
+        seconds = time.perf_counter() - start
+        print(''.join(instrumentation.summary(seconds)), end='')
+        if profiler is not None:
+            profiler.dump_stats(PROFILE_DUMP)
+            print('cProfile stats dumped to {}'.format(PROFILE_DUMP))
+
+
+# Global variables
+SOURCE = "."
+DESTINATION = "."
+VERBOSE = False
+DEBUG = False
+MMAP = False
+WORKERS = None
+INCREMENTAL = False
+REBUILD = False
+OUTPUT_FORMAT = 'txt'
+PROFILE = False
+PROFILE_DUMP = None
+BETWEEN = None
+CHECK_CRC = False
+VERIFY = False
+RESYNC = False
+RESOLUTION = None
+DECIMATION = 'minmax'
+INDEX_DIR = None
+start_time = 'INVALID START TIME'
+
+# How many bytes of output a SessionWriter buffers before writing to disk
+WRITE_BUFFER_SIZE = 1 << 16
+
+# The lock of each output SessionWriters have written to, see output_lock,
+# and the lock guarding the dictionary itself
+OUTPUT_LOCKS = {}
+OUTPUT_LOCKS_LOCK = threading.Lock()
+
+# The packet delimeter of PRS1 session files
+PACKET_DELIMETER = b'\xff\xff\xff\xff'
+
+# The extensions of the PRS1 session files that are extracted from profiles
+SESSION_EXTENSIONS = ('.001', '.002', '.004', '.005')
+
+# The extensions of archived copies of session files, e.g., 38611.005.gz,
+# which are decompressed as they are read, see open_stream. Reading .zst
+# copies needs the zstandard package
+ARCHIVE_EXTENSIONS = ('.gz', '.zst')
+
+# The decompressor of the packets after the header, by the header's
+# Compression field, see split_session
+DECOMPRESSORS = {1: zlib.decompressobj}
+
+# The version of the parser, bump this whenever the extracted output changes,
+# so that --incremental runs extract every file again
+PARSER_VERSION = 1
+
+# The name of the manifest of extracted files kept in DESTINATION
+MANIFEST_NAME = '.cpap_manifest.json'
+
+# The formats parse_time accepts, all in UTC
+TIME_FORMATS = ('%Y-%m-%d_%H-%M-%S',
+                '%Y-%m-%dT%H:%M:%S',
+                '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%dT%H:%M',
+                '%Y-%m-%d %H:%M',
+                '%Y-%m-%d')
+
+# The UNIX times, in seconds, of the first and last second that can be
+# formatted, 0001-01-01_00-00-00 and 9999-12-31_23-59-59
+MIN_UNIX_SECONDS = -62135596800
+MAX_UNIX_SECONDS = 253402300799
+
+# The sidecar file of a packet index, see PacketIndex. An index is saved as
+# INDEX_LAYOUT (magic, version, source size, source mtime, packet count),
+# followed by the offsets, lengths, starts and ends of the packets, each an
+# array of little endian unsigned 64 bit integers. Sidecars are kept in
+# INDEX_DIRECTORY in DESTINATION, unless INDEX_DIR is set, see index_sidecar
+INDEX_EXTENSION = '.idx'
+INDEX_DIRECTORY = '.index'
+INDEX_MAGIC = b'CPIX'
+INDEX_VERSION = 1
+INDEX_LAYOUT = struct.Struct('<4sHQQQ')
+
+# The Magic number every header starts with, see verify_file, and as it is
+# found in a session file, see resync_packets
+HEADER_MAGIC = 3341948587
+HEADER_MAGIC_BYTES = struct.pack('<I', HEADER_MAGIC)
+
+# The initial value of the CRC-16/CCITT that verify_file checks the header's
+# CRC field against
+CRC_INITIAL = 0xFFFF
+
+# How many bytes verify_file reads, and checks, at a time
+VERIFY_BLOCK_SIZE = 1 << 20
+
+# How many session files each task of verify_profile verifies
+VERIFY_BATCH_SIZE = 64
+
+# How many bytes read_packet and read_packets read from a file at a time
+BLOCK_SIZE = 1 << 16
 
 # See https://docs.python.org/3/library/struct.html
 C_TYPES = {'c': 1,
@@ -456,14 +3940,106 @@ C_TYPES = {'c': 1,
            'f': 4,
            'd': 8}
 
+# The fields of a header packet, see extract_header
+HEADER_FIELDS = {'Magic number': 'I',
+                 'File version': 'H',
+                 'File type data': 'H',
+                 'Machine ID': 'I',
+                 'Session ID': 'I',
+                 'Start time': 'Q',
+                 'End time': 'Q',
+                 'Compression': 'H',
+                 'Machine type': 'H',
+                 'Data size': 'I',
+                 'CRC': 'H',
+                 'MCSize': 'H'}
+
+# The fields of each sample in a .002 event packet
+EVENT_FIELDS = {'Event code': 'B',
+                'Time offset': 'H',
+                'Duration': 'H'}
+
+# How many milliseconds each unit of an event's Time offset is, see
+# event_times
+EVENT_TIME_UNIT = 1000
+
+# The fields of each sample in a .005 waveform packet
+WAVEFORM_FIELDS = {'Flow': 'b',
+                   'Pressure': 'B',
+                   'Leak': 'B'}
+
+# The columnar output formats, see write_columnar
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+# The JSON output formats, see write_json
+JSON_FORMATS = ('json', 'ndjson')
+
+# The ways samples can be decimated, the first is the default, see decimate
+DECIMATIONS = ('minmax', 'mean')
+
+# The SQLite output format, the database it is stored in in DESTINATION, and
+# how many seconds to wait for another process storing a session file, see
+# SQLiteStore. Sample tables are made from the parsers
+SQLITE_FORMAT = 'sqlite'
+SQLITE_NAME = 'sessions.sqlite'
+SQLITE_TIMEOUT = 60.0
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    machine_id INTEGER NOT NULL,
+    session_id INTEGER NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    machine_type INTEGER,
+    PRIMARY KEY (machine_id, session_id));
+CREATE INDEX IF NOT EXISTS sessions_start_time ON sessions (start_time);
+CREATE INDEX IF NOT EXISTS sessions_end_time ON sessions (end_time);
+'''
 
-if __name__ == '__main__':
-    setup_args()
-
-    DATA_FILE = open_file(SOURCE)
-    PACKET_DELIMETER = b'\xff\xff\xff\xff'
+# Compiled struct layouts, see compile_fields
+LAYOUTS = {}
+
+# The NumPy type matching each C Type, see fields_to_dtype
+NUMPY_TYPES = {'c': 'S1',
+               'b': 'i1',
+               'B': 'u1',
+               'h': '<i2',
+               'H': '<u2',
+               'i': '<i4',
+               'I': '<u4',
+               'l': '<i4',
+               'L': '<u4',
+               'q': '<i8',
+               'Q': '<u8',
+               'f': '<f4',
+               'd': '<f8'}
+
+# Built NumPy dtypes, see fields_to_dtype
+DTYPES = {}
+
+# Typed records of header and event packets, see make_record_type
+Header = make_record_type('Header', HEADER_FIELDS,
+                          ('Start time', 'End time'))
+Event = make_record_type('Event', EVENT_FIELDS)
+
+# The parser of each type of session file, keyed by (extension, File type
+# data, File version), where None matches any header, see find_parser
+PARSERS = {}
+register_parser(FileParser('Summary', '.001'))
+register_parser(FileParser('Events', '.002', EVENT_FIELDS,
+                           timer=event_times))
+register_parser(FileParser('Time details', '.004'))
+register_parser(FileParser('Waveform', '.005', WAVEFORM_FIELDS,
+                           continuous=True))
+
+# The parser of session files no parser is registered for, which only parses
+# their header
+UNKNOWN_PARSER = FileParser('Unknown', '')
+
+# The window of a session file returned by query_file
+QueryResult = namedtuple('QueryResult', ['source', 'header', 'times',
+                                         'samples'])
 
-    PACKETS = read_packets(DATA_FILE, PACKET_DELIMETER)
 
-    HEADER = extract_header(PACKETS[0])
-    write_file(HEADER, DESTINATION, 'header')
+if __name__ == '__main__':
+    setup_args()
+    run()
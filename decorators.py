@@ -15,8 +15,14 @@ def logger(orig_func):
         The un-executed form of orig_func
     '''
     import logging
-    logging.basicConfig(filename='{}.log'.format(orig_func.__name__), 
-                                                 level=logging.INFO)
+
+    # logging.basicConfig only takes effect once per process, so each
+    # decorated function gets its own logger and log file instead
+    log = logging.getLogger('decorators.{}'.format(orig_func.__name__))
+    if not log.handlers:
+        log.addHandler(logging.FileHandler(
+            '{}.log'.format(orig_func.__name__)))
+        log.setLevel(logging.INFO)
 
     @wraps(orig_func)
     def wrapper(*args, **kwargs):
@@ -24,14 +30,16 @@ def logger(orig_func):
         Using the wraps decorator allows for using multiple decorators on a 
         single function.
         '''
-        logging.info('Ran with args: {}, and kwargs: {}'.format(args, kwargs))
+        log.info('Ran with args: {}, and kwargs: {}'.format(args, kwargs))
         return orig_func(*args, **kwargs)
 
     return wrapper
 
 def timer(orig_func):
     '''
-    Calculates and prints how long orig_func took to run.
+    Calculates and prints how long orig_func took to run. The time is also
+    added to the instrumentation histogram named after orig_func, when
+    instrumentation is enabled.
 
     Parameters
     ----------
@@ -45,13 +53,16 @@ def timer(orig_func):
     '''
 
     import time
+    import instrumentation
 
     @wraps(orig_func)
     def wrapper(*args, **kwargs):
-        t = time.time()
+        t = time.perf_counter_ns()
         result = orig_func(*args, **kwargs)
-        t = time.time() - t
-        print('{} ran in: {} seconds'.format(orig_func.__name__, t))
+        t = time.perf_counter_ns() - t
+        if instrumentation.ENABLED:
+            instrumentation.observe(orig_func.__name__, t)
+        print('{} ran in: {} seconds'.format(orig_func.__name__, t / 1e9))
         return result
 
     return wrapper
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+'''
+This module continuously ingests CPAP session files dropped into an inbox
+directory, e.g., by copying in SD-card dumps, and extracts each one to a
+destination directory as soon as it has been fully written.
+
+The inbox is polled every INTERVAL seconds. A session file is queued once it
+is settled, i.e., its size and modification time are unchanged since the last
+poll, or it has not been modified for SETTLE seconds. Queued files are
+extracted by a fixed number of workers, each running Extractor.extract_file
+on a pool of processes, so a burst of hundreds of files is extracted at the
+pace of the pool. The queue is bounded, so while it is full, the inbox is not
+polled, instead of queueing every file of the burst at once. The files of a
+session are extracted one at a time, in order, as they share their text
+output. Files of a session queued while it waits are extracted together, in
+one pass that rewrites the output from every settled file of the session, so
+ingesting a file again never duplicates it.
+
+Example
+-------
+    $ python ingest.py inbox --destination output -j 4
+
+Watches inbox until interrupted, and extracts every session file dropped into
+it to output, on 4 processes.
+
+    $ python ingest.py inbox --destination output --once
+
+Extracts every session file already in inbox, and exits.
+
+Attributes
+----------
+INTERVAL : float
+    How many seconds to wait between polls of the inbox
+
+SETTLE : float
+    How many seconds a session file must go unmodified before it is queued,
+    even if it has only been seen by a single poll
+
+QUEUE_SIZE : int
+    How many session files can be waiting to be extracted at once, per worker
+'''
+import argparse                 # For command line arguments
+import asyncio                  # For watching the inbox while extracting
+import contextlib               # For session locks
+from concurrent.futures import ProcessPoolExecutor  # For extracting
+import os                       # For file IO
+import time                     # For ingest latency
+import cpap_extraction          # For extracting session files
+import instrumentation          # For --profile counters and histograms
+
+
+class Ingestor(object):
+    '''
+    Watches an inbox directory, and extracts each settled session file in it
+    with extractor, an Extractor
+
+    Example
+    -------
+        extractor = cpap_extraction.Extractor(destination='output')
+        asyncio.run(Ingestor('inbox', extractor).run())
+
+    Attributes
+    ----------
+    inbox : Path
+        The directory to watch, including its subdirectories
+
+    extractor : Extractor
+        Extracts each session file, and holds the destination and format
+
+    workers : int
+        How many session files are extracted at once
+
+    queue_size : int
+        How many settled session files can wait to be extracted, before
+        polling stops
+
+    interval, settle : float
+        See INTERVAL and SETTLE
+
+    manifest : Dictionary (optional)
+        If given, session files recorded in it are not extracted again, and
+        every extracted file is recorded in it, see
+        cpap_extraction.load_manifest
+
+    report : function (optional)
+        Called with (source, output, error) once each session file is
+        extracted, by default errors are printed
+
+    seen : Dictionary {Path: (int, int)}
+        The size and modification time of each session file at the last poll
+
+    queued : Dictionary {Path: (int, int)}
+        The size and modification time of each session file when it was last
+        queued, so it is only queued again if it changes
+
+    sessions : Dictionary {Path: [asyncio.Lock, int]}
+        The lock of each session being extracted, and how many workers hold
+        or wait for it, see session_lock
+
+    waiting : Dictionary {Path: Dictionary {Path: int}}
+        The files of each session that are queued but not extracted yet, and
+        when each was queued. A worker takes all of a session's waiting files
+        at once, see extract
+
+    pending : int
+        How many session files the last poll saw still being written
+    '''
+
+    def __init__(self, inbox, extractor, workers=None, queue_size=None,
+                 interval=None, settle=None, manifest=None, report=None):
+        self.inbox = inbox
+        self.extractor = extractor
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size or QUEUE_SIZE * self.workers
+        self.interval = INTERVAL if interval is None else interval
+        self.settle = SETTLE if settle is None else settle
+        self.manifest = manifest
+        self.report = report or self.print_result
+
+        self.seen = {}
+        self.queued = {}
+        self.sessions = {}
+        self.waiting = {}
+        self.pending = 0
+
+    def print_result(self, source, output, error):
+        '''
+        Prints that source could not be extracted, or, if verbose, where it
+        was extracted to
+        '''
+        if error is not None:
+            print('ERROR: {} could not be extracted: {}'.format(source, error))
+        elif self.extractor.verbose:
+            print('Extracted {} to {}'.format(source, output))
+
+    def poll(self):
+        '''
+        Polls the inbox for settled session files that have not been queued
+
+        Returns
+        -------
+        settled : Path array
+            The settled session files, grouped by session, and sorted by
+            extension within each session
+        '''
+        now = time.time_ns()
+        seen = {}
+        settled = []
+        self.pending = 0
+        for sources in cpap_extraction.find_sessions(self.inbox).values():
+            for source in sources:
+                try:
+                    stat = os.stat(source)
+                except FileNotFoundError:
+                    # Removed since the directory was listed
+                    continue
+
+                current = (stat.st_size, stat.st_mtime_ns)
+                seen[source] = current
+                if self.queued.get(source) == current:
+                    continue
+
+                if (self.seen.get(source) != current and
+                        now - stat.st_mtime_ns < self.settle * 1e9):
+                    # Still being written
+                    self.pending += 1
+                    continue
+
+                self.queued[source] = current
+                if (self.manifest is not None and
+                        cpap_extraction.is_unchanged(self.manifest, source)):
+                    continue
+
+                settled.append(source)
+
+        self.seen = seen
+        # Forget files that have left the inbox
+        self.queued = {source: queued
+                       for source, queued in self.queued.items()
+                       if source in seen}
+        return settled
+
+    @staticmethod
+    def session_of(source):
+        '''
+        Returns the session source belongs to, its path without extensions
+        '''
+        (name, archive) = cpap_extraction.split_archive(source)
+        return os.path.splitext(name)[0]
+
+    def session_files(self, source):
+        '''
+        Returns every queued file of the session source belongs to, source
+        included, sorted by extension. Files still being written are left
+        out, they are added once they settle, and files that have left the
+        inbox are forgotten by poll
+        '''
+        session = self.session_of(source)
+        return sorted(queued for queued in self.queued
+                      if self.session_of(queued) == session)
+
+    @contextlib.asynccontextmanager
+    async def session_lock(self, source):
+        '''
+        Holds the lock of the session source belongs to, so the files of a
+        session are extracted one at a time, in the order they were queued.
+        Locks are forgotten once no worker holds or waits for them
+        '''
+        session = self.session_of(source)
+        entry = self.sessions.setdefault(session, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.sessions[session]
+
+    async def watch(self, queue, once=False):
+        '''
+        Polls the inbox, and queues every settled session file. Putting a
+        file into a full queue waits for a worker to take one out, so polling
+        is held back while the workers are busy
+
+        Parameters
+        ----------
+        queue : asyncio.Queue
+            The queue of (queued time, source) to be extracted
+
+        once : bool (optional)
+            If True, poll the inbox until every session file in it has
+            settled, and return
+        '''
+        while True:
+            for source in self.poll():
+                queued = time.perf_counter_ns()
+                self.waiting.setdefault(self.session_of(source), {})[
+                    source] = queued
+                await queue.put((queued, source))
+                if instrumentation.ENABLED:
+                    instrumentation.count('files queued')
+
+            if once and not self.pending:
+                return
+
+            await asyncio.sleep(self.interval)
+
+    async def extract(self, queue, executor):
+        '''
+        Extracts the session of each file taken from queue on executor,
+        until cancelled. Every waiting file of the session is extracted in
+        one pass, so the files of a session queued together cost a single
+        extraction, and the queue entries of the files already extracted
+        are passed over
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            (queued, source) = await queue.get()
+            try:
+                session = self.session_of(source)
+                async with self.session_lock(source):
+                    batch = self.waiting.pop(session, None)
+                    if not batch:
+                        # Extracted along with an earlier file
+                        continue
+
+                    try:
+                        (results, fingerprints) = await loop.run_in_executor(
+                            executor, extract_session_files, self.extractor,
+                            self.session_files(source), sorted(batch),
+                            self.manifest is not None)
+                    except Exception as error:
+                        (results, fingerprints) = (
+                            [(extracted, None, error)
+                             for extracted in sorted(batch)], None)
+
+                for (extracted, output, error) in results:
+                    if error is not None:
+                        self.report(extracted, None, error)
+                        continue
+
+                    if self.manifest is not None:
+                        cpap_extraction.record_file(self.manifest, extracted,
+                                                    output,
+                                                    fingerprints[extracted])
+                    if instrumentation.ENABLED:
+                        instrumentation.count('files ingested')
+                        instrumentation.observe(
+                            'ingest latency',
+                            time.perf_counter_ns() - batch[extracted])
+                    self.report(extracted, output, None)
+            finally:
+                queue.task_done()
+
+    async def run(self, once=False, executor=None):
+        '''
+        Watches the inbox, and extracts every settled session file in it,
+        until cancelled
+
+        Parameters
+        ----------
+        once : bool (optional)
+            If True, extract the session files already in the inbox, once
+            they have settled, and return once they are all extracted
+
+        executor : Executor (optional)
+            Runs Extractor.extract_file, by default a ProcessPoolExecutor of
+            workers processes
+        '''
+        queue = asyncio.Queue(self.queue_size)
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        workers = [asyncio.ensure_future(self.extract(queue, executor))
+                   for worker in range(self.workers)]
+        try:
+            await self.watch(queue, once)
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if own_executor:
+                executor.shutdown()
+
+
+def extract_session_files(extractor, sources, batch, fingerprinted=False):
+    '''
+    Extracts batch, the waiting files of a session, with extractor, in a
+    worker process. With text output, which the files of a session share,
+    every file of the session in sources is extracted in a single pass,
+    replacing the output rather than appending to it, see
+    Extractor.extract_session. Other formats have an output per file, which
+    is always replaced, so only batch is extracted
+
+    Parameters
+    ----------
+    fingerprinted : bool (optional)
+        If True, fingerprint each file just before it is extracted, for the
+        manifest, see cpap_extraction.record_file
+
+    Returns
+    -------
+    (results, fingerprints) : (Array <(source, output, error)>, Dictionary)
+        The result of each file of batch, see Extractor.extract_session,
+        and its fingerprint, or None if not fingerprinted. Errors in the
+        rest of sources are left for their own extraction to report
+    '''
+    fingerprints = {} if fingerprinted else None
+    if extractor.output_format == 'txt':
+        results = extractor.extract_session(sorted(set(sources) | set(batch)),
+                                            fingerprints)
+        return ([result for result in results if result[0] in batch],
+                fingerprints)
+
+    results = []
+    for source in batch:
+        try:
+            if fingerprinted:
+                fingerprints[source] = cpap_extraction.fingerprint(source)
+            results.append((source, extractor.extract_file(source), None))
+        except Exception as error:
+            results.append((source, None, error))
+
+    return results, fingerprints
+
+
+def setup_args():
+    '''
+    Sets up command-line arguments
+
+    Returns
+    -------
+    args : Parsed Arguments
+        See https://docs.python.org/3/library/argparse.html
+    '''
+    parser = argparse.ArgumentParser(description='CPAP_data_ingestion')
+    parser.add_argument('inbox', nargs=1,
+                        help='directory that session files are dropped into')
+    parser.add_argument('--destination', nargs=1, default='.',
+                        help='path to place extracted files')
+    parser.add_argument('-v', action='store_true', help='be VERBOSE')
+    parser.add_argument('--format', default='txt',
+                        choices=(['txt'] +
+                                 list(cpap_extraction.COLUMNAR_FORMATS) +
+                                 list(cpap_extraction.JSON_FORMATS) +
+                                 [cpap_extraction.SQLITE_FORMAT]),
+                        help='format of the extracted files')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes to extract session files '
+                             'with (default: one per CPU)')
+    parser.add_argument('--queue-size', type=int, default=None,
+                        help='how many settled session files can wait to be '
+                             'extracted (default: {} per worker)'.format(
+                                 QUEUE_SIZE))
+    parser.add_argument('--interval', type=float, default=INTERVAL,
+                        help='seconds between polls of the inbox')
+    parser.add_argument('--settle', type=float, default=SETTLE,
+                        help='seconds a session file must go unmodified '
+                             'before it is extracted')
+    parser.add_argument('--once', action='store_true',
+                        help='extract the session files already in the '
+                             'inbox, and exit')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip session files that were extracted before, '
+                             'even by an earlier run')
+    parser.add_argument('--profile', action='store_true',
+                        help='count queued and ingested files, time how long '
+                             'each waited, and print a summary')
+
+    return parser.parse_args()
+
+
+def main():
+    '''
+    Ingests the inbox given on the command line until interrupted, or, with
+    --once, until every session file already in it is extracted
+    '''
+    args = setup_args()
+    (inbox,) = args.inbox
+    (destination,) = args.destination
+    extractor = cpap_extraction.Extractor(inbox, destination, args.v,
+                                          output_format=args.format)
+
+    manifest = None
+    manifest_path = os.path.join(destination,
+                                 cpap_extraction.MANIFEST_NAME)
+    if args.incremental:
+        manifest = cpap_extraction.load_manifest(
+            manifest_path, settings=extractor.output_settings())
+
+    if args.profile:
+        instrumentation.enable()
+
+    ingestor = Ingestor(inbox, extractor, args.workers, args.queue_size,
+                        args.interval, args.settle, manifest)
+    start = time.perf_counter()
+    try:
+        asyncio.run(ingestor.run(args.once))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if manifest is not None:
+            cpap_extraction.save_manifest(manifest, manifest_path)
+        if args.profile:
+            seconds = time.perf_counter() - start
+            print(''.join(instrumentation.summary(seconds)), end='')
+
+
+# Global variables
+INTERVAL = 1.0
+SETTLE = 2.0
+QUEUE_SIZE = 4
+
+
+if __name__ == '__main__':
+    main()
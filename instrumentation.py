@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+'''
+This module collects counters and timing histograms from the hot paths of
+cpap_extraction, such as the number of bytes read, packets split and fields
+decoded, and how long each write took.
+
+Instrumentation is disabled by default. Every hook in cpap_extraction is
+guarded by a check of ENABLED, so while it is disabled, the only cost is that
+check. Times are measured with time.perf_counter_ns().
+
+Example
+-------
+    $ python cpap_extraction.py 38611.005 --profile
+
+Extracts 38611.005, and prints a summary of the counters and histograms once
+the run is done.
+
+Attributes
+----------
+ENABLED : bool
+    If True, collect counters and histograms
+
+COUNTERS : dictionary {string: int}
+    The total of each counter, e.g., 'bytes read'
+
+HISTOGRAMS : dictionary {string: Histogram}
+    The distribution of each timing, e.g., 'write latency'
+'''
+from time import perf_counter_ns    # For timing
+
+
+class Histogram(object):
+    '''
+    A histogram of timings, in nanoseconds. Timings are counted in
+    power-of-two buckets, so the histogram stays small no matter how many
+    timings are added.
+
+    Attributes
+    ----------
+    count : int
+        How many timings were added
+
+    total : int
+        The sum of the timings
+
+    minimum, maximum : int
+        The fastest and slowest timing
+
+    buckets : dictionary {int: int}
+        How many timings fell in each bucket. Bucket b holds timings from
+        2 ** (b - 1) up to 2 ** b nanoseconds
+    '''
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.buckets = {}
+
+    def add(self, nanoseconds):
+        '''
+        Adds a single timing to the histogram
+        '''
+        self.count += 1
+        self.total += nanoseconds
+        if self.minimum is None or nanoseconds < self.minimum:
+            self.minimum = nanoseconds
+        if self.maximum is None or nanoseconds > self.maximum:
+            self.maximum = nanoseconds
+
+        bucket = nanoseconds.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other):
+        '''
+        Adds every timing of other, another Histogram, to this histogram
+        '''
+        if other.count == 0:
+            return
+
+        self.count += other.count
+        self.total += other.total
+        if self.minimum is None or other.minimum < self.minimum:
+            self.minimum = other.minimum
+        if self.maximum is None or other.maximum > self.maximum:
+            self.maximum = other.maximum
+
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, percent):
+        '''
+        Estimates a percentile of the timings, as the upper bound of the
+        bucket it falls in
+
+        Parameters
+        ----------
+        percent : float
+            The percentile, from 0 to 100
+
+        Returns
+        -------
+        nanoseconds : int
+            The estimate, never more than maximum
+        '''
+        if self.count == 0:
+            return 0
+
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(1 << bucket, self.maximum)
+
+        return self.maximum
+
+
+def enable():
+    '''
+    Enables instrumentation, and resets every counter and histogram
+    '''
+    global ENABLED
+    reset()
+    ENABLED = True
+
+
+def disable():
+    '''
+    Disables instrumentation, the counters and histograms are kept
+    '''
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    '''
+    Resets every counter and histogram
+    '''
+    COUNTERS.clear()
+    HISTOGRAMS.clear()
+
+
+def count(name, amount=1):
+    '''
+    Adds amount to the counter name
+
+    Notes
+    ------
+    Callers on a hot path should check ENABLED before calling this
+    '''
+    COUNTERS[name] = COUNTERS.get(name, 0) + amount
+
+
+def observe(name, nanoseconds):
+    '''
+    Adds a timing, in nanoseconds, to the histogram name
+    '''
+    histogram = HISTOGRAMS.get(name)
+    if histogram is None:
+        histogram = HISTOGRAMS[name] = Histogram()
+    histogram.add(nanoseconds)
+
+
+def timed(name):
+    '''
+    A decorator that adds how long each call of the decorated function takes
+    to the histogram name, while instrumentation is enabled
+
+    Parameters
+    ----------
+    name : String
+        The histogram to add to, e.g., 'write latency'
+    '''
+    from functools import wraps
+
+    def decorator(orig_func):
+        @wraps(orig_func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return orig_func(*args, **kwargs)
+
+            start = perf_counter_ns()
+            try:
+                return orig_func(*args, **kwargs)
+            finally:
+                observe(name, perf_counter_ns() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot():
+    '''
+    Returns a copy of every counter and histogram, e.g., to send back from a
+    worker process to be merged into the parent's with merge()
+    '''
+    histograms = {}
+    for name, histogram in HISTOGRAMS.items():
+        copied = Histogram()
+        copied.merge(histogram)
+        histograms[name] = copied
+
+    return dict(COUNTERS), histograms
+
+
+def merge(counters_and_histograms):
+    '''
+    Adds a snapshot(), e.g., from a worker process, to the counters and
+    histograms
+    '''
+    (counters, histograms) = counters_and_histograms
+    for name, amount in counters.items():
+        count(name, amount)
+
+    for name, histogram in histograms.items():
+        if name not in HISTOGRAMS:
+            HISTOGRAMS[name] = Histogram()
+        HISTOGRAMS[name].merge(histogram)
+
+
+def summary(seconds=None):
+    '''
+    Formats the counters and histograms as a summary of the run
+
+    Parameters
+    ----------
+    seconds : float (optional)
+        How long the run took. If given, the rate of each counter is included
+
+    Returns
+    -------
+    lines : String array
+        The summary, one line per counter and histogram
+    '''
+    lines = ['---PROFILE---\n']
+    if seconds is not None:
+        lines.append('Run time: {:.3f} s\n'.format(seconds))
+
+    for name in sorted(COUNTERS):
+        line = '{}: {}'.format(name, COUNTERS[name])
+        if seconds:
+            line += ' ({:.0f}/s)'.format(COUNTERS[name] / seconds)
+        lines.append(line + '\n')
+
+    for name in sorted(HISTOGRAMS):
+        histogram = HISTOGRAMS[name]
+        lines.append('{}: {} calls, mean {:.1f} us, p50 {:.1f} us, '
+                     'p99 {:.1f} us, max {:.1f} us\n'.format(
+                         name, histogram.count,
+                         histogram.total / histogram.count / 1000,
+                         histogram.percentile(50) / 1000,
+                         histogram.percentile(99) / 1000,
+                         histogram.maximum / 1000))
+
+    return lines
+
+
+# Global variables
+ENABLED = False
+COUNTERS = {}
+HISTOGRAMS = {}
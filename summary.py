@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+'''
+This module summarises each night of a CPAP profile, e.g., its usage hours,
+AHI, and mean and percentile pressure and leak, straight from the session
+files, without extracting them first.
+
+Each session file is read in a single streaming pass. Its packets are decoded
+a batch at a time, and every batch is folded into running statistics, so
+memory use does not grow with the length of a session. Means and variances
+are kept by Welford's method, and the percentiles of 8-bit fields, such as
+Pressure and Leak, come from an exact histogram of their 256 possible
+values. Sessions are summarised on a pool of processes, and merged into
+nights.
+
+Example
+-------
+    $ python summary.py Profiles/John/PRS1_P12345 --csv nights.csv
+
+Prints a table of the nights in the profile, and also writes it to
+nights.csv.
+
+Attributes
+----------
+APNEA_CODES, HYPOPNEA_CODES : tuple
+    The Event codes of .002 event files counted as apneas, and as hypopneas,
+    towards the AHI, after the PRS1 loader of SleepyHead
+
+NIGHT_START_HOUR : int
+    The hour, in UTC, a night starts at. Sessions starting before it count
+    towards the night before
+
+BATCH_SIZE : int
+    How many bytes of packets are decoded at a time
+
+COLUMNS : tuple
+    The columns of the summary table, see summary_rows
+'''
+import argparse                 # For command line arguments
+import csv                      # For writing the summary table
+from concurrent.futures import ProcessPoolExecutor, as_completed  # Profiles
+import warnings                 # For raising warnings
+import cpap_extraction          # For reading session files
+
+
+class RunningStats(object):
+    '''
+    The count, mean, variance, minimum and maximum of a stream of values,
+    kept in constant memory. Each batch of values is combined with the
+    statistics so far by Chan et al.'s parallel form of Welford's method,
+    which stays accurate over millions of values
+
+    Attributes
+    ----------
+    count : int
+        How many values were added
+
+    mean : float
+        The mean of the values
+
+    m2 : float
+        The sum of the squared differences of the values from their mean
+
+    minimum, maximum : number
+        The smallest and largest value, None if there are no values
+    '''
+    __slots__ = ('count', 'mean', 'm2', 'minimum', 'maximum')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    @property
+    def variance(self):
+        '''
+        The sample variance of the values, 0 for fewer than two values
+        '''
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    @property
+    def deviation(self):
+        '''
+        The sample standard deviation of the values
+        '''
+        return self.variance ** 0.5
+
+    def add(self, values):
+        '''
+        Adds values, a NumPy array, to the statistics
+        '''
+        if len(values) == 0:
+            return
+
+        values = values.astype('f8')
+        other = RunningStats()
+        other.count = len(values)
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.minimum = values.min().item()
+        other.maximum = values.max().item()
+        self.merge(other)
+
+    def merge(self, other):
+        '''
+        Adds every value of other, another RunningStats, to the statistics
+        '''
+        if other.count == 0:
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+        if self.minimum is None or other.minimum < self.minimum:
+            self.minimum = other.minimum
+        if self.maximum is None or other.maximum > self.maximum:
+            self.maximum = other.maximum
+
+
+class ByteHistogram(object):
+    '''
+    An exact histogram of 8-bit values, such as the Pressure and Leak of a
+    waveform, from which any percentile can be read. It holds one count per
+    possible value, no matter how many values are added
+
+    Attributes
+    ----------
+    offset : int
+        The smallest possible value, -128 for signed values, otherwise 0
+
+    counts : numpy.ndarray
+        How many times each of the 256 possible values was added
+    '''
+    __slots__ = ('offset', 'counts')
+
+    def __init__(self, signed=False):
+        import numpy
+
+        self.offset = -128 if signed else 0
+        self.counts = numpy.zeros(256, numpy.int64)
+
+    @property
+    def count(self):
+        '''
+        How many values were added
+        '''
+        return int(self.counts.sum())
+
+    def add(self, values):
+        '''
+        Adds values, a NumPy array of 8-bit integers, to the histogram
+        '''
+        import numpy
+
+        self.counts += numpy.bincount(values.astype('i2') - self.offset,
+                                      minlength=256)
+
+    def merge(self, other):
+        '''
+        Adds every value of other, another ByteHistogram, to the histogram
+        '''
+        self.counts += other.counts
+
+    def percentile(self, percent):
+        '''
+        Returns the value below which percent of the values fall, or None if
+        there are no values
+
+        Parameters
+        ----------
+        percent : float
+            The percentile, from 0 to 100
+        '''
+        import numpy
+
+        total = self.count
+        if total == 0:
+            return None
+
+        rank = max(percent / 100 * total, 1)
+        value = int(numpy.searchsorted(numpy.cumsum(self.counts), rank))
+        return value + self.offset
+
+
+class Summary(object):
+    '''
+    The statistics of a session, or of a night of sessions merged together
+
+    Attributes
+    ----------
+    start, end : int
+        The UNIX time, in milliseconds, the first session started, and the
+        last ended
+
+    sessions : int
+        How many sessions are summarised
+
+    usage : int
+        How long the sessions lasted in total, in milliseconds
+
+    events : Dictionary {int: int}
+        How many events of each Event code the sessions had
+
+    stats : Dictionary {Field name: RunningStats}
+        The statistics of each field of the waveforms
+
+    histograms : Dictionary {Field name: ByteHistogram}
+        The histogram of each 8-bit field of the waveforms
+    '''
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.sessions = 0
+        self.usage = 0
+        self.events = {}
+        self.stats = {}
+        self.histograms = {}
+
+    def add_headers(self, headers):
+        '''
+        Adds a session, from the headers of its files, whose start and end
+        times span it
+        '''
+        start = min(header.start_time for header in headers)
+        end = max(header.end_time for header in headers)
+        self.sessions += 1
+        self.usage += max(end - start, 0)
+        self.start = start if self.start is None else min(self.start, start)
+        self.end = end if self.end is None else max(self.end, end)
+
+    def add_samples(self, samples):
+        '''
+        Adds samples, decoded by decode_samples. Event samples are counted by
+        their Event code, the fields of any other samples are added to their
+        statistics
+        '''
+        import numpy
+
+        if 'Event code' in samples.dtype.names:
+            counts = numpy.bincount(samples['Event code'])
+            for code in numpy.flatnonzero(counts):
+                self.events[int(code)] = (self.events.get(int(code), 0) +
+                                          int(counts[code]))
+            return
+
+        for field in samples.dtype.names:
+            values = samples[field]
+            if values.dtype.kind not in 'iuf':
+                continue
+
+            if field not in self.stats:
+                self.stats[field] = RunningStats()
+            self.stats[field].add(values)
+
+            if values.dtype.kind in 'iu' and values.dtype.itemsize == 1:
+                if field not in self.histograms:
+                    self.histograms[field] = ByteHistogram(
+                        values.dtype.kind == 'i')
+                self.histograms[field].add(values)
+
+    def merge(self, other):
+        '''
+        Adds every session of other, another Summary
+        '''
+        self.sessions += other.sessions
+        self.usage += other.usage
+        if other.start is not None:
+            self.start = (other.start if self.start is None
+                          else min(self.start, other.start))
+            self.end = (other.end if self.end is None
+                        else max(self.end, other.end))
+
+        for code, count in other.events.items():
+            self.events[code] = self.events.get(code, 0) + count
+        for field, stats in other.stats.items():
+            self.stats.setdefault(field, RunningStats()).merge(stats)
+        for field, histogram in other.histograms.items():
+            if field not in self.histograms:
+                self.histograms[field] = ByteHistogram()
+                self.histograms[field].offset = histogram.offset
+            self.histograms[field].merge(histogram)
+
+    @property
+    def hours(self):
+        '''
+        The usage, in hours
+        '''
+        return self.usage / 3600000
+
+    def count_events(self, codes):
+        '''
+        Returns how many events had one of codes
+        '''
+        return sum(self.events.get(code, 0) for code in codes)
+
+    def ahi(self):
+        '''
+        Returns the apnea-hypopnea index, the apneas and hypopneas per hour
+        of usage, or None if there was no usage
+        '''
+        if self.usage <= 0:
+            return None
+        return (self.count_events(APNEA_CODES) +
+                self.count_events(HYPOPNEA_CODES)) / self.hours
+
+
+def summarize_file(source, summary=None, skipped=None):
+    '''
+    Adds the samples of source, a session file, to summary, in a single
+    streaming pass. Packets are decoded BATCH_SIZE bytes at a time
+
+    Parameters
+    ----------
+    source : Path
+        The session file
+
+    summary : Summary (optional)
+        The summary to add to, a new one by default
+
+    skipped : Array <(int, int)> (optional)
+        If given, malformed packets are skipped, see
+        cpap_extraction.resync_packets
+
+    Returns
+    -------
+    (header, summary) : (Header, Summary)
+        The header of source, and the summary added to
+    '''
+    if summary is None:
+        summary = Summary()
+
+    with cpap_extraction.open_stream(source) as data_file:
+        (header, parser, packets) = cpap_extraction.split_session(
+            data_file, source, skipped=skipped)
+        next(packets, None)
+        if parser.fields is None:
+            packets.close()
+            return header, summary
+
+        batch = []
+        size = 0
+        sample_size = parser.layout.size
+        for packet in packets:
+            # Packets are decoded together, so each has to hold whole
+            # samples, or the samples after it would be shifted
+            packet = packet[:len(packet) - len(packet) % sample_size]
+            batch.append(packet)
+            size += len(packet)
+            if size >= BATCH_SIZE:
+                summary.add_samples(parser.decode(batch))
+                (batch, size) = ([], 0)
+
+        if batch:
+            summary.add_samples(parser.decode(batch))
+
+    return header, summary
+
+
+def summarize_session(sources):
+    '''
+    Summarises the files of a single session, see summarize_file
+
+    Returns
+    -------
+    summary : Summary
+        The summary of the session
+    '''
+    summary = Summary()
+    headers = [summarize_file(source, summary)[0] for source in sources]
+    summary.add_headers(headers)
+    return summary
+
+
+def night_of(unixtime):
+    '''
+    Returns the night a UNIX time, in milliseconds, falls in, as the date the
+    night starts on, e.g., '2019-03-21' for 2019-03-22_02-00-00, see
+    NIGHT_START_HOUR
+    '''
+    seconds = unixtime // 1000 - NIGHT_START_HOUR * 3600
+    return cpap_extraction.format_unix_time(seconds)[:10]
+
+
+def summarize_profile(profile, workers=None):
+    '''
+    Summarises every session in profile on a pool of worker processes, and
+    merges the sessions of each night
+
+    Parameters
+    ----------
+    profile : Path
+        A profile directory, see cpap_extraction.find_sessions
+
+    workers : int (optional)
+        How many processes to summarise with, None for one per CPU
+
+    Returns
+    -------
+    nights : Array <(String, Summary)>
+        The summary of each night, sorted by night. Sessions that can't be
+        read are warned about, and left out
+    '''
+    nights = {}
+    sessions = cpap_extraction.find_sessions(profile)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(summarize_session, sources): session
+                   for session, sources in sessions.items()}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as error:
+                warnings.warn('WARNING: session {} could not be summarised: '
+                              '{}'.format(futures[future], error))
+                continue
+
+            night = night_of(summary.start)
+            if night not in nights:
+                nights[night] = Summary()
+            nights[night].merge(summary)
+
+    return sorted(nights.items())
+
+
+def summary_rows(nights):
+    '''
+    Formats the summary of each night as a row of the summary table
+
+    Parameters
+    ----------
+    nights : Array <(String, Summary)>
+        The summary of each night, from summarize_profile
+
+    Returns
+    -------
+    rows : Array <Dictionary {String: String}>
+        One row per night, holding each of COLUMNS. Statistics that can't be
+        computed, e.g., the pressure of a night without waveforms, are empty
+    '''
+    def number(value, digits=1):
+        return '' if value is None else '{:.{}f}'.format(value, digits)
+
+    rows = []
+    for night, summary in nights:
+        pressure = summary.stats.get('Pressure')
+        leak = summary.stats.get('Leak')
+        pressures = summary.histograms.get('Pressure')
+        leaks = summary.histograms.get('Leak')
+        rows.append({
+            'Night': night,
+            'Sessions': str(summary.sessions),
+            'Usage (h)': number(summary.hours, 2),
+            'Events': str(sum(summary.events.values())),
+            'AHI': number(summary.ahi(), 2),
+            'Pressure mean': number(pressure and pressure.mean),
+            'Pressure sd': number(pressure and pressure.deviation),
+            'Pressure p50': number(pressures and pressures.percentile(50),
+                                   0),
+            'Pressure p95': number(pressures and pressures.percentile(95),
+                                   0),
+            'Leak mean': number(leak and leak.mean),
+            'Leak p95': number(leaks and leaks.percentile(95), 0)})
+
+    return rows
+
+
+def format_table(rows):
+    '''
+    Formats rows, from summary_rows, as a text table, one line per night
+
+    Returns
+    -------
+    lines : String array
+        The heading, and a line per row
+    '''
+    widths = [max([len(column)] + [len(row[column]) for row in rows])
+              for column in COLUMNS]
+    lines = []
+    for values in [COLUMNS] + [[row[column] for column in COLUMNS]
+                               for row in rows]:
+        lines.append('  '.join(value.rjust(width)
+                               for value, width in zip(values, widths)) +
+                     '\n')
+
+    return lines
+
+
+def write_csv(rows, output):
+    '''
+    Writes rows, from summary_rows, to output as CSV
+    '''
+    with open(output, 'w', newline='') as output_file:
+        writer = csv.DictWriter(output_file, COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    '''
+    Summarises the profile given on the command line, and prints the table
+    '''
+    parser = argparse.ArgumentParser(description='CPAP_data_summary')
+    parser.add_argument('profile', nargs=1, help='path to a CPAP profile')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='number of processes to summarise sessions '
+                             'with (default: one per CPU)')
+    parser.add_argument('--csv', default=None,
+                        help='also write the table to this CSV file')
+    args = parser.parse_args()
+
+    rows = summary_rows(summarize_profile(args.profile[0], args.workers))
+    print(''.join(format_table(rows)), end='')
+    if args.csv is not None:
+        write_csv(rows, args.csv)
+
+
+# Global variables
+APNEA_CODES = (0x06, 0x07)
+HYPOPNEA_CODES = (0x0a,)
+NIGHT_START_HOUR = 12
+BATCH_SIZE = 1 << 16
+COLUMNS = ('Night', 'Sessions', 'Usage (h)', 'Events', 'AHI',
+           'Pressure mean', 'Pressure sd', 'Pressure p50', 'Pressure p95',
+           'Leak mean', 'Leak p95')
+
+
+if __name__ == '__main__':
+    main()
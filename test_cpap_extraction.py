@@ -1,12 +1,70 @@
 '''
-This module contains unittests for the cpap_extraction module
+This module contains unittests for the cpap_extraction module, and the
+modules built on it
 '''
 import unittest         # For testing
+import asyncio          # For running the Ingestor
 import os               # For file I/O
 import io               # For reading strings as files
+import json             # For reading back JSON output
+import struct           # For packing test packets
+import tempfile         # For writing real files to map
 from mock import Mock   # For mocking input and output files
 from mock import patch  # For patching out file I/O
 import cpap_extraction  # The module to be tested
+import ingest           # The inbox ingestion service
+import summary          # The nightly summaries
+import instrumentation  # For checking the instrumentation hooks
+
+try:
+    import pyarrow      # For reading back columnar output
+except ImportError:
+    pyarrow = None
+
+
+class TestInstrumentation(unittest.TestCase):
+    '''
+    Tests the instrumentation hooks in cpap_extraction, which count bytes
+    read, packets split and fields decoded, and time writes, only while
+    instrumentation is enabled.
+
+    Methods
+    -------
+        testEnabled
+            Tests that splitting and extracting packets is counted
+        testDisabled
+            Tests that nothing is counted while instrumentation is disabled
+        testHistogram
+            Tests the percentiles of a timing histogram
+    '''
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_enabled(self):
+        instrumentation.enable()
+        data_file = io.BytesIO(b'\x2a\x00\xff\xff\xff\xff\xc3\x01')
+        packets = cpap_extraction.read_packets(data_file, b'\xff\xff\xff\xff')
+        cpap_extraction.extract_packet(packets[0], {'Test short': 'H'})
+
+        self.assertEqual(instrumentation.COUNTERS, {'bytes read': 8,
+                                                    'packets split': 2,
+                                                    'fields decoded': 1})
+
+    def test_disabled(self):
+        data_file = io.BytesIO(b'\x2a\x00\xff\xff\xff\xff\xc3\x01')
+        cpap_extraction.read_packets(data_file, b'\xff\xff\xff\xff')
+        self.assertEqual(instrumentation.COUNTERS, {})
+
+    def test_histogram(self):
+        histogram = instrumentation.Histogram()
+        for nanoseconds in [100, 200, 300, 5000]:
+            histogram.add(nanoseconds)
+
+        self.assertEqual(histogram.percentile(50), 256)
+        self.assertEqual(histogram.percentile(100), 5000)
+        self.assertEqual(histogram.minimum, 100)
 
 
 class TestOpenFile(unittest.TestCase):
@@ -66,6 +124,12 @@ class TestReadPacket(unittest.TestCase):
         testInvalidDelimeter
             Tests whether read_file properly raises a ValueError if delimeter
             is not of type bytes
+        testDelimeterStraddlesBlocks
+            Tests whether read_file finds a delimeter that is split across two
+            blocks, and leaves the seek point just past it
+        testPartialDelimeter
+            Tests whether read_file keeps bytes that look like the start of
+            the delimeter, but aren't
     '''
 
     def test_normal(self):
@@ -104,6 +168,21 @@ class TestReadPacket(unittest.TestCase):
         with self.assertRaises(TypeError):
             packet = cpap_extraction.read_packet(data_file, delimeter)
 
+    def test_delimeter_straddles_blocks(self):
+        data_file = io.BytesIO(b'\x34\x32\x01\xff\xff\xff\xff\x42')
+        delimeter = b'\xff\xff\xff\xff'
+        packet = cpap_extraction.read_packet(data_file, delimeter, 4)
+
+        self.assertEqual(packet, b'\x34\x32\x01')
+        self.assertEqual(data_file.read(), b'\x42')
+
+    def test_partial_delimeter(self):
+        data_file = io.BytesIO(b'\x34\xff\xff\x32\x01\x02')
+        delimeter = b'\xff\xff\xff\xff'
+        packet = cpap_extraction.read_packet(data_file, delimeter)
+
+        self.assertEqual(packet, b'\x34\xff\xff\x32\x01\x02')
+
 
 class TestReadPackets(unittest.TestCase):
     '''
@@ -118,6 +197,12 @@ class TestReadPackets(unittest.TestCase):
             an array of size 2, and that the first index of the array contains
             the first packet, and the second index of the array contains the
             second packet
+        testDelimeterStraddlesBlocks
+            Tests that read_packets finds delimeters split across blocks, for
+            every block size
+        testEmptyPacket
+            Tests that read_packets stops at an empty packet, the same as
+            calling read_packet until it returns an empty packet
 
     Notes
     ------
@@ -135,6 +220,626 @@ class TestReadPackets(unittest.TestCase):
         self.assertEqual(packets[0], b'\x03\x0c\x01\x00')
         self.assertEqual(packets[1], b'\x45')
 
+    def test_delimeter_straddles_blocks(self):
+        data = (b'\x03\x0c\x01\xff\xff\xff\xff\x45\xff\x46'
+                b'\xff\xff\xff\xff\x47\x48')
+        delimeter = b'\xff\xff\xff\xff'
+
+        for block_size in range(1, len(data) + 1):
+            data_file = io.BytesIO(data)
+            packets = cpap_extraction.read_packets(data_file, delimeter,
+                                                   block_size)
+            self.assertEqual(packets, [b'\x03\x0c\x01', b'\x45\xff\x46',
+                                       b'\x47\x48'])
+
+    def test_empty_packet(self):
+        data_file = io.BytesIO(b'\x03\xff\xff\xff\xff\xff\xff\xff\xff\x45')
+        delimeter = b'\xff\xff\xff\xff'
+
+        packets = cpap_extraction.read_packets(data_file, delimeter)
+        self.assertEqual(packets, [b'\x03'])
+
+
+class TestIterPackets(unittest.TestCase):
+    '''
+    Tests the iter_packets method, which yields the packets in a data file
+    one at a time.
+
+    Methods
+    -------
+        testNormal
+            Tests that iter_packets yields the same packets as read_packets
+        testLazy
+            Tests that iter_packets only reads as much of the data file as it
+            needs to yield the first packet
+    '''
+
+    def test_normal(self):
+        data_file = io.BytesIO(b'\x03\x0c\x01\x00\xff\xff\xff\xff\x45')
+        delimeter = b'\xff\xff\xff\xff'
+
+        packets = cpap_extraction.iter_packets(data_file, delimeter)
+        self.assertEqual(next(packets), b'\x03\x0c\x01\x00')
+        self.assertEqual(next(packets), b'\x45')
+        with self.assertRaises(StopIteration):
+            next(packets)
+
+    def test_lazy(self):
+        data_file = io.BytesIO(b'\x03\x0c\xff\xff\xff\xff' + b'\x45' * 64)
+        delimeter = b'\xff\xff\xff\xff'
+
+        packets = cpap_extraction.iter_packets(data_file, delimeter, 8)
+        self.assertEqual(next(packets), b'\x03\x0c')
+        self.assertEqual(data_file.tell(), 8)
+
+
+class TestReadMappedPackets(unittest.TestCase):
+    '''
+    Tests the open_mapped_file and read_mapped_packets methods, which
+    memory-map a data file, and yield its packets as memoryviews into the
+    mapping.
+
+    Methods
+    -------
+        testNormal
+            Tests that read_mapped_packets yields the same packets as
+            read_packets, and that they are memoryviews
+        testEmptyFile
+            Tests that open_mapped_file raises a ValueError for an empty file
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.005')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_normal(self):
+        with open(self.path, 'wb') as data_file:
+            data_file.write(b'\x03\x0c\x01\x00\xff\xff\xff\xff\x45')
+        delimeter = b'\xff\xff\xff\xff'
+
+        mapping = cpap_extraction.open_mapped_file(self.path)
+        packets = cpap_extraction.read_mapped_packets(mapping, delimeter)
+        for packet, correct_packet in zip(packets, [b'\x03\x0c\x01\x00',
+                                                    b'\x45']):
+            self.assertIsInstance(packet, memoryview)
+            self.assertEqual(packet, correct_packet)
+            packet.release()
+        mapping.close()
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        with self.assertRaises(ValueError):
+            cpap_extraction.open_mapped_file(self.path)
+
+
+class TestPacketIndex(unittest.TestCase):
+    '''
+    Tests the PacketIndex class, and open_index, which index where each
+    packet of a session file is, and the stretch of the session it covers.
+
+    Methods
+    -------
+        testBuild
+            Tests that each packet is found, and that the session is shared
+            out between the packets after the header by their length
+        testSeekPacket
+            Tests that each packet read through the index matches
+            read_packets
+        testPacketsBetween
+            Tests that only the packets overlapping a stretch of time are
+            yielded
+        testSidecar
+            Tests that a saved index loads back, and that it is rebuilt once
+            its session file changes
+        testIndexDir
+            Tests that indexes are kept in the index directory, not next to
+            their session file, and that session files with the same name
+            get their own index
+        testReadOnly
+            Tests that an index that can't be saved is still returned
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, '38611.005')
+        self.index_dir = os.path.join(self.directory.name, 'index')
+        patcher = patch.object(cpap_extraction, 'INDEX_DIR', self.index_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        packets = [make_header(start_time=1000000, end_time=1010000)]
+        packets += [bytes([i]) * 30 for i in range(1, 10)] + [b'\x0a' * 60]
+        with open(self.source, 'wb') as source:
+            source.write(b'\xff\xff\xff\xff'.join(packets))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_build(self):
+        index = cpap_extraction.PacketIndex.build(self.source)
+        self.assertEqual(len(index), 11)
+        self.assertEqual(list(index.lengths), [44] + [30] * 9 + [60])
+        self.assertEqual((index.starts[0], index.ends[0]), (1000000, 1010000))
+        self.assertEqual(list(index.starts[1:4]), [1000000, 1000909, 1001818])
+        self.assertEqual((index.starts[-1], index.ends[-1]),
+                         (1008181, 1010000))
+
+    def test_seek_packet(self):
+        index = cpap_extraction.PacketIndex.build(self.source)
+        with open(self.source, 'rb') as source:
+            packets = cpap_extraction.read_packets(source, b'\xff\xff\xff\xff')
+            self.assertEqual([index.seek_packet(i, source)
+                              for i in range(len(index))], packets)
+        self.assertEqual(index.seek_packet(-1), b'\x0a' * 60)
+
+    def test_packets_between(self):
+        index = cpap_extraction.PacketIndex.build(self.source)
+        packets = list(index.packets_between(1002000, 1003000))
+        self.assertEqual([i for (i, packet) in packets], [3, 4])
+        self.assertEqual([bytes(packet) for (i, packet) in packets],
+                         [b'\x03' * 30, b'\x04' * 30])
+        self.assertEqual(list(index.packets_between(0, 999999)), [])
+
+    def test_sidecar(self):
+        index = cpap_extraction.open_index(self.source)
+        path = cpap_extraction.index_sidecar(self.source)
+        self.assertTrue(os.path.isfile(path))
+
+        loaded = cpap_extraction.PacketIndex.load(path, self.source)
+        self.assertEqual(loaded.columns(), index.columns())
+
+        with open(self.source, 'ab') as source:
+            source.write(b'\xff\xff\xff\xff' + b'\x0b' * 30)
+        self.assertIsNone(cpap_extraction.PacketIndex.load(path, self.source))
+        self.assertEqual(len(cpap_extraction.open_index(self.source)), 12)
+
+    def test_index_dir(self):
+        other = os.path.join(self.directory.name, 'other', '38611.005')
+        os.makedirs(os.path.dirname(other))
+        with open(self.source, 'rb') as source, open(other, 'wb') as copy:
+            copy.write(source.read())
+
+        cpap_extraction.open_index(self.source)
+        cpap_extraction.open_index(other)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['38611.005', 'index', 'other'])
+        self.assertEqual(len(os.listdir(self.index_dir)), 2)
+        self.assertTrue(cpap_extraction.index_sidecar(
+            self.source).startswith(self.index_dir))
+
+    def test_read_only(self):
+        path = os.path.join(self.directory.name, 'file', 'index.idx')
+        open(os.path.join(self.directory.name, 'file'), 'w').close()
+        with self.assertWarns(Warning):
+            index = cpap_extraction.open_index(self.source, path)
+        self.assertEqual(len(index), 11)
+
+
+class TestQuery(unittest.TestCase):
+    '''
+    Tests parse_time, query_file and query_profile, which decode only the
+    samples of a profile between two times.
+
+    Methods
+    -------
+        testParseTime
+            Tests that UNIX times and each of TIME_FORMATS are parsed, as UTC
+        testQueryFile
+            Tests that only the samples in the window are decoded, each with
+            its time
+        testQueryEvents
+            Tests that events are timed by their Time offset, not spread over
+            their packet
+        testPruned
+            Tests that a session outside the window is pruned by its header
+            alone, without indexing it
+        testQueryProfile
+            Tests that every session file with samples is queried, and that a
+            file that can't be read is warned about and skipped
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profile = os.path.join(self.directory.name, 'PRS1_TEST')
+        os.makedirs(self.profile)
+        self.source = os.path.join(self.profile, '38611.005')
+        patcher = patch.object(cpap_extraction, 'INDEX_DIR',
+                               os.path.join(self.directory.name, 'index'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # 10 packets of 10 Flow, Pressure, Leak samples, 1 second each
+        packets = [make_header(start_time=1000000, end_time=1010000)]
+        packets += [bytes([i, 10, 20]) * 10 for i in range(10)]
+        with open(self.source, 'wb') as source:
+            source.write(b'\xff\xff\xff\xff'.join(packets))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parse_time(self):
+        self.assertEqual(cpap_extraction.parse_time('1553245673000'),
+                         1553245673000)
+        for text in ['2019-03-22_09-07-53', '2019-03-22T09:07:53',
+                     '2019-03-22 09:07:53']:
+            self.assertEqual(cpap_extraction.parse_time(text), 1553245673000)
+        self.assertEqual(cpap_extraction.parse_time('2019-03-22T09:07'),
+                         1553245620000)
+        with self.assertRaises(ValueError):
+            cpap_extraction.parse_time('yesterday')
+
+    def test_query_file(self):
+        result = cpap_extraction.query_file(self.source, 1002500, 1004000)
+        self.assertEqual(result.header.session_id, 1553245673)
+        self.assertEqual(result.times[0], 1002500)
+        self.assertEqual(result.times[-1], 1004000)
+        self.assertEqual(len(result.samples), 16)
+        self.assertEqual(result.samples['Flow'].tolist(),
+                         [2] * 5 + [3] * 10 + [4])
+
+    def test_query_events(self):
+        source = os.path.join(self.profile, '38611.002')
+        events = [struct.pack('<BHH', code, offset, 0)
+                  for code, offset in [(6, 1), (10, 2), (3, 9)]]
+        with open(source, 'wb') as data_file:
+            data_file.write(b'\xff\xff\xff\xff'.join(
+                [make_header(start_time=1000000, end_time=1010000),
+                 events[0] + events[1], events[2]]))
+
+        result = cpap_extraction.query_file(source, 1008000, 1010000)
+        self.assertEqual(result.times.tolist(), [1009000])
+        self.assertEqual(result.samples['Event code'].tolist(), [3])
+        result = cpap_extraction.query_file(source, 1002000, 1005000)
+        self.assertEqual(result.samples['Event code'].tolist(), [10])
+
+    def test_pruned(self):
+        self.assertIsNone(cpap_extraction.query_file(self.source, 0, 999999))
+        self.assertFalse(os.path.exists(
+            cpap_extraction.index_sidecar(self.source)))
+
+    def test_query_profile(self):
+        with open(os.path.join(self.profile, '38611.001'), 'wb') as source:
+            source.write(make_header())
+        with open(os.path.join(self.profile, '38612.005'), 'wb') as source:
+            source.write(b'\x01\x02')
+
+        with self.assertWarns(Warning):
+            results = list(cpap_extraction.query_profile(self.profile,
+                                                         1000000, 1000999))
+        self.assertEqual([result.source for result in results],
+                         [self.source])
+        self.assertEqual(len(results[0].samples), 10)
+
+
+class TestCompression(unittest.TestCase):
+    '''
+    Tests that compressed sessions, and archived copies of session files,
+    are decompressed as they are split into packets.
+
+    Methods
+    -------
+        testDecompressingReader
+            Tests that reads of any size, of a stream decompressed a small
+            chunk at a time, return the decompressed data
+        testCompressedSession
+            Tests that a session with its Compression field set is extracted
+            like the same session uncompressed
+        testArchives
+            Tests that .gz and .zst copies are found in a profile, and
+            extracted like the session file they are a copy of
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.body = b''.join(b'\xff\xff\xff\xff' + bytes([i, 1, 2]) * 10
+                             for i in range(20))
+        self.source = os.path.join(self.directory.name, '38611.005')
+        with open(self.source, 'wb') as source:
+            source.write(make_header() + self.body)
+
+        self.extractor = cpap_extraction.Extractor(
+            destination=self.directory.name, output_format='ndjson')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def extract(self, source):
+        with open(self.extractor.extract_file(source)) as output:
+            return [json.loads(line) for line in output]
+
+    def test_decompressing_reader(self):
+        import zlib
+
+        data = bytes(range(256)) * 100
+        reader = cpap_extraction.DecompressingReader(
+            io.BytesIO(zlib.compress(data)[5:]), zlib.decompressobj(),
+            zlib.compress(data)[:5], chunk_size=7)
+        self.assertEqual(reader.read(3), data[:3])
+        self.assertEqual(reader.read(1000), data[3:1003])
+        self.assertEqual(reader.read(), data[1003:])
+        self.assertEqual(reader.read(10), b'')
+
+    def test_compressed_session(self):
+        import zlib
+
+        expected = self.extract(self.source)
+        compressed = os.path.join(self.directory.name, '38612.005')
+        with open(compressed, 'wb') as source:
+            source.write(make_header(compression=1) + b'\xff\xff\xff\xff' +
+                         zlib.compress(self.body[4:]))
+
+        records = self.extract(compressed)
+        self.assertEqual(records[0]['Compression'], 1)
+        self.assertEqual(records[1:], expected[1:])
+
+        with self.assertRaises(ValueError):
+            cpap_extraction.PacketIndex.build(compressed)
+
+    def test_archives(self):
+        import gzip
+
+        expected = self.extract(self.source)
+        with open(self.source, 'rb') as source:
+            data = source.read()
+        os.remove(self.source)
+        archives = [self.source + '.gz']
+        with gzip.open(self.source + '.gz', 'wb') as archive:
+            archive.write(data)
+
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        if zstandard is not None:
+            archives.append(os.path.join(self.directory.name,
+                                         '38612.005.zst'))
+            with open(archives[-1], 'wb') as archive:
+                archive.write(zstandard.ZstdCompressor().compress(data))
+
+        sessions = cpap_extraction.find_sessions(self.directory.name)
+        self.assertEqual(sorted(sum(sessions.values(), [])), archives)
+        for archive in archives:
+            self.assertEqual(self.extract(archive), expected)
+
+
+class TestVerify(unittest.TestCase):
+    '''
+    Tests verify_file and verify_profile, which check the magic number and
+    CRC of session files without extracting them.
+
+    Methods
+    -------
+        testIntact
+            Tests that a file matching its CRC, a file without a CRC, and an
+            archived copy, have no problems
+        testCorrupt
+            Tests that a changed byte, a wrong magic number, and a file too
+            short to hold a header, are all reported
+        testCheckCrc
+            Tests that an Extractor with check_crc refuses a corrupt file
+        testVerifyProfile
+            Tests that every session file of a profile is verified on a pool
+            of worker processes
+    '''
+
+    def setUp(self):
+        import binascii
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.body = b''.join(b'\xff\xff\xff\xff' + bytes([i, 1, 2]) * 10
+                             for i in range(20))
+        self.crc = binascii.crc_hqx(self.body[4:],
+                                    cpap_extraction.CRC_INITIAL)
+        self.source = self.write('38611.005', make_header(crc=self.crc) +
+                                 self.body)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as session_file:
+            session_file.write(data)
+        return path
+
+    def test_intact(self):
+        import gzip
+
+        self.assertEqual(cpap_extraction.verify_file(self.source), [])
+        self.assertEqual(cpap_extraction.verify_file(
+            self.write('38612.005', make_header() + self.body)), [])
+
+        with gzip.open(self.source + '.gz', 'wb') as archive:
+            archive.write(make_header(crc=self.crc) + self.body)
+        self.assertEqual(cpap_extraction.verify_file(self.source + '.gz'), [])
+
+    def test_corrupt(self):
+        corrupt = self.body[:-1] + b'\x00'
+        problems = cpap_extraction.verify_file(
+            self.write('38612.005', make_header(crc=self.crc) + corrupt))
+        self.assertEqual(len(problems), 1)
+        self.assertIn('CRC', problems[0])
+
+        problems = cpap_extraction.verify_file(
+            self.write('38613.005', make_header(magic_number=1, crc=self.crc)
+                       + self.body))
+        self.assertEqual(len(problems), 1)
+        self.assertIn('magic number', problems[0])
+
+        self.assertEqual(len(cpap_extraction.verify_file(
+            self.write('38614.001', b'\x01\x02'))), 1)
+
+    def test_check_crc(self):
+        source = self.write('38612.005', make_header(crc=self.crc) +
+                            self.body[:-1] + b'\x00')
+        extractor = cpap_extraction.Extractor(
+            destination=self.directory.name, check_crc=True)
+        extractor.extract_file(self.source)
+        with self.assertRaises(ValueError):
+            extractor.extract_file(source)
+
+    def test_verify_profile(self):
+        self.write('38612.005', make_header(crc=self.crc) + self.body[:-1] +
+                   b'\x00')
+        self.write('38613.001', make_header())
+        results = sorted(cpap_extraction.verify_profile(
+            self.directory.name, 2, batch_size=1))
+        self.assertEqual([(os.path.basename(source), len(problems))
+                          for (source, problems, error) in results],
+                         [('38611.005', 0), ('38612.005', 1),
+                          ('38613.001', 0)])
+
+
+class TestResyncPackets(unittest.TestCase):
+    '''
+    Tests the resync_packets method, which splits a session file into
+    packets, skipping malformed packets rather than stopping at them.
+
+    Methods
+    -------
+        testIntact
+            Tests that an intact file is split like iter_packets, even when
+            delimeters straddle blocks
+        testStrayBytes
+            Tests that a delimeter written out too long only loses its stray
+            bytes, and that empty packets don't end the data
+        testResync
+            Tests that only a malformed packet is skipped, and that the
+            packets after it are kept, up to and after a later header
+        testHeaderRunIn
+            Tests that a header run into the packet before it is found, and
+            that only the bytes before it are skipped
+        testTruncated
+            Tests that a damaged first header, and a truncated last packet,
+            are skipped
+        testExtractor
+            Tests that an Extractor with resync extracts every intact packet
+            of a damaged file, and warns about what it skipped
+    '''
+    delimeter = b'\xff\xff\xff\xff'
+
+    def setUp(self):
+        self.header = make_header()
+        self.packets = [bytes([i, 1, 2]) * 4 for i in range(5)]
+
+    def split(self, data, block_size=None):
+        skipped = []
+        packets = list(cpap_extraction.resync_packets(
+            io.BytesIO(data), '38611.005', skipped=skipped,
+            block_size=block_size))
+        return packets, skipped
+
+    def test_intact(self):
+        data = self.delimeter.join([self.header] + self.packets)
+        for block_size in [5, 7, 64, None]:
+            self.assertEqual(self.split(data, block_size),
+                             ([self.header] + self.packets, []))
+
+    def test_stray_bytes(self):
+        data = (self.header + self.delimeter + self.packets[0] +
+                self.delimeter + b'\xff\xff' + self.packets[1] +
+                self.delimeter * 2 + self.packets[2])
+        (packets, skipped) = self.split(data, 5)
+        self.assertEqual(packets, [self.header] + self.packets[:3])
+        offset = len(self.header) + 4 + len(self.packets[0]) + 4
+        self.assertEqual(skipped, [(offset, offset + 2)])
+
+    def test_resync(self):
+        damaged = self.packets[1][:-1] + b'\x00\x00'
+        data = self.delimeter.join([self.header, self.packets[0], damaged,
+                                    self.packets[2], self.header] +
+                                   self.packets[3:])
+        (packets, skipped) = self.split(data, 7)
+        self.assertEqual(packets, [self.header, self.packets[0]] +
+                         self.packets[2:])
+
+        start = len(self.header) + 4 + len(self.packets[0]) + 4
+        self.assertEqual(skipped, [(start, start + len(damaged))])
+
+    def test_header_run_in(self):
+        damaged = self.packets[1][:-1] + self.header
+        data = self.delimeter.join([self.header, self.packets[0], damaged] +
+                                   self.packets[3:])
+        (packets, skipped) = self.split(data, 7)
+        self.assertEqual(packets, [self.header, self.packets[0]] +
+                         self.packets[3:])
+
+        start = len(self.header) + 4 + len(self.packets[0]) + 4
+        self.assertEqual(skipped, [(start, start + len(self.packets[1]) - 1)])
+
+    def test_truncated(self):
+        data = (b'\x00\x01' +
+                self.delimeter.join([self.header] + self.packets)[:-1])
+        (packets, skipped) = self.split(data)
+        self.assertEqual(packets, [self.header] + self.packets[:4])
+        self.assertEqual(skipped, [(0, 2), (len(data) - 11, len(data))])
+
+    def test_extractor(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, '38611.005')
+            with open(source, 'wb') as session_file:
+                session_file.write(self.delimeter.join(
+                    [self.header, self.packets[0], b'\x01\x02',
+                     self.packets[1]]))
+
+            extractor = cpap_extraction.Extractor(
+                destination=directory, output_format='ndjson', resync=True)
+            with self.assertWarns(Warning):
+                output = extractor.extract_file(source)
+            with open(output) as extracted:
+                records = [json.loads(line) for line in extracted]
+
+        self.assertEqual([record['Flow'][0] for record in records[1:]],
+                         [0, 1])
+        self.assertEqual(len(extractor.skipped), 1)
+
+
+class TestCompileFields(unittest.TestCase):
+    '''
+    Tests the compile_fields method, which compiles a dictionary of fields
+    into a single, cached, struct.Struct.
+
+    Methods
+    -------
+        testHeader
+            Tests that the header fields compile to '<IHHIIQQHHIHH'
+        testCached
+            Tests that compiling the same fields twice returns the same layout
+        testInvalidCType
+            Tests that compile_fields raises a ValueError for an unknown c_type
+    '''
+
+    def test_header(self):
+        layout = cpap_extraction.compile_fields(cpap_extraction.HEADER_FIELDS)
+        self.assertEqual(layout.format, '<IHHIIQQHHIHH')
+        self.assertEqual(layout.size, 44)
+
+    def test_cached(self):
+        fields = {'Test unsigned short': 'H', 'Test unsigned int': 'I'}
+        layout = cpap_extraction.compile_fields(fields)
+        self.assertIs(cpap_extraction.compile_fields(dict(fields)), layout)
+
+    def test_invalid_c_type(self):
+        with self.assertRaises(ValueError):
+            cpap_extraction.compile_fields({'Test invalid': 'z'})
+
+
+class TestUnpackFields(unittest.TestCase):
+    '''
+    Tests the unpack_fields method, which unpacks a packet into a dictionary
+    of {field name: value}, starting at an offset.
+    '''
+
+    def test_offset(self):
+        fields = {'Test unsigned short': 'H', 'Test unsigned int': 'I'}
+        packet = b'\x99\x2a\x00\xc3\x01\x00\x00'
+
+        values = cpap_extraction.unpack_fields(packet, fields, 1)
+        self.assertEqual(values, {'Test unsigned short': 42,
+                                  'Test unsigned int': 451})
+
 
 class TestExtractPacket(unittest.TestCase):
     '''
@@ -161,6 +866,508 @@ class TestExtractPacket(unittest.TestCase):
 
         self.assertEqual(extracted_packet, correct_output)
 
+    def test_memoryview(self):
+        fields = {'Test unsigned short': 'H',
+                  'Test unsigned int': 'I'}
+
+        input_file = memoryview(b'\x2a\x00\xc3\x01\x00\x00')
+
+        correct_output = ['Test unsigned short: 42\n',
+                          'Test unsigned int: 451\n']
+
+        extracted_packet = cpap_extraction.extract_packet(input_file, fields)
+
+        self.assertEqual(extracted_packet, correct_output)
+
+
+class TestRecords(unittest.TestCase):
+    '''
+    Tests the typed packet records, made by make_record_type, which hold the
+    unpacked values of a packet's fields, and format them only when asked.
+
+    Methods
+    -------
+        testDecodeHeader
+            Tests that a header packet decodes to a Header with integer fields
+        testLines
+            Tests that lines() matches extract_packet, with times converted
+        testIterUnpack
+            Tests unpacking a record for each sample in an event packet
+        testExtractHeader
+            Tests that extract_header returns the formatted header, and sets
+            start_time
+    '''
+
+    def test_decode_header(self):
+        header = cpap_extraction.decode_header(make_header())
+        self.assertIsInstance(header, cpap_extraction.Header)
+        self.assertEqual(header.start_time, 1553245673000)
+        self.assertEqual(header.machine_id, 1332405373)
+        self.assertEqual(header.as_dict()['Session ID'], 1553245673)
+
+    def test_lines(self):
+        packet = make_header()
+        lines = cpap_extraction.decode_header(packet).lines()
+        extracted = cpap_extraction.extract_packet(
+            packet, cpap_extraction.HEADER_FIELDS)
+
+        self.assertEqual(lines[5], 'Start time: 2019-03-22_09-07-53\n')
+        self.assertEqual(lines[6], 'End time: 2019-03-22_12-47-32\n')
+        self.assertEqual(lines[:5] + lines[7:], extracted[:5] + extracted[7:])
+
+    def test_iter_unpack(self):
+        events = list(cpap_extraction.Event.iter_unpack(
+            b'\x01\x2a\x00\x05\x00\x02\xc3\x01\x00\x00'))
+        self.assertEqual(events[1].event_code, 2)
+        self.assertEqual(events[0].time_offset, 42)
+        self.assertEqual(events[1].time_offset, 451)
+
+    @patch('cpap_extraction.start_time', 'INVALID START TIME')
+    def test_extract_header(self):
+        header = cpap_extraction.extract_header(make_header())
+        self.assertEqual(header[0], 'Magic number: 3341948587\n')
+        self.assertEqual(header[5], 'Start time: 2019-03-22_09-07-53\n')
+        self.assertEqual(cpap_extraction.start_time, '2019-03-22_09-07-53')
+
+
+class TestParsers(unittest.TestCase):
+    '''
+    Tests the FileParser registry, which finds the parser of each session
+    file from its extension and header.
+
+    Methods
+    -------
+        testFindParser
+            Tests that each session file type has a parser, and that unknown
+            types only get their header parsed
+        testPrecedence
+            Tests that a parser for the exact File type data and File
+            version is preferred over one for any header
+        testDispatch
+            Tests that extract_file splits and decodes a file with the
+            delimeter and fields of the parser its header dispatches to
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.parsers = dict(cpap_extraction.PARSERS)
+
+    def tearDown(self):
+        self.directory.cleanup()
+        cpap_extraction.PARSERS.clear()
+        cpap_extraction.PARSERS.update(self.parsers)
+
+    def test_find_parser(self):
+        self.assertEqual(cpap_extraction.find_parser('38611.001').name,
+                         'Summary')
+        self.assertEqual(cpap_extraction.find_parser('38611.002').fields,
+                         cpap_extraction.EVENT_FIELDS)
+        self.assertEqual(cpap_extraction.find_parser('.005').layout.size, 3)
+        self.assertIs(cpap_extraction.find_parser('notes.txt'),
+                      cpap_extraction.UNKNOWN_PARSER)
+
+    def test_precedence(self):
+        parser = cpap_extraction.register_parser(cpap_extraction.FileParser(
+            'Waveform 3', '.005', {'Flow': 'h'}, file_type=1,
+            file_version=3))
+        header = cpap_extraction.decode_header(make_header(file_version=3))
+        self.assertIs(cpap_extraction.find_parser('38611.005', header),
+                      parser)
+
+        header = cpap_extraction.decode_header(make_header(file_version=2))
+        self.assertEqual(cpap_extraction.find_parser('38611.005',
+                                                     header).name,
+                         'Waveform')
+
+    def test_dispatch(self):
+        cpap_extraction.register_parser(cpap_extraction.FileParser(
+            'Waveform 3', '.005', {'Flow': 'h'}, file_type=1,
+            file_version=3, delimeter=b'\xfe\xfe'))
+        source = os.path.join(self.directory.name, '38611.005')
+        with open(source, 'wb') as session_file:
+            session_file.write(make_header(file_version=3) + b'\xfe\xfe' +
+                               struct.pack('<hh', -2, 300))
+
+        extractor = cpap_extraction.Extractor(
+            destination=self.directory.name, output_format='ndjson')
+        with open(extractor.extract_file(source)) as output:
+            records = [json.loads(line) for line in output]
+        self.assertEqual(records[1]['Flow'], [-2, 300])
+
+
+class TestDecodeSamples(unittest.TestCase):
+    '''
+    Tests the decode_samples method, which decodes packets of fixed-width
+    samples into a NumPy structured array.
+
+    Methods
+    -------
+        testNormal
+            Tests decoding a single packet of two samples
+        testPackets
+            Tests that several packets are decoded together, and that the
+            dtype matches the struct layout of the same fields
+        testPartialSample
+            Tests that a warning is raised, and the partial sample ignored, if
+            a packet does not hold a whole number of samples
+    '''
+
+    fields = {'Test signed char': 'b', 'Test unsigned short': 'H'}
+
+    def test_normal(self):
+        samples = cpap_extraction.decode_samples(b'\xff\x2a\x00\x05\xc3\x01',
+                                                 self.fields)
+        self.assertEqual(samples['Test signed char'].tolist(), [-1, 5])
+        self.assertEqual(samples['Test unsigned short'].tolist(), [42, 451])
+
+    def test_packets(self):
+        packets = [bytearray(b'\xff\x2a\x00'), memoryview(b'\x05\xc3\x01')]
+        samples = cpap_extraction.decode_samples(packets, self.fields)
+        self.assertEqual(samples['Test unsigned short'].tolist(), [42, 451])
+        self.assertEqual(samples.dtype.itemsize,
+                         cpap_extraction.compile_fields(self.fields).size)
+
+    def test_partial_sample(self):
+        with self.assertWarns(Warning):
+            samples = cpap_extraction.decode_samples(b'\xff\x2a\x00\x05',
+                                                     self.fields)
+        self.assertEqual(len(samples), 1)
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestDecimate(unittest.TestCase):
+    '''
+    Tests decimate, which downsamples samples to buckets of a resolution.
+
+    Methods
+    -------
+        testMinMax
+            Tests that each bucket keeps its minimum and maximum, in the
+            order they occurred, so a one-sample peak survives
+        testMean
+            Tests that each bucket keeps its mean, timed at its middle
+        testRaggedBuckets
+            Tests that unevenly spaced times, and a partial last bucket, are
+            bucketed by time
+        testExtractor
+            Tests that the SQLite format stores the decimated samples
+        testEventsKept
+            Tests that events are never decimated, neither when stored nor
+            when queried
+    '''
+
+    def setUp(self):
+        import numpy
+
+        # 1000 samples, 10 ms apart, with a single spike
+        self.times = 1000000 + 10 * numpy.arange(1000, dtype=numpy.int64)
+        flow = numpy.zeros(1000, 'i1')
+        flow[123] = 100
+        flow[456] = -100
+        pressure = (numpy.arange(1000) % 50).astype('u1')
+        self.samples = numpy.rec.fromarrays(
+            [flow, pressure], names=['Flow', 'Pressure']).view(numpy.ndarray)
+
+    def test_min_max(self):
+        (times, samples) = cpap_extraction.decimate(self.times, self.samples,
+                                                    1000)
+        self.assertEqual(len(samples), 20)
+        self.assertEqual(times[:4].tolist(),
+                         [1000000, 1000990, 1001000, 1001990])
+        self.assertEqual(samples['Flow'][2:4].tolist(), [0, 100])
+        self.assertEqual(samples['Flow'][8:10].tolist(), [0, -100])
+        self.assertEqual(samples['Pressure'][:2].tolist(), [0, 49])
+        self.assertEqual(samples.dtype, self.samples.dtype)
+
+    def test_mean(self):
+        (times, samples) = cpap_extraction.decimate(self.times, self.samples,
+                                                    500, 'mean')
+        self.assertEqual(len(samples), 20)
+        self.assertEqual(times[0], 1000245)
+        self.assertAlmostEqual(samples['Pressure'][0], 24.5)
+        self.assertAlmostEqual(samples['Flow'][2], 2)
+
+        with self.assertRaises(ValueError):
+            cpap_extraction.decimate(self.times, self.samples, 500, 'lttb')
+
+    def test_ragged_buckets(self):
+        import numpy
+
+        times = numpy.array([0, 1, 2, 50, 150, 151], numpy.int64)
+        (decimated, samples) = cpap_extraction.decimate(
+            times, self.samples[:6], 100, 'mean')
+        self.assertEqual(decimated.tolist(), [25, 150])
+        self.assertEqual(samples['Pressure'].tolist(), [1.5, 4.5])
+
+    def test_extractor(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, '38611.005')
+            with open(source, 'wb') as data_file:
+                data_file.write(make_header(start_time=1000000,
+                                            end_time=1010000))
+                data_file.write(b'\xff\xff\xff\xff' +
+                                bytes([1, 10, 20]) * 99 + bytes([1, 90, 20]))
+
+            extractor = cpap_extraction.Extractor(
+                destination=directory, output_format='sqlite',
+                resolution=5000)
+            with cpap_extraction.SQLiteStore(
+                    extractor.extract_file(source)) as store:
+                self.assertEqual(store.connection.execute(
+                    'SELECT time, pressure FROM waveform').fetchall(),
+                    [(1000000, 10), (1004900, 10), (1005000, 10),
+                     (1009900, 90)])
+
+    def test_events_kept(self):
+        events = b''.join(struct.pack('<BHH', code, offset, 10)
+                          for offset, code in enumerate([6, 10, 3] * 10))
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, '38611.002')
+            with open(source, 'wb') as data_file:
+                data_file.write(make_header(start_time=1000000,
+                                            end_time=1010000))
+                data_file.write(b'\xff\xff\xff\xff' + events)
+
+            extractor = cpap_extraction.Extractor(
+                destination=directory, output_format='sqlite',
+                resolution=5000)
+            with cpap_extraction.SQLiteStore(
+                    extractor.extract_file(source)) as store:
+                self.assertEqual(store.connection.execute(
+                    'SELECT event_code, time_offset FROM events '
+                    'ORDER BY time').fetchall(),
+                    [(code, offset) for offset, code
+                     in enumerate([6, 10, 3] * 10)])
+
+            results = list(cpap_extraction.decimate_results(
+                cpap_extraction.query_profile(directory, 0, 2000000,
+                                              index_dir=directory), 5000))
+            self.assertEqual(len(results[0].samples), 30)
+
+
+class TestWriteColumnar(unittest.TestCase):
+    '''
+    Tests the write_columnar method, which writes a session file's header and
+    samples out as typed columns in a Parquet or Arrow IPC file.
+
+    Methods
+    -------
+        testParquet
+            Tests that the header and samples are written as typed columns, in
+            a single row group
+        testArrow
+            Tests writing an Arrow IPC file
+        testHeaderOnly
+            Tests that a file with no samples is written as a single row
+        testNoPackets
+            Tests that a file whose header has no packets is written as a
+            single row, with null sample columns
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.header = cpap_extraction.unpack_fields(
+            make_header(), cpap_extraction.HEADER_FIELDS)
+        self.samples = cpap_extraction.decode_samples(
+            b'\xff\x0a\x02\x05\x0b\x03', cpap_extraction.WAVEFORM_FIELDS)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parquet(self):
+        import pyarrow.parquet
+
+        output = cpap_extraction.write_columnar(
+            self.header, self.samples, self.directory.name, '.005')
+        self.assertTrue(output.endswith('2019-03-22_09-07-53.005.parquet'))
+
+        parquet_file = pyarrow.parquet.ParquetFile(output)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 1)
+
+        table = parquet_file.read(columns=['Session ID', 'Flow'])
+        self.assertEqual(table.column('Flow').to_pylist(), [-1, 5])
+        self.assertEqual(table.column('Session ID').to_pylist(),
+                         [1553245673, 1553245673])
+        self.assertEqual(table.schema.field('Session ID').type,
+                         pyarrow.uint32())
+
+    def test_arrow(self):
+        output = cpap_extraction.write_columnar(
+            self.header, self.samples, self.directory.name, '.005', 'arrow')
+
+        with pyarrow.OSFile(output, 'rb') as source:
+            table = pyarrow.ipc.open_file(source).read_all()
+        self.assertEqual(table.column('Pressure').to_pylist(), [10, 11])
+
+    def test_header_only(self):
+        import pyarrow.parquet
+
+        output = cpap_extraction.write_columnar(
+            self.header, None, self.directory.name, '.001')
+        table = pyarrow.parquet.read_table(output)
+        self.assertEqual(table.num_rows, 1)
+        self.assertEqual(table.column('Start time').to_pylist(),
+                         [1553245673000])
+
+    def test_no_packets(self):
+        import pyarrow.parquet
+
+        output = cpap_extraction.write_columnar(
+            self.header, self.samples[:0], self.directory.name, '.005')
+        table = pyarrow.parquet.read_table(output)
+        self.assertEqual(table.num_rows, 1)
+        self.assertEqual(table.column('Session ID').to_pylist(),
+                         [1553245673])
+        self.assertEqual(table.column('Flow').to_pylist(), [None])
+        self.assertEqual(table.schema.field('Flow').type, pyarrow.int8())
+
+
+class TestWriteJson(unittest.TestCase):
+    '''
+    Tests the iter_records and write_json methods, which stream the decoded
+    records of a session file out as JSON or newline-delimited JSON.
+
+    Methods
+    -------
+        testJson
+            Tests that a JSON array of records is written, with numeric
+            fields kept numeric
+        testNdjson
+            Tests that one record is written per line
+        testEmpty
+            Tests that no records are written as an empty JSON array
+        testWriteFailure
+            Tests that an error writing a memory-mapped session file out is
+            raised as is, rather than the mapping failing to close
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'output.json')
+        self.header = cpap_extraction.unpack_fields(
+            make_header(), cpap_extraction.HEADER_FIELDS)
+        self.packets = [b'\xff\x0a\x02', b'\x05\x0b\x03\x06\x0c\x04']
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_json(self):
+        records = cpap_extraction.iter_records(
+            self.header, self.packets, cpap_extraction.WAVEFORM_FIELDS)
+        cpap_extraction.write_json(records, self.output)
+
+        with open(self.output) as output:
+            records = json.load(output)
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]['Start time'], 1553245673000)
+        self.assertEqual(records[2], {'type': 'packet', 'index': 1,
+                                      'Flow': [5, 6], 'Pressure': [11, 12],
+                                      'Leak': [3, 4]})
+
+    def test_ndjson(self):
+        records = cpap_extraction.iter_records(
+            self.header, self.packets, cpap_extraction.WAVEFORM_FIELDS)
+        cpap_extraction.write_json(records, self.output, ndjson=True)
+
+        with open(self.output) as output:
+            lines = output.readlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[1])['Flow'], [-1])
+
+    def test_empty(self):
+        cpap_extraction.write_json([], self.output)
+        with open(self.output) as output:
+            self.assertEqual(json.load(output), [])
+
+    def test_write_failure(self):
+        source = os.path.join(self.directory.name, '38611.005')
+        with open(source, 'wb') as data_file:
+            data_file.write(b'\xff\xff\xff\xff'.join(
+                [make_header()] + self.packets))
+        extractor = cpap_extraction.Extractor(
+            destination=self.directory.name, use_mmap=True,
+            output_format='ndjson')
+
+        def dumps(record, **kwargs):
+            if record['type'] == 'packet':
+                raise OSError('No space left on device')
+            return '{}'
+
+        with patch('json.dumps', dumps):
+            with self.assertRaises(OSError):
+                extractor.extract_file(source)
+
+
+class TestSQLiteStore(unittest.TestCase):
+    '''
+    Tests the SQLite output format, which stores every session file in one
+    SQLiteStore.
+
+    Methods
+    -------
+        testStoreSession
+            Tests that the files of a session fill the sessions, events and
+            waveform tables, each event timed by its Time offset, and each
+            waveform sample spread over the session
+        testReextract
+            Tests that extracting a session file again replaces its samples
+        testSessionsBetween
+            Tests that only the sessions overlapping a window are found
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.extractor = cpap_extraction.Extractor(
+            destination=self.directory.name, output_format='sqlite')
+        self.sources = {}
+        events = struct.pack('<BHHBHH', 0x06, 0, 10, 0x0a, 7, 10)
+        waveform = bytes([1, 10, 20]) * 10
+        for extension, body in [('.001', b''), ('.002', events),
+                                ('.005', waveform)]:
+            source = os.path.join(self.directory.name, '38611' + extension)
+            with open(source, 'wb') as data_file:
+                data_file.write(make_header(start_time=1000000,
+                                            end_time=1010000))
+                if body:
+                    data_file.write(b'\xff\xff\xff\xff' + body)
+            self.sources[extension] = source
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def extract(self):
+        for source in self.sources.values():
+            output = self.extractor.extract_file(source)
+        return cpap_extraction.SQLiteStore(output)
+
+    def test_store_session(self):
+        with self.extract() as store:
+            query = store.connection.execute
+            self.assertEqual(query('SELECT * FROM sessions').fetchall(),
+                             [(1332405373, 1553245673, 1000000, 1010000, 2)])
+            self.assertEqual(
+                query('SELECT time, event_code, time_offset FROM events '
+                      'ORDER BY time').fetchall(),
+                [(1000000, 0x06, 0), (1007000, 0x0a, 7)])
+            self.assertEqual(
+                query('SELECT count(*), min(time), max(time), sum(pressure) '
+                      'FROM waveform').fetchone(),
+                (10, 1000000, 1009000, 100))
+
+    def test_reextract(self):
+        self.extract().close()
+        with self.extract() as store:
+            self.assertEqual(store.connection.execute(
+                'SELECT count(*) FROM waveform').fetchone(), (10,))
+            self.assertEqual(store.connection.execute(
+                'SELECT count(*) FROM sessions').fetchone(), (1,))
+
+    def test_sessions_between(self):
+        with self.extract() as store:
+            self.assertEqual(store.sessions_between(1009000, 2000000),
+                             [(1332405373, 1553245673, 1000000, 1010000)])
+            self.assertEqual(store.sessions_between(0, 999999), [])
+
 
 class TestConvertUnixTime(unittest.TestCase):
     '''
@@ -229,6 +1436,52 @@ class TestConvertUnixTime(unittest.TestCase):
         self.assertEqual(converted_time, 'ERROR: test is invalid\n')
 
 
+class TestConvertUnixTimes(unittest.TestCase):
+    '''
+    Tests the convert_unix_times method, which converts a whole array of UNIX
+    times, in milliseconds, to the format of convert_unix_time.
+
+    Methods
+    -------
+        testNormal
+            Tests that each time matches convert_unix_time, with extra
+            milliseconds dropped, for integer and float arrays
+        testWarnings
+            Tests that a batch with several times out of range only warns
+            once for each range
+        testBadArgument
+            Tests that a non-numeric array raises a TypeError
+    '''
+
+    def test_normal(self):
+        unixtimes = [842323380451, 1553245673000, 1553245673999]
+        expected = [cpap_extraction.convert_unix_time(unixtime)
+                    for unixtime in unixtimes]
+        self.assertEqual(
+            cpap_extraction.convert_unix_times(unixtimes).tolist(), expected)
+        self.assertEqual(cpap_extraction.convert_unix_times(
+            [float(unixtime) for unixtime in unixtimes]).tolist(), expected)
+
+    def test_warnings(self):
+        with self.assertWarns(Warning) as warned:
+            converted_times = cpap_extraction.convert_unix_times(
+                [0, -1, -1500, 842323380000])
+        self.assertIn('3 of 4', str(warned.warning))
+        self.assertEqual(converted_times.tolist(),
+                         ['1970-01-01_00-00-00', '1970-01-01_00-00-00',
+                          '1969-12-31_23-59-59', '1996-09-10_02-43-00'])
+
+        with self.assertWarns(Warning):
+            converted_times = cpap_extraction.convert_unix_times(
+                [2147483647000, 2147483647000])
+        self.assertEqual(converted_times.tolist(),
+                         ['2038-01-19_03-14-07'] * 2)
+
+    def test_bad_argument(self):
+        with self.assertRaises(TypeError):
+            cpap_extraction.convert_unix_times(['test'])
+
+
 class test_convert_time_string(unittest.TestCase):
     '''
     Tests the convert_time_string() method, which takes a string of the form
@@ -294,5 +1547,630 @@ class TestWriteFile(unittest.TestCase):
             cpap_extraction.write_file('', 'Any directory')
 
 
+def make_header(start_time=1553245673000, end_time=1553258852000,
+                **fields):
+    '''
+    Packs a header packet, as found at the start of a session file. Any field
+    of HEADER_FIELDS can be given as a keyword argument, with its spaces
+    replaced by underscores, e.g., session_id=1553245673
+    '''
+    values = {'Magic number': 3341948587,
+              'File version': 10,
+              'File type data': 1,
+              'Machine ID': 1332405373,
+              'Session ID': 1553245673,
+              'Start time': start_time,
+              'End time': end_time,
+              'Compression': 0,
+              'Machine type': 2,
+              'Data size': 46106,
+              'CRC': 0,
+              'MCSize': 4}
+    for field in values:
+        values[field] = fields.get(field.lower().replace(' ', '_'),
+                                   values[field])
+
+    return struct.pack('<IHHIIQQHHIHH', *values.values())
+
+
+class TestSessionWriter(unittest.TestCase):
+    '''
+    Tests the SessionWriter class, which keeps the outputs of a session open
+    and buffered, and only moves them into place once the session is closed.
+
+    Methods
+    -------
+        testWrite
+            Tests that sections are written, and only appear once closed
+        testAppend
+            Tests that an existing output is appended to, or replaced
+        testAbort
+            Tests that an exception leaves the existing output untouched, and
+            removes the temporary file
+        testFailedClose
+            Tests that if an output can't be moved into place, no temporary
+            files are left behind
+        testUmask
+            Tests that outputs are made with the umask of the process when
+            they are closed
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'session.txt')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_output(self):
+        with open(self.path) as output:
+            return output.read()
+
+    def test_write(self):
+        writer = cpap_extraction.SessionWriter(self.directory.name)
+        writer.write('session.txt', ['a: 1\n', 'b: 2\n'], 'header')
+        writer.write('session.txt', ['c: 3\n'])
+        self.assertFalse(os.path.exists(self.path))
+
+        self.assertEqual(writer.close(), [self.directory.name +
+                                          '/session.txt'])
+        self.assertEqual(self.read_output(),
+                         '---HEADER---\na: 1\nb: 2\nc: 3\n')
+        self.assertEqual(os.listdir(self.directory.name), ['session.txt'])
+
+    def test_append(self):
+        with open(self.path, 'w') as output:
+            output.write('old\n')
+
+        with cpap_extraction.SessionWriter(self.directory.name) as writer:
+            writer.write('session.txt', ['new\n'])
+        self.assertEqual(self.read_output(), 'old\nnew\n')
+
+        with cpap_extraction.SessionWriter(self.directory.name,
+                                           append=False) as writer:
+            writer.write('session.txt', ['new\n'])
+        self.assertEqual(self.read_output(), 'new\n')
+
+    def test_abort(self):
+        with open(self.path, 'w') as output:
+            output.write('old\n')
+
+        with self.assertRaises(ValueError):
+            with cpap_extraction.SessionWriter(self.directory.name) as writer:
+                writer.write('session.txt', ['new\n'])
+                raise ValueError
+
+        self.assertEqual(self.read_output(), 'old\n')
+        self.assertEqual(os.listdir(self.directory.name), ['session.txt'])
+
+    def test_failed_close(self):
+        writer = cpap_extraction.SessionWriter(self.directory.name)
+        writer.write('session.txt', ['a\n'])
+        writer.write('other.txt', ['b\n'])
+
+        with patch('os.replace', side_effect=OSError('Disk full')):
+            with self.assertRaises(OSError):
+                writer.close()
+        self.assertEqual(os.listdir(self.directory.name), [])
+        self.assertEqual(writer.outputs, {})
+
+    def test_umask(self):
+        umask = os.umask(0o027)
+        try:
+            with cpap_extraction.SessionWriter(self.directory.name) as writer:
+                writer.write('session.txt', ['a\n'])
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+
+
+class TestExtractProfile(unittest.TestCase):
+    '''
+    Tests the find_sessions and extract_profile methods, which find every
+    session file in a profile directory, and extract them on a pool of worker
+    processes.
+
+    Methods
+    -------
+        testFindSessions
+            Tests that session files are grouped by session, and that other
+            files are ignored
+        testExtractProfile
+            Tests that every session file is extracted, and that a file that
+            can't be extracted doesn't stop the rest of the profile
+        testManifest
+            Tests that extracted files are recorded by the fingerprint taken
+            before they were extracted, so a file modified while it was
+            extracted is extracted again
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profile = os.path.join(self.directory.name, 'PRS1_TEST')
+        self.destination = os.path.join(self.directory.name, 'output')
+        os.makedirs(os.path.join(self.profile, 'p0'))
+        os.makedirs(self.destination)
+
+        for name, data in [('38611.001', make_header()),
+                           ('38611.005', make_header() + b'\xff' * 4),
+                           ('38612.001', b'\x01\x02'),
+                           ('notes.txt', b'')]:
+            with open(os.path.join(self.profile, 'p0', name), 'wb') as file:
+                file.write(data)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find_sessions(self):
+        sessions = cpap_extraction.find_sessions(self.profile)
+        session = os.path.join(self.profile, 'p0', '38611')
+        self.assertEqual(sorted(sessions), [session, session[:-1] + '2'])
+        self.assertEqual(sessions[session], [session + '.001',
+                                             session + '.005'])
+
+    def test_extract_profile(self):
+        results = list(cpap_extraction.extract_profile(self.profile,
+                                                       self.destination, 2))
+        self.assertEqual(len(results), 3)
+
+        errors = [source for (source, output, error) in results if error]
+        self.assertEqual([os.path.basename(source) for source in errors],
+                         ['38612.001'])
+        self.assertEqual(os.listdir(self.destination),
+                         ['2019-03-22_09-07-53.txt'])
+
+    def test_manifest(self):
+        manifest = cpap_extraction.load_manifest(
+            os.path.join(self.destination, 'missing.json'))
+        source = os.path.join(self.profile, 'p0', '38611.005')
+        extractor = cpap_extraction.Extractor(destination=self.destination)
+        extract_file = cpap_extraction.Extractor.extract_file
+
+        def modify_while_extracting(self, extracted, writer=None):
+            output = extract_file(self, extracted, writer)
+            if extracted == source:
+                with open(source, 'ab') as data_file:
+                    data_file.write(b'\x00')
+            return output
+
+        # The worker processes are forked with the patch in place
+        with patch.object(cpap_extraction.Extractor, 'extract_file',
+                          modify_while_extracting):
+            results = list(extractor.extract_profile(self.profile, 1,
+                                                     manifest))
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len(manifest['files']), 2)
+        self.assertFalse(cpap_extraction.is_unchanged(manifest, source))
+        self.assertTrue(cpap_extraction.is_unchanged(
+            manifest, os.path.join(self.profile, 'p0', '38611.001')))
+
+
+class TestExtractor(unittest.TestCase):
+    '''
+    Tests the Extractor class, which carries its own configuration and
+    session state, so that several extractions can run at once.
+
+    Methods
+    -------
+        testConcurrent
+            Tests that Extractors in several threads each keep their own
+            start_time, and write their own output
+        testConcurrentSession
+            Tests that Extractors in several threads, appending the files of
+            one session to the same output, never lose each other's sections
+        testGlobalExtractor
+            Tests that the module functions still keep the global start_time
+        testVerboseNamesFile
+            Tests that verbose messages name the session file being
+            extracted, not the profile directory
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sources = []
+        for i in range(4):
+            source = os.path.join(self.directory.name, '{}.001'.format(i))
+            with open(source, 'wb') as data_file:
+                data_file.write(make_header(start_time=1553245673000 +
+                                            i * 3600000))
+            self.sources.append(source)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_concurrent(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        extractors = [cpap_extraction.Extractor(
+            destination=self.directory.name) for source in self.sources]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            outputs = list(executor.map(
+                lambda pair: pair[0].extract_file(pair[1]),
+                zip(extractors, self.sources)))
+
+        self.assertEqual(len(set(outputs)), 4)
+        self.assertEqual([extractor.start_time for extractor in extractors],
+                         ['2019-03-22_09-07-53', '2019-03-22_10-07-53',
+                          '2019-03-22_11-07-53', '2019-03-22_12-07-53'])
+        for output in outputs:
+            with open(output) as extracted:
+                self.assertEqual(extracted.read().count('---HEADER---'), 1)
+
+    def test_concurrent_session(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        sources = []
+        for extension in ['.001', '.002', '.005']:
+            source = os.path.join(self.directory.name, '38611' + extension)
+            with open(source, 'wb') as data_file:
+                data_file.write(make_header())
+            sources.append(source)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            for attempt in range(50):
+                destination = os.path.join(self.directory.name,
+                                           str(attempt))
+                os.makedirs(destination)
+                outputs = list(executor.map(
+                    lambda source: cpap_extraction.Extractor(
+                        destination=destination).extract_file(source),
+                    sources))
+
+                self.assertEqual(os.listdir(destination),
+                                 ['2019-03-22_09-07-53.txt'])
+                with open(outputs[0]) as extracted:
+                    self.assertEqual(
+                        extracted.read().count('---HEADER---'), 3)
+
+    @patch('cpap_extraction.start_time', 'INVALID START TIME')
+    def test_global_extractor(self):
+        cpap_extraction.extract_file(self.sources[0], self.directory.name)
+        self.assertEqual(cpap_extraction.start_time, '2019-03-22_09-07-53')
+        self.assertEqual(cpap_extraction.global_extractor().start_time,
+                         '2019-03-22_09-07-53')
+
+    def test_verbose_names_file(self):
+        extractor = cpap_extraction.Extractor(
+            'profile', self.directory.name, verbose=True)
+        with patch('builtins.print') as mock_print:
+            extractor.extract_file(self.sources[1])
+
+        mock_print.assert_any_call('Extracting header from {}'.format(
+            self.sources[1]))
+
+
+class TestIngestor(unittest.TestCase):
+    '''
+    Tests the Ingestor class, which watches an inbox directory, and extracts
+    each session file dropped into it once it is settled.
+
+    Methods
+    -------
+        testPoll
+            Tests that a freshly written file is only queued once it is
+            unchanged between polls, and is not queued again
+        testRun
+            Tests that every session file in the inbox is extracted, that
+            the files of a session share their output, and that a file that
+            can't be extracted is reported
+        testManifest
+            Tests that files recorded in the manifest are skipped, and that
+            extracted files are recorded
+        testReingest
+            Tests that ingesting the same inbox again replaces the text
+            output, rather than appending to it
+        testOnceUnsettled
+            Tests that once waits for freshly written files to settle,
+            rather than exiting without extracting them
+        testCoalesce
+            Tests that the files of a session queued together are extracted
+            in a single pass, rather than once per file
+        testVanished
+            Tests that a file removed from the inbox is forgotten, and left
+            out of its session
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.inbox = os.path.join(self.directory.name, 'inbox')
+        self.destination = os.path.join(self.directory.name, 'output')
+        os.makedirs(self.inbox)
+        os.makedirs(self.destination)
+
+        for name, data in [('38611.001', make_header()),
+                           ('38611.005', make_header() + b'\xff' * 4),
+                           ('38612.001', b'\x01\x02')]:
+            with open(os.path.join(self.inbox, name), 'wb') as file:
+                file.write(data)
+
+        self.results = []
+        self.extractor = cpap_extraction.Extractor(
+            destination=self.destination)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def ingest(self, manifest=None, settle=0):
+        from concurrent.futures import ThreadPoolExecutor
+
+        ingestor = ingest.Ingestor(
+            self.inbox, self.extractor, workers=2, interval=0.01,
+            settle=settle, manifest=manifest,
+            report=lambda *result: self.results.append(result))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            asyncio.run(ingestor.run(once=True, executor=executor))
+
+    def test_poll(self):
+        ingestor = ingest.Ingestor(self.inbox, self.extractor, settle=60)
+        self.assertEqual(ingestor.poll(), [])
+        self.assertEqual([os.path.basename(source)
+                          for source in ingestor.poll()],
+                         ['38611.001', '38611.005', '38612.001'])
+        self.assertEqual(ingestor.poll(), [])
+
+    def test_run(self):
+        self.ingest()
+        self.assertEqual(len(self.results), 3)
+
+        errors = [source for (source, output, error) in self.results
+                  if error]
+        self.assertEqual([os.path.basename(source) for source in errors],
+                         ['38612.001'])
+        self.assertEqual(os.listdir(self.destination),
+                         ['2019-03-22_09-07-53.txt'])
+        with open(os.path.join(self.destination,
+                               '2019-03-22_09-07-53.txt')) as output:
+            self.assertEqual(output.read().count('---HEADER---'), 2)
+
+    def test_manifest(self):
+        manifest = cpap_extraction.load_manifest(
+            os.path.join(self.directory.name, 'missing.json'))
+        source = os.path.join(self.inbox, '38611.001')
+        output = os.path.join(self.directory.name, 'output.txt')
+        open(output, 'w').close()
+        cpap_extraction.record_file(manifest, source, output)
+
+        self.ingest(manifest)
+        self.assertEqual(sorted(os.path.basename(result[0])
+                                for result in self.results),
+                         ['38611.005', '38612.001'])
+        self.assertIn(os.path.join(self.inbox, '38611.005'),
+                      manifest['files'])
+
+    def test_reingest(self):
+        self.ingest()
+        self.ingest()
+        with open(os.path.join(self.destination,
+                               '2019-03-22_09-07-53.txt')) as output:
+            self.assertEqual(output.read().count('---HEADER---'), 2)
+
+    def test_once_unsettled(self):
+        self.ingest(settle=60)
+        self.assertEqual(len(self.results), 3)
+        self.assertEqual(os.listdir(self.destination),
+                         ['2019-03-22_09-07-53.txt'])
+
+    def test_coalesce(self):
+        extracted = []
+        extract_file = cpap_extraction.Extractor.extract_file
+
+        def counting(extractor, source, *args, **kwargs):
+            extracted.append(os.path.basename(source))
+            return extract_file(extractor, source, *args, **kwargs)
+
+        with patch.object(cpap_extraction.Extractor, 'extract_file',
+                          counting):
+            self.ingest()
+        self.assertEqual(sorted(extracted),
+                         ['38611.001', '38611.005', '38612.001'])
+        self.assertEqual(len(self.results), 3)
+
+    def test_vanished(self):
+        ingestor = ingest.Ingestor(self.inbox, self.extractor, settle=0)
+        ingestor.poll()
+        source = os.path.join(self.inbox, '38611.001')
+        os.remove(os.path.join(self.inbox, '38611.005'))
+        ingestor.poll()
+        self.assertNotIn(os.path.join(self.inbox, '38611.005'),
+                         ingestor.queued)
+        self.assertEqual(ingestor.session_files(source), [source])
+
+
+class TestManifest(unittest.TestCase):
+    '''
+    Tests the manifest of extracted files, which lets extract_profile skip
+    sessions that haven't changed since they were last extracted.
+
+    Methods
+    -------
+        testUnchanged
+            Tests that a recorded file is unchanged, even if it was touched
+        testChanged
+            Tests that a modified file, and an unrecorded file, are changed
+        testOutputMissing
+            Tests that a file whose output is gone is changed
+        testSaveLoad
+            Tests that a saved manifest loads back, unless rebuild is True or
+            it was made by a different parser version
+        testSettings
+            Tests that a manifest made with other output settings, e.g., by
+            another Extractor output_format, is not trusted
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, '38611.001')
+        with open(self.source, 'wb') as source:
+            source.write(make_header())
+
+        self.output = os.path.join(self.directory.name, 'output.txt')
+        open(self.output, 'w').close()
+        self.manifest = cpap_extraction.load_manifest(
+            os.path.join(self.directory.name, 'missing.json'))
+        cpap_extraction.record_file(self.manifest, self.source, self.output)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_unchanged(self):
+        self.assertTrue(cpap_extraction.is_unchanged(self.manifest,
+                                                     self.source))
+        os.utime(self.source, ns=(0, 0))
+        self.assertTrue(cpap_extraction.is_unchanged(self.manifest,
+                                                     self.source))
+
+    def test_changed(self):
+        with open(self.source, 'r+b') as source:
+            source.write(b'\x00')
+        os.utime(self.source, ns=(0, 0))
+        self.assertFalse(cpap_extraction.is_unchanged(self.manifest,
+                                                      self.source))
+        self.assertFalse(cpap_extraction.is_unchanged(self.manifest,
+                                                      'another.001'))
+
+    def test_output_missing(self):
+        os.remove(self.output)
+        self.assertFalse(cpap_extraction.is_unchanged(self.manifest,
+                                                      self.source))
+
+    def test_save_load(self):
+        path = os.path.join(self.directory.name, 'manifest.json')
+        cpap_extraction.save_manifest(self.manifest, path)
+
+        self.assertEqual(cpap_extraction.load_manifest(path), self.manifest)
+        self.assertEqual(cpap_extraction.load_manifest(path, True)['files'],
+                         {})
+        with patch('cpap_extraction.PARSER_VERSION', 0):
+            self.assertEqual(cpap_extraction.load_manifest(path)['files'], {})
+
+    def test_settings(self):
+        path = os.path.join(self.directory.name, 'manifest.json')
+        text = cpap_extraction.Extractor().output_settings()
+        manifest = cpap_extraction.load_manifest(path, settings=text)
+        cpap_extraction.record_file(manifest, self.source, self.output)
+        cpap_extraction.save_manifest(manifest, path)
+
+        self.assertEqual(cpap_extraction.load_manifest(path, settings=text),
+                         manifest)
+        for settings in [{'output_format': 'json'}, {'resolution': 1000},
+                         {'resync': True}]:
+            other = cpap_extraction.Extractor(**settings).output_settings()
+            self.assertEqual(cpap_extraction.load_manifest(
+                path, settings=other)['files'], {})
+
+
+class TestSummary(unittest.TestCase):
+    '''
+    Tests the streaming statistics of summary, and the nightly summaries of a
+    profile.
+
+    Methods
+    -------
+        testRunningStats
+            Tests that batches, and merged statistics, give the mean and
+            variance of all their values at once
+        testByteHistogram
+            Tests that percentiles are exact, for unsigned and signed values
+        testSummarizeFile
+            Tests that the events and waveform samples of a session are
+            summarised in small batches
+        testSummarizeProfile
+            Tests that sessions are merged into nights, and formatted as the
+            summary table
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profile = os.path.join(self.directory.name, 'PRS1_TEST')
+        os.makedirs(self.profile)
+
+        # Two sessions on the night of 2019-03-21, of 1 and 2 hours, and one
+        # on the night of 2019-03-22
+        sessions = {'1': (1553220000000, 1553223600000),
+                    '2': (1553230000000, 1553237200000),
+                    '3': (1553320000000, 1553323600000)}
+        for name, (start, end) in sessions.items():
+            header = make_header(start_time=start, end_time=end)
+            events = struct.pack('<BHHBHHBHH', 0x06, 0, 10, 0x0a, 5, 10,
+                                 0x03, 9, 0)
+            waveform = b''.join(bytes([0, pressure, 20])
+                                for pressure in range(1, 101))
+            for extension, body in [('.002', events), ('.005', waveform)]:
+                with open(os.path.join(self.profile, name + extension),
+                          'wb') as source:
+                    source.write(b'\xff\xff\xff\xff'.join(
+                        [header, body[:150], body[150:]]))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_running_stats(self):
+        import numpy
+
+        values = numpy.arange(1000, dtype='f8') ** 1.5
+        stats = summary.RunningStats()
+        for batch in numpy.array_split(values, 7):
+            stats.add(batch)
+        self.assertEqual(stats.count, 1000)
+        self.assertAlmostEqual(stats.mean, values.mean())
+        self.assertAlmostEqual(stats.variance / values.var(ddof=1), 1)
+        self.assertEqual((stats.minimum, stats.maximum), (0, values.max()))
+
+        merged = summary.RunningStats()
+        merged.merge(stats)
+        merged.merge(summary.RunningStats())
+        self.assertEqual(merged.count, 1000)
+        self.assertAlmostEqual(merged.mean, stats.mean)
+
+    def test_byte_histogram(self):
+        import numpy
+
+        histogram = summary.ByteHistogram()
+        self.assertIsNone(histogram.percentile(50))
+        histogram.add(numpy.arange(1, 101, dtype='u1'))
+        self.assertEqual(histogram.percentile(50), 50)
+        self.assertEqual(histogram.percentile(95), 95)
+        self.assertEqual(histogram.percentile(0), 1)
+        self.assertEqual(histogram.percentile(100), 100)
+
+        signed = summary.ByteHistogram(signed=True)
+        signed.add(numpy.array([-128, -1, 127], dtype='i1'))
+        self.assertEqual(signed.percentile(50), -1)
+        self.assertEqual(signed.percentile(100), 127)
+
+    def test_summarize_file(self):
+        with patch('summary.BATCH_SIZE', 32):
+            result = summary.summarize_session(
+                [os.path.join(self.profile, '1.002'),
+                 os.path.join(self.profile, '1.005')])
+
+        self.assertEqual(result.sessions, 1)
+        self.assertEqual(result.hours, 1)
+        self.assertEqual(result.events, {0x03: 1, 0x06: 1, 0x0a: 1})
+        self.assertEqual(result.ahi(), 2)
+        self.assertEqual(result.stats['Pressure'].count, 100)
+        self.assertAlmostEqual(result.stats['Pressure'].mean, 50.5)
+        self.assertEqual(result.histograms['Pressure'].percentile(95), 95)
+        self.assertEqual(result.histograms['Leak'].percentile(50), 20)
+        self.assertEqual(result.histograms['Flow'].offset, -128)
+
+    def test_summarize_profile(self):
+        nights = summary.summarize_profile(self.profile, workers=1)
+        self.assertEqual([night for night, result in nights],
+                         ['2019-03-21', '2019-03-22'])
+        self.assertEqual(nights[0][1].sessions, 2)
+        self.assertEqual(nights[0][1].hours, 3)
+        self.assertEqual(nights[0][1].stats['Pressure'].count, 200)
+
+        rows = summary.summary_rows(nights)
+        self.assertEqual(rows[0]['AHI'], '1.33')
+        self.assertEqual(rows[0]['Pressure p95'], '95')
+        self.assertEqual(rows[1]['Usage (h)'], '1.00')
+        lines = summary.format_table(rows)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0].split()[:3], ['Night', 'Sessions', 'Usage'])
+
+
 if __name__ == '__main__':
     unittest.main()